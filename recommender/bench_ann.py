@@ -0,0 +1,67 @@
+# bench_ann.py — Recall vs latency: IVFIndex so với ExactIndex
+# Ví dụ:
+#   python bench_ann.py --items 300000 --factors 32 --queries 200 --k 12
+#   python bench_ann.py --artifacts artifacts      (dùng V thật từ als_model.npz)
+import argparse, time
+
+import numpy as np
+
+from similarity_index import ExactIndex, IVFIndex
+
+
+def synthetic_factors(n: int, d: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Item factors có cấu trúc cụm (gần giống ALS thật hơn Gaussian thuần)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, d)).astype(np.float32)
+    assign = rng.integers(0, clusters, size=n)
+    return (centers[assign] + 0.5 * rng.normal(size=(n, d))).astype(np.float32)
+
+
+def _time_queries(index, Q: np.ndarray, k: int):
+    lat, res = [], []
+    for q in Q:
+        t = time.perf_counter()
+        idx, _ = index.search(q, k)
+        lat.append((time.perf_counter() - t) * 1000.0)
+        res.append(idx)
+    return np.array(lat), res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=300000)
+    ap.add_argument("--factors", type=int, default=32)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--nprobe", type=str, default="1,4,8,16,32")
+    ap.add_argument("--artifacts", type=str, default=None)
+    args = ap.parse_args()
+
+    if args.artifacts:
+        V = np.load(f"{args.artifacts}/als_model.npz")["item_factors"].astype(np.float32)
+    else:
+        V = synthetic_factors(args.items, args.factors)
+    rng = np.random.default_rng(1)
+    Q = V[rng.choice(V.shape[0], size=min(args.queries, V.shape[0]), replace=False)]
+    print(f"[INFO] items={V.shape[0]} factors={V.shape[1]} queries={Q.shape[0]} k={args.k}")
+
+    exact = ExactIndex(V)
+    lat_e, truth = _time_queries(exact, Q, args.k)
+    print(f"{'exact':>12} | recall=1.000 | p50={np.percentile(lat_e, 50):7.3f}ms p99={np.percentile(lat_e, 99):7.3f}ms")
+
+    t = time.perf_counter()
+    ivf = IVFIndex.build(V, nlist=args.nlist)
+    print(f"[INFO] IVF build: nlist={ivf.centroids.shape[0]} in {time.perf_counter() - t:.2f}s")
+
+    for nprobe in (int(x) for x in args.nprobe.split(",")):
+        ivf.nprobe = nprobe
+        lat, res = _time_queries(ivf, Q, args.k)
+        recall = np.mean([len(np.intersect1d(a, b)) / max(len(b), 1) for a, b in zip(res, truth)])
+        print(f"{'ivf/' + str(nprobe):>12} | recall={recall:.3f} | "
+              f"p50={np.percentile(lat, 50):7.3f}ms p99={np.percentile(lat, 99):7.3f}ms | "
+              f"speedup(p50)={np.percentile(lat_e, 50) / max(np.percentile(lat, 50), 1e-9):5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
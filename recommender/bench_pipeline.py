@@ -0,0 +1,251 @@
+# bench_pipeline.py — Benchmark end-to-end trên dữ liệu giả lập (synth_data.py):
+#   generate → export_interactions (full / stream) → train_als → serve_api (/recommend/user, /recommend/similar)
+# Báo cáo: thời gian + peak RSS mỗi stage, throughput export, p50/p90/p99 API. Không cần DB production.
+# Ví dụ:
+#   python bench_pipeline.py --mock --users 5000 --movies 3000 --series 500 --json bench.json
+#   python bench_pipeline.py --mongo-url mongodb://localhost:27017 --db Movie-web-bench --users 100000 --drop
+#   python bench_pipeline.py --mock --baseline bench.json --tolerance 0.25   # exit 1 nếu chậm/tốn RAM hơn baseline
+import argparse, contextlib, importlib, io, json, os, resource, socket, sys, tempfile, threading, time, tracemalloc
+from typing import Dict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+# Metric so với baseline: True = càng cao càng tốt
+METRICS = {"sec": False, "rss_peak_mb": False, "py_peak_mb": False, "docs_per_sec": True,
+           "p50": False, "p90": False, "p99": False, "rps": True}
+
+
+def _reset_rss_peak() -> bool:
+    """Linux: reset VmHWM để đo peak RSS theo từng stage."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _mongomock_convert():
+    """mongomock 4.x chưa có $convert (export stream mode ép progressPct sang double) → thêm to: "double"."""
+    from mongomock import aggregate
+    orig = aggregate._Parser._handle_type_convertion_operator
+
+    def handle(self, operator, values):
+        if operator != "$convert" or values.get("to") != "double":
+            return orig(self, operator, values)
+        try:
+            v = self.parse(values["input"])
+        except KeyError:
+            v = None
+        if v is None:
+            return values.get("onNull")
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return values.get("onError")
+
+    aggregate._Parser._handle_type_convertion_operator = handle
+
+
+def _rss_peak_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KB trên Linux
+
+
+class Stage:
+    """with Stage("train", res): ... → res["train"] = {sec, rss_peak_mb, py_peak_mb?}."""
+
+    def __init__(self, name: str, results: Dict[str, dict], trace: bool = False, quiet: bool = True):
+        self.name, self.results, self.trace, self.quiet = name, results, trace, quiet
+        self.out = io.StringIO()
+
+    def __enter__(self):
+        self.per_stage_rss = _reset_rss_peak()
+        if self.trace:
+            tracemalloc.start()
+        self._redirect = contextlib.redirect_stdout(self.out) if self.quiet else contextlib.nullcontext()
+        self._redirect.__enter__()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        sec = time.perf_counter() - self.t0
+        self._redirect.__exit__(*exc)
+        r = {"sec": round(sec, 3), "rss_peak_mb": round(_rss_peak_mb(), 1)}
+        if not self.per_stage_rss:
+            r["rss_cumulative"] = True  # không reset được VmHWM → peak của cả process tới lúc này
+        if self.trace:
+            r["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+        self.results[self.name] = r
+        print(f"[INFO] {self.name:<14} {sec:8.2f}s  peak RSS {r['rss_peak_mb']:8.1f} MB"
+              + (f"  py peak {r['py_peak_mb']:.1f} MB" if self.trace else ""))
+        if exc[0] is not None and self.quiet:
+            print(self.out.getvalue()[-4000:])
+        return False
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _bench_api(args, users, items) -> Dict[str, dict]:
+    """serve_api chạy uvicorn trong thread (cùng process → dùng chung mongomock), đo bằng loadtest_api."""
+    import random
+    import uvicorn
+    import serve_api
+    from loadtest_api import run_target
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(serve_api.app, host="127.0.0.1", port=port, log_level="warning"))
+    t = threading.Thread(target=server.run, daemon=True)
+    t.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        weights = {k: int(v) for k, v in (p.split("=") for p in args.mix.split(","))}
+        plan = random.Random(args.seed).choices(list(weights), weights=list(weights.values()), k=args.requests)
+        return run_target(f"http://127.0.0.1:{port}", plan, users, items, args)
+    finally:
+        server.should_exit = True
+        t.join(timeout=10)
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """[(metric path, baseline, hiện tại)] của các chỉ số tệ hơn baseline quá tolerance."""
+    bad = []
+    for section in ("stages", "api"):
+        for name, cur in results.get(section, {}).items():
+            base = baseline.get(section, {}).get(name) or {}
+            for k, higher_better in METRICS.items():
+                b, c = base.get(k), cur.get(k)
+                if not b or c is None:
+                    continue
+                worse = c < b * (1 - tolerance) if higher_better else c > b * (1 + tolerance)
+                if worse:
+                    bad.append((f"{section}.{name}.{k}", b, c))
+    return bad
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="End-to-end benchmark: export, train, API on synthetic data")
+    ap.add_argument("--mock", action="store_true", help="in-memory mongomock thay cho mongod")
+    ap.add_argument("--mongo-url", type=str, default=os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    ap.add_argument("--db", type=str, default="Movie-web-bench")
+    ap.add_argument("--drop", action="store_true", help="xoá các collection trong --db trước khi generate")
+    ap.add_argument("--skip-generate", action="store_true", help="dùng dữ liệu có sẵn trong --db")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--movies", type=int, default=1500)
+    ap.add_argument("--series", type=int, default=300)
+    ap.add_argument("--events", type=float, default=20.0, help="mean playback rows per user")
+    ap.add_argument("--item-zipf", type=float, default=1.1)
+    ap.add_argument("--export-modes", type=str, default="full,stream")
+    ap.add_argument("--train-args", type=str, default="", help='vd. "--threads 4 --early-stop loss"')
+    ap.add_argument("--workdir", type=str, default=None, help="thư mục artifacts (mặc định: temp dir)")
+    ap.add_argument("--requests", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--warmup", type=int, default=50)
+    ap.add_argument("--mix", type=str, default="user=6,similar=3,cold=1")
+    ap.add_argument("--n", type=int, default=8)
+    ap.add_argument("--batch", type=int, default=20)
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--trace-malloc", action="store_true", help="thêm peak heap Python (tracemalloc, chậm hơn)")
+    ap.add_argument("--verbose", action="store_true", help="không ẩn log của export/train")
+    ap.add_argument("--json", type=str, default=None, help="ghi kết quả ra file")
+    ap.add_argument("--baseline", type=str, default=None, help="so với kết quả cũ (--json của lần trước)")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    if args.db == "Movie-web" and not args.mock:
+        raise SystemExit("[ERROR] refusing to benchmark against DB_NAME=Movie-web")
+
+    # Env phải set trước khi import export_interactions / serve_api (đọc config lúc import)
+    os.environ.update({"MONGO_URL": args.mongo_url, "DB_NAME": args.db, "MODEL_WATCH_SECONDS": "0"})
+    if args.mock:
+        import mongomock, pymongo
+        _client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *a, **k: _client
+        _mongomock_convert()
+    from pymongo import MongoClient
+    import synth_data
+
+    cwd0 = os.getcwd()  # --json/--baseline tương đối theo thư mục gọi lệnh
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # export/train/serve đọc-ghi ./artifacts
+    print(f"[INFO] backend={'mongomock' if args.mock else args.mongo_url} db={args.db} workdir={workdir}")
+
+    db = MongoClient(args.mongo_url)[args.db]
+    results: Dict[str, dict] = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+                                "stages": {}, "api": {}}
+    stages = results["stages"]
+    quiet = not args.verbose
+
+    if not args.skip_generate:
+        if args.drop:
+            for c in ("playback_state", "users", "movies", "series"):
+                db.drop_collection(c)
+        with Stage("generate", stages, args.trace_malloc, quiet):
+            counts = synth_data.generate(db, users=args.users, movies=args.movies, series=args.series,
+                                         events=args.events, item_zipf=args.item_zipf, seed=args.seed)
+        results["data"] = counts
+        print(f"[INFO] data: {counts}")
+    src_docs = db.playback_state.estimated_document_count() + db.users.estimated_document_count() \
+        + db.movies.estimated_document_count() + db.series.estimated_document_count()
+
+    import export_interactions
+    for mode in [m for m in args.export_modes.split(",") if m]:
+        with Stage(f"export_{mode}", stages, args.trace_malloc, quiet):
+            export_interactions.main(["--mode", mode])
+        stages[f"export_{mode}"]["docs_per_sec"] = round(src_docs / max(stages[f"export_{mode}"]["sec"], 1e-9), 1)
+
+    import train_als
+    with Stage("train", stages, args.trace_malloc, quiet):
+        results["train_meta"] = train_als.main(args.train_args.split())
+
+    with open("artifacts/user_id_map.json", "r", encoding="utf-8") as f:
+        users = json.load(f)["users"]
+    with open("artifacts/item_id_map.json", "r", encoding="utf-8") as f:
+        items = json.load(f)["items"]
+    results["data"] = dict(results.get("data", {}), model_users=len(users), model_items=len(items))
+
+    with Stage("api_startup", stages, args.trace_malloc, quiet):
+        importlib.import_module("serve_api")  # load model + registry lúc import
+    results["api"] = _bench_api(args, users, items)
+
+    # === Report ===
+    fmt = lambda v: f"{v:8.2f}" if v is not None else "       -"
+    for kind, r in results["api"].items():
+        print(f"{kind:>8} | n={r['n']:6d} err={r['errors']:4d} | p50={fmt(r['p50'])}ms "
+              f"p90={fmt(r['p90'])}ms p99={fmt(r['p99'])}ms" + (f" | {r['rps']:8.1f} req/s" if r["rps"] else ""))
+    for name, r in stages.items():
+        if "docs_per_sec" in r:
+            print(f"[INFO] {name}: {r['docs_per_sec']:,.0f} source docs/s")
+
+    if args.json:
+        with open(os.path.join(cwd0, args.json), "w") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"[INFO] Saved {args.json}")
+
+    if args.baseline:
+        with open(os.path.join(cwd0, args.baseline), "r", encoding="utf-8") as f:
+            bad = compare(results, json.load(f), args.tolerance)
+        for k, b, c in bad:
+            print(f"[WARN] regression {k}: {b} → {c}")
+        if bad:
+            sys.exit(1)
+        print(f"[INFO] no regression vs {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
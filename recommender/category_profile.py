@@ -0,0 +1,166 @@
+# category_profile.py — Category id per item + category-preference vector per user
+# Thay cho _user_profile_categories() (find_one theo từng likedItem mỗi request):
+#   artifacts/category_profile.npz
+#     categories : tên category (lowercase), vị trí = category id
+#     item_cat   : int32 (num_items,)  category id theo item index, -1 = không có
+#     indptr / cat_idx / weight : CSR (num_users × num_categories), trọng số đã chuẩn hoá
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from bson import ObjectId
+from scipy.sparse import csr_matrix
+
+PROFILE_PATH = "category_profile.npz"
+
+
+def norm_category(c) -> str:
+    return (c or "").strip().lower() if isinstance(c, str) else ""
+
+
+def load_item_categories(db, items: List[str], movies_col: str = "movies", series_col: str = "series",
+                         chunk: int = 5000) -> List[str]:
+    """Category string cho từng item key ("movie:<id>"/"series:<id>"), query $in theo lô."""
+    by_key: Dict[str, str] = {}
+    for kind, col in (("movie", movies_col), ("series", series_col)):
+        oids = []
+        for k in items:
+            kk, _, oid = k.partition(":")
+            if kk == kind and ObjectId.is_valid(oid):
+                oids.append(ObjectId(oid))
+        for s in range(0, len(oids), chunk):
+            for d in db[col].find({"_id": {"$in": oids[s:s + chunk]}}, {"category": 1}):
+                by_key[f"{kind}:{d['_id']}"] = norm_category(d.get("category"))
+    return [by_key.get(k, "") for k in items]
+
+
+class CategoryProfile:
+    def __init__(self, categories: List[str], item_cat: np.ndarray,
+                 indptr: np.ndarray, cat_idx: np.ndarray, weight: np.ndarray):
+        self.categories = list(categories)
+        self.index = {c: j for j, c in enumerate(self.categories)}
+        self.item_cat = item_cat
+        self.indptr = indptr
+        self.cat_idx = cat_idx
+        self.weight = weight
+
+    @classmethod
+    def build(cls, item_categories: List[str], uu: np.ndarray, ii: np.ndarray, w: np.ndarray,
+              num_users: int) -> "CategoryProfile":
+        """
+        item_categories: category string theo item index ("" = không có)
+        (uu, ii, w): tương tác dùng làm tín hiệu sở thích (watch + like)
+        """
+        categories = sorted({c for c in item_categories if c})
+        index = {c: j for j, c in enumerate(categories)}
+        item_cat = np.array([index.get(c, -1) for c in item_categories], dtype=np.int32)
+
+        # (users × items) @ one-hot(items × categories) → tổng trọng số theo category
+        c = item_cat[ii] if ii.size else np.empty(0, dtype=np.int32)
+        ok = (c >= 0) & (w > 0)
+        M = csr_matrix((w[ok].astype(np.float32), (uu[ok], c[ok])),
+                       shape=(num_users, max(len(categories), 1)))
+        M.sum_duplicates()
+        M.eliminate_zeros()
+        tot = np.asarray(M.sum(axis=1)).ravel()
+        M = csr_matrix(M.multiply(1.0 / np.maximum(tot, 1e-12)[:, None]))
+        M.sort_indices()
+        return cls(categories, item_cat, M.indptr.astype(np.int64),
+                   M.indices.astype(np.int32), M.data.astype(np.float32))
+
+    def save(self, path: str):
+        np.savez(path, categories=np.array(self.categories, dtype=np.str_), item_cat=self.item_cat,
+                 indptr=self.indptr, cat_idx=self.cat_idx, weight=self.weight)
+
+    @classmethod
+    def load(cls, path: str, num_users: int, num_items: int) -> "CategoryProfile":
+        d = np.load(path)
+        if d["indptr"].shape[0] != num_users + 1 or d["item_cat"].shape[0] != num_items:
+            raise RuntimeError("category profile/Model mismatch")
+        return cls(d["categories"].tolist(), d["item_cat"], d["indptr"], d["cat_idx"], d["weight"])
+
+    @property
+    def num_categories(self) -> int:
+        return len(self.categories)
+
+    def user_weights(self, uidx: int):
+        a, b = int(self.indptr[uidx]), int(self.indptr[uidx + 1])
+        return self.cat_idx[a:b], self.weight[a:b]
+
+    def user_names(self, uidx: int) -> Set[str]:
+        return {self.categories[j] for j in self.user_weights(uidx)[0]}
+
+    def mask_for(self, cats: Optional[Iterable[int]]) -> np.ndarray:
+        """
+        allowed[c + 1] cho category id c (cột 0 ứng với -1 = không có category).
+        Không có sở thích → cho phép tất cả (giống hành vi cũ: pref rỗng = không lọc).
+        """
+        cats = np.fromiter(cats if cats is not None else (), dtype=np.int64)
+        if not cats.size:
+            return np.ones(self.num_categories + 1, dtype=bool)
+        allowed = np.zeros(self.num_categories + 1, dtype=bool)
+        allowed[cats + 1] = True
+        return allowed
+
+    def mask_for_names(self, names: Set[str]) -> np.ndarray:
+        """Như mask_for nhưng từ tên category (user chưa có trong profile)."""
+        if not names:
+            return self.mask_for(None)
+        allowed = np.zeros(self.num_categories + 1, dtype=bool)
+        allowed[np.array(self.ids_for(names), dtype=np.int64) + 1] = True
+        return allowed
+
+    def user_mask(self, uidx: int) -> np.ndarray:
+        return self.mask_for(self.user_weights(uidx)[0])
+
+    def users_mask(self, uidxs: np.ndarray) -> np.ndarray:
+        """(B, num_categories + 1) allowed matrix cho một batch user."""
+        B = uidxs.shape[0]
+        a, b = self.indptr[uidxs], self.indptr[uidxs + 1]
+        lens = (b - a).astype(np.int64)
+        allowed = np.zeros((B, self.num_categories + 1), dtype=bool)
+        rows = np.repeat(np.arange(B), lens)
+        pos = np.repeat(a - np.r_[0, np.cumsum(lens)[:-1]], lens) + np.arange(lens.sum())
+        allowed[rows, self.cat_idx[pos] + 1] = True
+        allowed[lens == 0] = True
+        return allowed
+
+    def filter(self, idx: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+        """Giữ các item index có category được phép (vectorized)."""
+        return idx[allowed[self.item_cat[idx] + 1]]
+
+    def ids_for(self, names: Iterable[str]) -> List[int]:
+        return [self.index[c] for c in names if c in self.index]
+
+    def stats(self) -> dict:
+        return {"categories": self.num_categories, "users": int(self.indptr.shape[0] - 1),
+                "items": int(self.item_cat.shape[0]), "entries": int(self.cat_idx.shape[0])}
+
+
+def build_category_profile(db, users: List[str], items: List[str], uu: np.ndarray, ii: np.ndarray,
+                           w: np.ndarray, art_dir: str = "artifacts", **cols) -> CategoryProfile:
+    prof = CategoryProfile.build(load_item_categories(db, items, **cols), uu, ii, w, len(users))
+    prof.save(os.path.join(art_dir, PROFILE_PATH))
+    return prof
+
+
+if __name__ == "__main__":
+    # Dựng lại category_profile.npz từ artifacts/ hiện có (không cần export lại)
+    import sys, json
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+    from interactions_io import load_interactions
+
+    load_dotenv()
+    art = sys.argv[1] if len(sys.argv) > 1 else "artifacts"
+    _db = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))[os.getenv("DB_NAME", "Movie-web")]
+    with open(os.path.join(art, "user_id_map.json"), "r", encoding="utf-8") as f:
+        _users = json.load(f)["users"]
+    with open(os.path.join(art, "item_id_map.json"), "r", encoding="utf-8") as f:
+        _items = json.load(f)["items"]
+    _c = load_interactions(art, parts=True)
+    _p = build_category_profile(_db, _users, _items, _c["user_idx"], _c["item_idx"],
+                                _c["parts"][:, 0] + _c["parts"][:, 1], art,
+                                movies_col=os.getenv("MOVIES_COLLECTION", "movies"),
+                                series_col=os.getenv("SERIES_COLLECTION", "series"))
+    print(f"[INFO] Saved {art}/{PROFILE_PATH}: {_p.stats()}")
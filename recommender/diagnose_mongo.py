@@ -1,24 +1,33 @@
-import os
+import os, time
 from pymongo import MongoClient
 from pymongo.errors import ServerSelectionTimeoutError, ConfigurationError
 
+from mongo_client import pool_options
+
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME   = os.getenv("DB_NAME", "movieapp")
+DB_NAME   = os.getenv("DB_NAME", "Movie-web")
+COLLECTIONS = [os.getenv("WATCH_COLLECTION", "playback_state"), os.getenv("USERS_COLLECTION", "users"),
+               os.getenv("MOVIES_COLLECTION", "movies"), os.getenv("SERIES_COLLECTION", "series")]
 
 print(f"[INFO] MONGO_URL={MONGO_URL}")
 print(f"[INFO] DB_NAME={DB_NAME}")
 
 try:
-    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
-    print("[INFO] server_info:", client.server_info())  # force connection
+    client = MongoClient(MONGO_URL, **dict(pool_options(), serverSelectionTimeoutMS=5000))
+    info = client.server_info()  # force connection
+    print(f"[INFO] server: {info.get('version')}")
+    t = time.perf_counter()
+    client.admin.command("ping")
+    print(f"[INFO] ping: {(time.perf_counter() - t) * 1000:.1f} ms | pool: {pool_options()}")
     db = client[DB_NAME]
     cols = db.list_collection_names()
     print("[INFO] Collections:", cols)
-    if "watch_history" not in cols:
-        print("[WARN] Collection 'watch_history' không tồn tại trong DB này.")
-    else:
-        cnt = db.watch_history.estimated_document_count()
-        print(f"[INFO] watch_history documents ≈ {cnt}")
+    for name in COLLECTIONS:
+        if name not in cols:
+            print(f"[WARN] Collection '{name}' không tồn tại trong DB này.")
+        else:
+            print(f"[INFO] {name} documents ≈ {db[name].estimated_document_count()}")
+    print("[NEXT] Kiểm tra tham chiếu hỏng toàn DB: python mongo_check.py")
 except (ServerSelectionTimeoutError, ConfigurationError) as e:
     print("[ERROR] Không kết nối được MongoDB.")
     print(e)
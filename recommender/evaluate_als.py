@@ -0,0 +1,330 @@
+# evaluate_als.py — Đánh giá offline trước khi promote model
+#   Time split: mỗi user giữ lại --holdout tương tác mới nhất (theo playback_state.lastActionAt),
+#   train ALS trên phần còn lại, chấm P@k / R@k / NDCG@k trên toàn bộ user có holdout (không sample).
+#   Trọng số export (WATCH_*, LIKE_WEIGHT, RATING_WEIGHT_MULT) quét được mà không cần export lại:
+#   điểm watch dựng lại từ số lượt finished / >=50% / còn lại của từng cặp (user, item).
+# Ví dụ:
+#   python evaluate_als.py                                          # tham số hiện tại (train_meta.json) + popularity
+#   python evaluate_als.py --grid factors=32,64 regularization=0.02,0.1 alpha=15,40 --workers 4
+#   python evaluate_als.py --grid like_weight=1,2.5,4 watch_finished=3,5 --k 10,20 --json eval.json
+import os, json, time, argparse, datetime, itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from pymongo import MongoClient
+
+from export_interactions import (MONGO_URL, DB_NAME, WATCH_COL, WATCH_FINISHED, WATCH_HALF_OR_MORE,
+                                 WATCH_MIN_SIGNAL, LIKE_WEIGHT, RATING_WEIGHT_MULT,
+                                 SRC_WATCH, SRC_LIKE, SRC_RATING, PB_IS_SERIES, PB_NOT_FINISHED,
+                                 PB_HALF_OR_MORE)
+from id_codec import KIND_PREFIX, oid_bytes, index_for, rows_for
+from interactions_io import has_interactions, load_interactions, to_csr
+
+# Tham số quét được qua --grid name=v1,v2,...
+GRID_KEYS = {
+    "factors": int, "iterations": int, "regularization": float, "alpha": float,
+    "watch_finished": float, "watch_half": float, "watch_min": float,
+    "like_weight": float, "rating_mult": float,
+}
+
+
+# =========================================================
+# Metrics
+# =========================================================
+def ranking_metrics(U: np.ndarray, V: np.ndarray, seen: csr_matrix, test: csr_matrix, users: np.ndarray,
+                    ks=(10,), block: int = 0) -> Dict[str, float]:
+    """
+    P@k / R@k / NDCG@k (relevance nhị phân) trung bình trên `users` + coverage@K.
+    Theo block: S = U[b] @ V.T (float32), loại item trong `seen`, argpartition lấy top-K rồi sort.
+    RAM ~ block × n_items × 4 byte.
+    """
+    ks = sorted({int(k) for k in ks})
+    n_items = V.shape[0]
+    K = min(ks[-1], n_items)
+    block = block or max(32, min(4096, (1 << 25) // max(n_items, 1)))
+    V32 = np.ascontiguousarray(V, dtype=np.float32)
+    disc = 1.0 / np.log2(np.arange(2, K + 2))
+    idcg = np.cumsum(disc)
+    sums = {f"{m}@{k}": 0.0 for k in ks for m in ("precision", "recall", "ndcg")}
+    covered = np.zeros(n_items, dtype=bool)
+    n = 0
+
+    for s in range(0, users.size, block):
+        ub = users[s:s + block]
+        S = np.asarray(U[ub], dtype=np.float32) @ V32.T
+        sr = seen[ub]
+        S[np.repeat(np.arange(ub.size), np.diff(sr.indptr)), sr.indices] = -np.inf
+        top = np.argpartition(-S, K - 1, axis=1)[:, :K] if K < n_items else np.tile(np.arange(n_items), (ub.size, 1))
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(S, top, axis=1), axis=1, kind="stable"), axis=1)
+
+        # hit: tra (row, item) của top-K trong khoá đã sort của tập test
+        te = test[ub]
+        te.sort_indices()
+        truth_n = np.diff(te.indptr)
+        tkey = np.repeat(np.arange(ub.size, dtype=np.int64), truth_n) * n_items + te.indices
+        qkey = np.arange(ub.size, dtype=np.int64)[:, None] * n_items + top
+        rel = tkey[np.minimum(np.searchsorted(tkey, qkey), tkey.size - 1)] == qkey
+        hits = np.cumsum(rel, axis=1)
+        dcg = np.cumsum(rel * disc, axis=1)
+        for k in ks:
+            kk = min(k, K)
+            sums[f"precision@{k}"] += float((hits[:, kk - 1] / k).sum())
+            sums[f"recall@{k}"] += float((hits[:, kk - 1] / truth_n).sum())
+            sums[f"ndcg@{k}"] += float((dcg[:, kk - 1] / idcg[np.minimum(truth_n, kk) - 1]).sum())
+        covered[top.ravel()] = True
+        n += ub.size
+
+    out = {k: round(v / max(n, 1), 6) for k, v in sums.items()}
+    out[f"coverage@{K}"] = round(float(covered.mean()), 6)
+    out["users"] = n
+    return out
+
+
+# =========================================================
+# Time split
+# =========================================================
+def _to_ts(d) -> float:
+    return d.timestamp() if isinstance(d, datetime.datetime) else np.nan
+
+
+def load_watch_history(db, users: List[str], items: List[str], batch_size: int = 5000):
+    """
+    (user, item) của model → lastActionAt mới nhất + số lượt (finished, >=50%, còn lại) từ playback_state.
+    finished / progressPct theo cùng biểu thức với export_interactions: tier khớp điểm watch của train.
+    """
+    uidx, iidx = index_for(users, item=False), index_for(items, item=True)
+    half = {"$and": [PB_NOT_FINISHED, PB_HALF_OR_MORE]}
+    pipeline = [
+        {"$match": {"userId": {"$ne": None}, "movieId": {"$ne": None}}},
+        {"$group": {"_id": {"u": "$userId", "m": "$movieId", "s": PB_IS_SERIES},
+                    "last": {"$max": "$lastActionAt"},
+                    "f": {"$sum": {"$cond": [PB_NOT_FINISHED, 0, 1]}},
+                    "h": {"$sum": {"$cond": [half, 1, 0]}},
+                    "n": {"$sum": 1}}},
+    ]
+    # gom code (id_codec) cả kết quả rồi tra index một lần mỗi loại
+    ucodes, icodes, ts, tiers = [], [], [], []
+    for g in db[WATCH_COL].aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+        m = oid_bytes(g["_id"].get("m"))
+        f, h, n = int(g["f"]), int(g["h"]), int(g["n"])
+        ucodes.append(oid_bytes(g["_id"].get("u")))
+        icodes.append(KIND_PREFIX[bool(g["_id"].get("s"))] + m if m else None)
+        ts.append(_to_ts(g.get("last"))); tiers.append((f, h, n - f - h))
+    uu, ii = rows_for(uidx, ucodes, item=False), rows_for(iidx, icodes, item=True)
+    ok = (uu >= 0) & (ii >= 0)
+    return (uu[ok], ii[ok], np.asarray(ts, dtype=np.float64)[ok],
+            np.asarray(tiers, dtype=np.float32).reshape(-1, 3)[ok])
+
+
+def time_split(cols: dict, hist, n_users: int, n_items: int, holdout: int = 1, min_train: int = 1) -> dict:
+    """
+    Giữ lại `holdout` cặp (user, item) có lastActionAt mới nhất của mỗi user (cả nguồn like / rating
+    của cặp đó bị bỏ khỏi train để không lộ đáp án). User phải còn >= min_train tương tác để train.
+    """
+    uu = np.asarray(cols["user_idx"], dtype=np.int32)
+    ii = np.asarray(cols["item_idx"], dtype=np.int32)
+    P = np.asarray(cols["parts"], dtype=np.float32)
+    n = uu.shape[0]
+
+    # căn lịch sử playback vào các dòng artifact (đã sort theo (user, item) = theo key)
+    key = uu.astype(np.int64) * n_items + ii
+    h_uu, h_ii, h_ts, h_tiers = hist
+    pos = np.searchsorted(key, h_uu * n_items + h_ii)
+    ok = pos < n
+    ok[ok] = key[pos[ok]] == (h_uu * n_items + h_ii)[ok]
+    ts = np.full(n, np.nan)
+    ts[pos[ok]] = h_ts[ok]
+    tiers = np.zeros((n, 3), dtype=np.float32)
+    tiers[pos[ok]] = h_tiers[ok]
+    has_tiers = np.zeros(n, dtype=bool)
+    has_tiers[pos[ok]] = True
+
+    # thứ hạng theo thời gian trong từng user (mới nhất = 0), chỉ trên dòng có lastActionAt
+    e = np.flatnonzero(~np.isnan(ts))
+    order = e[np.lexsort((-ts[e], uu[e]))]
+    us = uu[order]
+    start = np.flatnonzero(np.r_[True, us[1:] != us[:-1]])
+    rank = np.arange(order.size) - np.repeat(start, np.diff(np.r_[start, order.size]))
+    held = np.zeros(n, dtype=bool)
+    held[order[rank < holdout]] = True
+    left = np.bincount(uu, minlength=n_users) - np.bincount(uu[held], minlength=n_users)
+    held &= left[uu] >= min_train
+
+    tr = ~held
+    test = to_csr(uu[held], ii[held], np.ones(int(held.sum()), dtype=np.float32), n_users, n_items)
+    seen = to_csr(uu[tr], ii[tr], np.ones(int(tr.sum()), dtype=np.float32), n_users, n_items)
+    return {
+        "uu": uu[tr], "ii": ii[tr], "parts": P[tr], "tiers": tiers[tr], "has_tiers": has_tiers[tr],
+        "seen": seen, "test": test, "users": np.flatnonzero(np.diff(test.indptr) > 0),
+        "n_users": n_users, "n_items": n_items,
+        "stats": {"rows": int(n), "train_rows": int(tr.sum()), "held_out": int(held.sum()),
+                  "timestamped": int(e.size), "matched_history": int(ok.sum())},
+    }
+
+
+def config_scores(split: dict, cfg: dict) -> np.ndarray:
+    """Điểm tương tác theo trọng số của cfg (cùng công thức với export_interactions)."""
+    P = split["parts"]
+    w = np.array([cfg["watch_finished"], cfg["watch_half"], cfg["watch_min"]], dtype=np.float32)
+    # cặp không khớp lịch sử playback (dữ liệu đổi sau lần export) giữ điểm watch đã export
+    watch = np.where(split["has_tiers"], split["tiers"] @ w, P[:, SRC_WATCH])
+    like = P[:, SRC_LIKE] * np.float32(cfg["like_weight"] / LIKE_WEIGHT) if LIKE_WEIGHT else P[:, SRC_LIKE]
+    rating = P[:, SRC_RATING] * np.float32(cfg["rating_mult"] / RATING_WEIGHT_MULT) if RATING_WEIGHT_MULT \
+        else P[:, SRC_RATING]
+    return (watch + like + rating).astype(np.float32)
+
+
+# =========================================================
+# Sweep (mỗi config một process, split dùng chung qua fork)
+# =========================================================
+_SPLIT: dict = {}
+
+
+def _init_worker(split: dict, threads: int):
+    global _SPLIT
+    _SPLIT = dict(split, threads=threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(max(threads, 1))
+    except ImportError:
+        pass
+
+
+def evaluate_config(cfg: dict) -> dict:
+    """Train ALS trên phần train của split với cfg → metrics trên holdout."""
+    from implicit.als import AlternatingLeastSquares
+    from train_als import fit_als, default_factors
+    s = _SPLIT
+    t0 = time.perf_counter()
+    C = to_csr(s["uu"], s["ii"], config_scores(s, cfg) * np.float32(cfg["alpha"]), s["n_users"], s["n_items"])
+    C.eliminate_zeros()
+    factors = cfg["factors"] or default_factors(np.unique(s["uu"]).size, np.unique(s["ii"]).size)
+    model = AlternatingLeastSquares(factors=factors, regularization=cfg["regularization"], alpha=1.0,
+                                    dtype=np.float32, iterations=cfg["iterations"],
+                                    num_threads=s["threads"], random_state=s["seed"])
+    fit_als(model, C, cfg["iterations"], s["seed"], s["threads"])
+    t1 = time.perf_counter()
+    res = ranking_metrics(model.user_factors, model.item_factors, s["seen"], s["test"], s["users"],
+                          s["ks"], s["block"])
+    return {"name": "als", "config": dict(cfg, factors=factors), "metrics": res,
+            "train_sec": round(t1 - t0, 3), "eval_sec": round(time.perf_counter() - t1, 3)}
+
+
+def evaluate_popularity(split: dict, ks, block: int = 0) -> dict:
+    """Baseline: xếp hạng theo số tương tác trong tập train (cùng cho mọi user)."""
+    t = time.perf_counter()
+    pop = np.bincount(split["ii"], minlength=split["n_items"]).astype(np.float32)[:, None]
+    res = ranking_metrics(np.ones((split["n_users"], 1), dtype=np.float32), pop, split["seen"], split["test"],
+                          split["users"], ks, block)
+    return {"name": "popularity", "config": {}, "metrics": res, "train_sec": 0.0,
+            "eval_sec": round(time.perf_counter() - t, 3)}
+
+
+def base_config(meta_path: str = "artifacts/train_meta.json") -> dict:
+    """Trọng số export hiện tại + tham số ALS của model đang chạy (train_meta.json nếu có)."""
+    cfg = {"factors": 0, "iterations": 15, "regularization": 0.02, "alpha": 15.0,
+           "watch_finished": WATCH_FINISHED, "watch_half": WATCH_HALF_OR_MORE, "watch_min": WATCH_MIN_SIGNAL,
+           "like_weight": LIKE_WEIGHT, "rating_mult": RATING_WEIGHT_MULT}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        for k, src in (("factors", "factors"), ("iterations", "iterations_final"),
+                       ("regularization", "regularization"), ("alpha", "alpha")):
+            if meta.get(src) is not None:
+                cfg[k] = GRID_KEYS[k](meta[src])
+    return cfg
+
+
+def parse_grid(specs: List[str], base: dict) -> List[dict]:
+    """["factors=32,64", "alpha=15,40"] → tích Descartes các config (mỗi config = base + override)."""
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in GRID_KEYS or not values:
+            raise SystemExit(f"[ERROR] bad --grid entry {spec!r}; keys: {', '.join(GRID_KEYS)}")
+        axes.append([(name, GRID_KEYS[name](v)) for v in values.split(",")])
+    return [dict(base, **dict(combo)) for combo in itertools.product(*axes)]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline evaluation of ALS with a per-user time-split holdout")
+    ap.add_argument("--grid", nargs="*", default=[], help="name=v1,v2 ... (" + ", ".join(GRID_KEYS) + ")")
+    ap.add_argument("--k", type=str, default="10,20")
+    ap.add_argument("--holdout", type=int, default=1, help="số tương tác mới nhất giữ lại mỗi user")
+    ap.add_argument("--min-train", type=int, default=1, help="user phải còn ít nhất chừng này tương tác để train")
+    ap.add_argument("--workers", type=int, default=0, help="số process (0 = min(số config, số core))")
+    ap.add_argument("--threads", type=int, default=0, help="thread mỗi process (0 = số core / workers)")
+    ap.add_argument("--block", type=int, default=0, help="số user mỗi block khi chấm (0 = tự chọn theo số item)")
+    ap.add_argument("--metric", type=str, default=None, help="chỉ số để chọn config tốt nhất (mặc định ndcg@<k đầu>)")
+    ap.add_argument("--no-baseline", action="store_true", help="bỏ baseline popularity")
+    ap.add_argument("--batch-size", type=int, default=int(os.getenv("EXPORT_BATCH_SIZE", "5000")))
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--json", type=str, default=None, help="ghi kết quả ra file")
+    args = ap.parse_args(argv)
+    ks = [int(k) for k in args.k.split(",") if k]
+    metric = args.metric or f"ndcg@{ks[0]}"
+
+    if not has_interactions("artifacts"):
+        raise SystemExit("[ERROR] Missing artifacts/interactions/. Run export_interactions.py first.")
+    with open("artifacts/user_id_map.json", "r", encoding="utf-8") as f:
+        users = json.load(f)["users"]
+    with open("artifacts/item_id_map.json", "r", encoding="utf-8") as f:
+        items = json.load(f)["items"]
+
+    t0 = time.perf_counter()
+    client = MongoClient(MONGO_URL)
+    hist = load_watch_history(client[DB_NAME], users, items, args.batch_size)
+    client.close()  # trước khi fork worker
+    t1 = time.perf_counter()
+    split = time_split(load_interactions("artifacts", parts=True), hist, len(users), len(items),
+                       args.holdout, args.min_train)
+    split.update(ks=ks, block=args.block, seed=args.seed)
+    stats = dict(split["stats"], eval_users=int(split["users"].size),
+                 history_sec=round(t1 - t0, 3), split_sec=round(time.perf_counter() - t1, 3))
+    print(f"[INFO] split: {stats}")
+    if not split["users"].size:
+        raise SystemExit("[ERROR] No user has a held-out interaction (missing lastActionAt?)")
+
+    configs = parse_grid(args.grid, base_config()) if args.grid else [base_config()]
+    cores = os.cpu_count() or 1
+    workers = max(1, min(args.workers or min(len(configs), cores), len(configs)))
+    threads = args.threads or max(1, cores // workers)
+    print(f"[INFO] {len(configs)} config(s), {workers} worker(s) × {threads} thread(s)")
+
+    results = [] if args.no_baseline else [evaluate_popularity(split, ks, args.block)]
+    t = time.perf_counter()
+    if workers == 1:
+        _init_worker(split, threads)
+        results += [evaluate_config(c) for c in configs]
+    else:
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(split, threads)) as ex:
+            results += list(ex.map(evaluate_config, configs))
+    sweep_sec = round(time.perf_counter() - t, 3)
+
+    # === Report ===
+    swept = [k for k in GRID_KEYS if len({r["config"].get(k) for r in results if r["name"] == "als"}) > 1]
+    cols = [m for m in results[0]["metrics"] if m != "users"]
+    print(f"{'model':<12}" + "".join(f"{c:>14}" for c in cols) + "  params")
+    for r in sorted(results, key=lambda r: -r["metrics"].get(metric, 0.0)):
+        params = (" ".join(f"{k}={r['config'][k]}" for k in swept) or "base") if r["name"] == "als" else ""
+        print(f"{r['name']:<12}" + "".join(f"{r['metrics'][c]:>14.4f}" for c in cols) + f"  {params}")
+    als = [r for r in results if r["name"] == "als"]
+    best = max(als, key=lambda r: r["metrics"].get(metric, 0.0))
+    print(f"[SUCCESS] best {metric}={best['metrics'][metric]:.4f} ({sweep_sec:.1f}s): "
+          + json.dumps({k: best["config"][k] for k in GRID_KEYS}))
+
+    out = {"split": stats, "metric": metric, "sweep_sec": sweep_sec, "results": results, "best": best}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=2)
+        print(f"[INFO] Saved {args.json}")
+    return out
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,28 @@
 # ---------------------------------------------------------
 # Export training data (user–item interactions) for ALS model.
 # Only use: playback_state + users.likedItems + movies.reviews.rating
+#
+#   python export_interactions.py                 # full: đọc toàn bộ vào Python (như cũ)
+#   python export_interactions.py --mode stream   # $group trong Mongo, đọc theo batch; RAM O(pairs) dạng numpy (~13 byte/cặp)
+#   python export_interactions.py --incremental   # chỉ đọc phần thay đổi từ lần export trước
+#   python export_interactions.py --csv           # thêm interactions.csv (debug; train đọc artifacts/interactions/)
 # ---------------------------------------------------------
 
-import os, sys, json
+import os, sys, json, time, datetime, argparse
 from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
 from bson import ObjectId
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from id_codec import KIND_PREFIX, OID_BYTES, oid_bytes, encode_keys, code_list, decode_codes, as_codes
+from seen_index import save_seen_index
+from category_profile import build_category_profile
+from schema_probe import SchemaProbe, required_indexes
+from interactions_io import save_interactions, has_interactions, load_interactions, write_csv
+
 load_dotenv()
 
 # === ENV ===
@@ -20,18 +34,16 @@ USERS_COL   = os.getenv("USERS_COLLECTION", "users")
 MOVIES_COL  = os.getenv("MOVIES_COLLECTION", "movies")
 SERIES_COL  = os.getenv("SERIES_COLLECTION", "series")
 
-print(f"[INFO] MONGO_URL={MONGO_URL}")
-print(f"[INFO] DB_NAME={DB_NAME}")
-print(f"[INFO] WATCH_COLLECTION={WATCH_COL}")
-print(f"[INFO] USERS_COLLECTION={USERS_COL}")
-print(f"[INFO] MOVIES_COLLECTION={MOVIES_COL}")
-print(f"[INFO] SERIES_COLLECTION={SERIES_COL}")
+# === Weights ===
+WATCH_FINISHED      = 3.0
+WATCH_HALF_OR_MORE  = 2.0
+WATCH_MIN_SIGNAL    = 1.0
+LIKE_WEIGHT         = 2.5
+RATING_WEIGHT_MULT  = 1.0
 
-# === Connect ===
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
-cols = set(db.list_collection_names())
-print(f"[INFO] Collections found: {sorted(cols)}")
+# Cột điểm theo nguồn (artifacts/interactions/parts.npy) — incremental thay từng cột
+SRC_WATCH, SRC_LIKE, SRC_RATING = 0, 1, 2
+N_SRC = 3
 
 def oid2str(x):
     if isinstance(x, ObjectId): return str(x)
@@ -47,125 +59,508 @@ def to_float(val):
     except:
         return 0.0
 
-# === Active items ===
-active_movies = {str(d["_id"]) for d in db[MOVIES_COL].find({}, {"_id":1})} if MOVIES_COL in cols else set()
-active_series = {str(d["_id"]) for d in db[SERIES_COL].find({}, {"_id":1})} if SERIES_COL in cols else set()
-
 def prefix_key(mid: str, is_series: bool) -> str:
     return ("series:" if is_series else "movie:") + mid
 
-if not active_movies and not active_series:
-    print("[ERROR] No active movies/series found in DB.")
-    sys.exit(1)
+def watch_score(progress_pct, finished) -> float:
+    p = float(progress_pct or 0) / 100.0
+    return WATCH_FINISHED if finished else (WATCH_HALF_OR_MORE if p >= 0.5 else WATCH_MIN_SIGNAL)
 
-# === Accumulators ===
-scores = defaultdict(float)
-user_seen = set()
 
-# === Weights ===
-WATCH_FINISHED      = 3.0
-WATCH_HALF_OR_MORE  = 2.0
-WATCH_MIN_SIGNAL    = 1.0
-LIKE_WEIGHT         = 2.5
-RATING_WEIGHT_MULT  = 1.0
+class Progress:
+    """Đếm + in throughput mỗi `every` bản ghi."""
 
-# === 1) playback_state ===
-if WATCH_COL in cols:
-    cnt = 0
-    cur = db[WATCH_COL].find(
-        {},
-        {"userId":1, "movieId":1, "progressPct":1, "finished":1, "seasonNumber":1, "episodeNumber":1}
-    )
-    for w in cur:
-        u = oid2str(w.get("userId"))
-        m = oid2str(w.get("movieId"))
-        if not u or not m:
-            continue
+    def __init__(self, name: str, every: int = 100000):
+        self.name, self.every = name, every
+        self.n = 0
+        self.t0 = time.time()
 
-        is_series = (w.get("seasonNumber") is not None) or (w.get("episodeNumber") is not None)
-        if is_series:
-            if m not in active_series: continue
-        else:
-            if m not in active_movies: continue
-
-        key = prefix_key(m, is_series)
-        p = float(w.get("progressPct", 0) or 0) / 100.0
-        s = WATCH_FINISHED if w.get("finished") else (WATCH_HALF_OR_MORE if p >= 0.5 else WATCH_MIN_SIGNAL)
-        scores[(u, key)] += s
-        user_seen.add(u)
-        cnt += 1
-    print(f"[INFO] playback_state interactions: {cnt}")
-else:
-    print(f"[WARN] Missing collection '{WATCH_COL}'")
+    def tick(self, k: int = 1):
+        before = self.n
+        self.n += k
+        if self.n // self.every != before // self.every:
+            dt = max(time.time() - self.t0, 1e-9)
+            print(f"[PROGRESS] {self.name}: {self.n:,} rows ({self.n / dt:,.0f} rows/s)")
 
-# === 2) users.likedItems ===
-if USERS_COL in cols:
-    cnt = 0
-    for udoc in db[USERS_COL].find({}, {"_id":1, "likedItems":1}):
-        u = str(udoc["_id"])
-        arr = udoc.get("likedItems") or []
-        for it in arr:
-            if not isinstance(it, dict):
-                continue
-            ref = oid2str(it.get("refId"))
-            kind = (it.get("kind") or "").strip()
-            if not ref or kind not in ("Movie", "Series"):
+    def done(self) -> str:
+        dt = max(time.time() - self.t0, 1e-9)
+        return f"{self.n:,} rows in {dt:.1f}s ({self.n / dt:,.0f} rows/s)"
+
+
+def load_active(db, cols):
+    """Tập _id (12 byte, id_codec) của movies / series còn tồn tại."""
+    active_movies = {oid_bytes(d["_id"]) for d in db[MOVIES_COL].find({}, {"_id":1})} if MOVIES_COL in cols else set()
+    active_series = {oid_bytes(d["_id"]) for d in db[SERIES_COL].find({}, {"_id":1})} if SERIES_COL in cols else set()
+    active_movies.discard(None)
+    active_series.discard(None)
+    return active_movies, active_series
+
+
+# =========================================================
+# Mode "full": gom tất cả (user, item) vào dict Python
+#   key = user code (12 byte) + item code (13 byte) — một bytes 25 byte thay tuple hai chuỗi hex
+# =========================================================
+def export_full(db, cols, active_movies, active_series):
+    scores = defaultdict(lambda: [0.0] * N_SRC)
+
+    # === 1) playback_state ===
+    if WATCH_COL in cols:
+        cnt = 0
+        cur = db[WATCH_COL].find(
+            {},
+            {"userId":1, "movieId":1, "progressPct":1, "finished":1, "seasonNumber":1, "episodeNumber":1}
+        )
+        for w in cur:
+            u = oid_bytes(w.get("userId"))
+            m = oid_bytes(w.get("movieId"))
+            if not u or not m:
                 continue
-            if kind == "Series":
-                if ref not in active_series: continue
-                key = prefix_key(ref, True)
+
+            is_series = (w.get("seasonNumber") is not None) or (w.get("episodeNumber") is not None)
+            if is_series:
+                if m not in active_series: continue
             else:
-                if ref not in active_movies: continue
-                key = prefix_key(ref, False)
-            scores[(u, key)] += LIKE_WEIGHT
-            user_seen.add(u)
+                if m not in active_movies: continue
+
+            scores[u + KIND_PREFIX[is_series] + m][SRC_WATCH] += watch_score(w.get("progressPct", 0), w.get("finished"))
             cnt += 1
-    print(f"[INFO] users.likedItems interactions: {cnt}")
-else:
-    print(f"[WARN] Missing collection '{USERS_COL}'")
-
-# === 3) movies.reviews[].rating ===
-if MOVIES_COL in cols:
-    rcnt = 0
-    for mdoc in db[MOVIES_COL].find({}, {"_id":1, "reviews":1}):
-        mid = str(mdoc["_id"])
-        if mid not in active_movies:
-            continue
-        for rv in (mdoc.get("reviews") or []):
-            u = oid2str(rv.get("userId"))
+        print(f"[INFO] playback_state interactions: {cnt}")
+    else:
+        print(f"[WARN] Missing collection '{WATCH_COL}'")
+
+    # === 2) users.likedItems ===
+    if USERS_COL in cols:
+        cnt = 0
+        for udoc in db[USERS_COL].find({}, {"_id":1, "likedItems":1}):
+            u = oid_bytes(udoc["_id"])
             if not u:
                 continue
-            rating = to_float(rv.get("rating"))
-            if rating <= 0:
+            arr = udoc.get("likedItems") or []
+            for it in arr:
+                if not isinstance(it, dict):
+                    continue
+                ref = oid_bytes(it.get("refId"))
+                kind = (it.get("kind") or "").strip()
+                if not ref or kind not in ("Movie", "Series"):
+                    continue
+                if kind == "Series":
+                    if ref not in active_series: continue
+                    key = u + KIND_PREFIX[1] + ref
+                else:
+                    if ref not in active_movies: continue
+                    key = u + KIND_PREFIX[0] + ref
+                scores[key][SRC_LIKE] += LIKE_WEIGHT
+                cnt += 1
+        print(f"[INFO] users.likedItems interactions: {cnt}")
+    else:
+        print(f"[WARN] Missing collection '{USERS_COL}'")
+
+    # === 3) movies.reviews[].rating ===
+    if MOVIES_COL in cols:
+        rcnt = 0
+        for mdoc in db[MOVIES_COL].find({}, {"_id":1, "reviews":1}):
+            mid = oid_bytes(mdoc["_id"])
+            if mid not in active_movies:
                 continue
-            key = prefix_key(mid, False)
-            scores[(u, key)] += rating * RATING_WEIGHT_MULT
-            user_seen.add(u)
-            rcnt += 1
-    print(f"[INFO] movies.reviews interactions: {rcnt}")
-else:
-    print(f"[WARN] Missing collection '{MOVIES_COL}'")
-
-# === Write artifacts ===
-if not scores:
-    print("[ERROR] No interactions found!")
-    sys.exit(1)
-
-users = sorted(user_seen)
-items = sorted({k for (_, k) in scores.keys()})
-
-u2i = {u: i for i, u in enumerate(users)}
-m2i = {k: i for i, k in enumerate(items)}
-
-os.makedirs("artifacts", exist_ok=True)
-with open("artifacts/user_id_map.json", "w", encoding="utf-8") as f:
-    json.dump({"users": users}, f, ensure_ascii=False)
-with open("artifacts/item_id_map.json", "w", encoding="utf-8") as f:
-    json.dump({"items": items}, f, ensure_ascii=False)
-with open("artifacts/interactions.csv", "w", encoding="utf-8") as f:
-    f.write("user_idx,item_idx,score\n")
-    for (u, k), s in scores.items():
-        f.write(f"{u2i[u]},{m2i[k]},{s}\n")
-
-print(f"[DONE] Exported users={len(users)} items={len(items)} interactions={len(scores)}")
-print("[NEXT] Run: python train_als.py")
+            icode = KIND_PREFIX[0] + mid
+            for rv in (mdoc.get("reviews") or []):
+                u = oid_bytes(rv.get("userId"))
+                if not u:
+                    continue
+                rating = to_float(rv.get("rating"))
+                if rating <= 0:
+                    continue
+                scores[u + icode][SRC_RATING] += rating * RATING_WEIGHT_MULT
+                rcnt += 1
+        print(f"[INFO] movies.reviews interactions: {rcnt}")
+    else:
+        print(f"[WARN] Missing collection '{MOVIES_COL}'")
+
+    if not scores:
+        return None
+
+    # Tách key 25 byte → user / item code, np.unique cho cả id đã sort lẫn index (không dict trung gian)
+    raw = np.frombuffer(b"".join(scores.keys()), dtype=np.uint8).reshape(len(scores), -1)
+    ucodes, uu = np.unique(as_codes(raw[:, :OID_BYTES]), return_inverse=True)
+    icodes, ii = np.unique(as_codes(raw[:, OID_BYTES:]), return_inverse=True)
+    P = np.array(list(scores.values()), dtype=np.float32)
+    return (decode_codes(ucodes, item=False), decode_codes(icodes, item=True),
+            uu.astype(np.int32), ii.astype(np.int32), P)
+
+
+# =========================================================
+# Mode "stream": $group trong Mongo, encode id → int ngay khi đọc
+# =========================================================
+class _Encoder:
+    """
+    id code (bytes, id_codec) → dense int, theo thứ tự gặp lần đầu (có thể seed bằng map cũ).
+    Dict key 12/13 byte thay chuỗi 24/30 ký tự: ít RAM, hash nhanh hơn; .ids decode lại khi ghi map.
+    """
+
+    def __init__(self, ids: List[str] = None, item: bool = False):
+        self.item = item
+        self.codes: List[bytes] = code_list(encode_keys(ids, item)) if ids else []
+        self.index: Dict[bytes, int] = {c: i for i, c in enumerate(self.codes)}
+
+    def __call__(self, code: bytes) -> int:
+        i = self.index.get(code)
+        if i is None:
+            i = self.index[code] = len(self.codes)
+            self.codes.append(code)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def ids(self) -> List[str]:
+        return decode_codes(self.codes, self.item) if self.codes else []
+
+    def rows(self, oids, is_series: bool = False) -> np.ndarray:
+        """Index của các ObjectId đã có trong map (bỏ id chưa gặp)."""
+        prefix = KIND_PREFIX[is_series] if self.item else b""
+        codes = (oid_bytes(x) for x in oids)
+        return np.array([i for i in (self.index.get(prefix + c) for c in codes if c) if i is not None],
+                        dtype=np.int64)
+
+
+class _Columns:
+    """Append-only (user int32, item int32, source int8, score float32), grown in numpy blocks."""
+
+    def __init__(self, block: int = 1 << 20):
+        self.block = block
+        self.parts = []
+        self._new()
+
+    def _new(self):
+        self.u = np.empty(self.block, dtype=np.int32)
+        self.i = np.empty(self.block, dtype=np.int32)
+        self.c = np.empty(self.block, dtype=np.int8)
+        self.s = np.empty(self.block, dtype=np.float32)
+        self.k = 0
+
+    def add(self, u: int, i: int, src: int, s: float):
+        if self.k == self.block:
+            self.parts.append((self.u, self.i, self.c, self.s))
+            self._new()
+        self.u[self.k], self.i[self.k], self.c[self.k], self.s[self.k] = u, i, src, s
+        self.k += 1
+
+    def __len__(self):
+        return len(self.parts) * self.block + self.k
+
+    def arrays(self):
+        parts = self.parts + [(self.u[:self.k], self.i[:self.k], self.c[:self.k], self.s[:self.k])]
+        return tuple(np.concatenate([p[j] for p in parts]) for j in range(4))
+
+
+def merge_rows(uu: np.ndarray, ii: np.ndarray, P: np.ndarray):
+    """Gộp (user, item) trùng: sort theo key int64 rồi np.add.reduceat trên từng cột nguồn."""
+    if not uu.size:
+        return uu.astype(np.int32), ii.astype(np.int32), P.astype(np.float32)
+    n_items = int(ii.max()) + 1
+    key = uu.astype(np.int64) * n_items + ii
+    order = np.argsort(key, kind="stable")
+    key, P = key[order], P[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    P = np.add.reduceat(P, starts, axis=0).astype(np.float32)
+    key = key[starts]
+    return (key // n_items).astype(np.int32), (key % n_items).astype(np.int32), P
+
+
+def _rows_to_parts(rows: _Columns):
+    uu, ii, cc, ss = rows.arrays()
+    P = np.zeros((uu.shape[0], N_SRC), dtype=np.float32)
+    P[np.arange(uu.shape[0]), cc] = ss
+    return uu, ii, P
+
+
+# Biểu thức aggregation dùng chung với evaluate_als.load_watch_history
+PB_IS_SERIES = {"$or": [{"$ne": [{"$ifNull": ["$seasonNumber", None]}, None]},
+                        {"$ne": [{"$ifNull": ["$episodeNumber", None]}, None]}]}
+# finished theo truthiness như watch_score() của mode full (1, "yes"... cũng tính là xem hết)
+PB_NOT_FINISHED = {"$in": [{"$ifNull": ["$finished", None]}, [False, None, 0, "", [], {}]]}
+# progressPct có thể là string ("30") → ép double như float() của watch_score, không so theo thứ tự kiểu BSON
+PB_HALF_OR_MORE = {"$gte": [{"$convert": {"input": "$progressPct", "to": "double", "onError": 0, "onNull": 0}}, 50]}
+
+def _watch_pipeline(match: dict = None):
+    score = {"$cond": [PB_NOT_FINISHED,
+             {"$cond": [PB_HALF_OR_MORE, WATCH_HALF_OR_MORE, WATCH_MIN_SIGNAL]},
+             WATCH_FINISHED]}
+    return ([{"$match": match}] if match else []) + [
+        {"$match": {"userId": {"$ne": None}, "movieId": {"$ne": None}}},
+        {"$group": {"_id": {"u": "$userId", "m": "$movieId", "s": PB_IS_SERIES},
+                    "score": {"$sum": score}, "n": {"$sum": 1}}},
+    ]
+
+def _likes_pipeline(match: dict = None):
+    return ([{"$match": match}] if match else []) + [
+        {"$match": {"likedItems.0": {"$exists": True}}},
+        {"$unwind": "$likedItems"},
+        {"$match": {"likedItems.kind": {"$in": ["Movie", "Series"]}, "likedItems.refId": {"$ne": None}}},
+        {"$group": {"_id": {"u": "$_id", "r": "$likedItems.refId", "k": "$likedItems.kind"},
+                    "n": {"$sum": 1}}},
+    ]
+
+def _reviews_pipeline(match: dict = None):
+    # rating có thể là string/number → ép kiểu bằng to_float() phía Python (giống mode full)
+    return ([{"$match": match}] if match else []) + [
+        {"$match": {"reviews.0": {"$exists": True}}},
+        {"$unwind": "$reviews"},
+        {"$match": {"reviews.userId": {"$ne": None}}},
+        {"$project": {"_id": 0, "u": "$reviews.userId", "m": "$_id", "r": "$reviews.rating"}},
+    ]
+
+
+def _stream_watch(db, rows, uenc, ienc, active_movies, active_series, batch_size, match=None):
+    prog = Progress("playback_state")
+    cnt = 0
+    cur = db[WATCH_COL].aggregate(_watch_pipeline(match), allowDiskUse=True, batchSize=batch_size)
+    for g in cur:
+        u, m, is_series = oid_bytes(g["_id"].get("u")), oid_bytes(g["_id"].get("m")), bool(g["_id"].get("s"))
+        prog.tick()
+        if not u or not m or m not in (active_series if is_series else active_movies):
+            continue
+        rows.add(uenc(u), ienc(KIND_PREFIX[is_series] + m), SRC_WATCH, float(g["score"]))
+        cnt += int(g.get("n", 1))
+    print(f"[INFO] playback_state interactions: {cnt} | {prog.done()}")
+
+def _stream_likes(db, rows, uenc, ienc, active_movies, active_series, batch_size, match=None):
+    prog = Progress("users.likedItems")
+    cnt = 0
+    cur = db[USERS_COL].aggregate(_likes_pipeline(match), allowDiskUse=True, batchSize=batch_size)
+    for g in cur:
+        u, ref, kind = oid_bytes(g["_id"].get("u")), oid_bytes(g["_id"].get("r")), g["_id"].get("k")
+        prog.tick()
+        is_series = kind == "Series"
+        if not u or not ref or ref not in (active_series if is_series else active_movies):
+            continue
+        rows.add(uenc(u), ienc(KIND_PREFIX[is_series] + ref), SRC_LIKE, LIKE_WEIGHT * int(g["n"]))
+        cnt += int(g["n"])
+    print(f"[INFO] users.likedItems interactions: {cnt} | {prog.done()}")
+
+def _stream_reviews(db, rows, uenc, ienc, active_movies, batch_size, match=None):
+    prog = Progress("movies.reviews")
+    cnt = 0
+    cur = db[MOVIES_COL].aggregate(_reviews_pipeline(match), allowDiskUse=True, batchSize=batch_size)
+    for g in cur:
+        u, m = oid_bytes(g.get("u")), oid_bytes(g.get("m"))
+        prog.tick()
+        rating = to_float(g.get("r"))
+        if not u or not m or m not in active_movies or rating <= 0:
+            continue
+        rows.add(uenc(u), ienc(KIND_PREFIX[0] + m), SRC_RATING, rating * RATING_WEIGHT_MULT)
+        cnt += 1
+    print(f"[INFO] movies.reviews interactions: {cnt} | {prog.done()}")
+
+
+def export_stream(db, cols, active_movies, active_series, batch_size: int = 5000):
+    """
+    Không giữ document / dict theo cặp như mode full, nhưng RAM vẫn tăng theo số cặp:
+    _Columns giữ mọi (user, item, source, score) dạng numpy (~13 byte/dòng) tới merge cuối,
+    _Encoder giữ id → int của mọi user / item. save_interactions, seen index và train_als
+    đằng nào cũng cần toàn bộ mảng, nên không tách block ra đĩa.
+    """
+    uenc, ienc = _Encoder(), _Encoder(item=True)
+    rows = _Columns()
+
+    # === 1) playback_state: cộng điểm theo (user, movie, isSeries) trong Mongo ===
+    if WATCH_COL in cols:
+        _stream_watch(db, rows, uenc, ienc, active_movies, active_series, batch_size)
+    else:
+        print(f"[WARN] Missing collection '{WATCH_COL}'")
+
+    # === 2) users.likedItems ===
+    if USERS_COL in cols:
+        _stream_likes(db, rows, uenc, ienc, active_movies, active_series, batch_size)
+    else:
+        print(f"[WARN] Missing collection '{USERS_COL}'")
+
+    # === 3) movies.reviews[].rating ===
+    if MOVIES_COL in cols:
+        _stream_reviews(db, rows, uenc, ienc, active_movies, batch_size)
+    else:
+        print(f"[WARN] Missing collection '{MOVIES_COL}'")
+
+    if not len(uenc):
+        return None
+    uu, ii, P = merge_rows(*_rows_to_parts(rows))
+    return uenc.ids, ienc.ids, uu, ii, P
+
+
+# =========================================================
+# Mode incremental: chỉ đọc những gì đổi sau watermark lần trước
+# =========================================================
+STATE_PATH = "artifacts/export_state.json"
+
+def _ids_changed(col, field: str, since, batch: int = 50000) -> List:
+    """_id của document có `field` > since (đọc theo batch)."""
+    return [d["_id"] for d in col.find({field: {"$gt": since}}, {"_id": 1}).batch_size(batch)]
+
+def _users_with_new_playback(col, since) -> List:
+    cur = col.aggregate([{"$match": {"lastActionAt": {"$gt": since}, "userId": {"$ne": None}}},
+                         {"$group": {"_id": "$userId"}}], allowDiskUse=True)
+    return [g["_id"] for g in cur]
+
+def export_incremental(db, cols, active_movies, active_series, batch_size: int = 5000, chunk: int = 1000):
+    """
+    Delta theo watermark:
+    - playback_state.lastActionAt > since → tính lại cột watch của các user đó
+    - users.updatedAt > since             → tính lại cột like của các user đó
+    - movies.updatedAt > since            → tính lại cột rating của các movie đó
+    User/item mới được append vào map cũ, không đánh số lại.
+    """
+    if not (os.path.exists(STATE_PATH) and has_interactions("artifacts")):
+        print("[WARN] No previous export state — running stream export instead")
+        return None
+    with open(STATE_PATH, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    with open("artifacts/user_id_map.json", "r", encoding="utf-8") as f:
+        uenc = _Encoder(json.load(f)["users"])
+    with open("artifacts/item_id_map.json", "r", encoding="utf-8") as f:
+        ienc = _Encoder(json.load(f)["items"], item=True)
+    prev = load_interactions("artifacts", mmap=False, parts=True)
+    uu, ii, P = prev["user_idx"], prev["item_idx"], prev["parts"]
+    if uu.size and (uu.max() >= len(uenc) or ii.max() >= len(ienc)):
+        print("[WARN] artifacts/interactions does not match id maps — running stream export instead")
+        return None
+
+    since = datetime.datetime.fromisoformat(state["watermark"])
+    print(f"[INFO] incremental since {since.isoformat()} "
+          f"(prev users={len(uenc)} items={len(ienc)} rows={uu.shape[0]})")
+    rows = _Columns()
+
+    # === 1) playback_state ===
+    touched = _users_with_new_playback(db[WATCH_COL], since) if WATCH_COL in cols else []
+    for s in range(0, len(touched), chunk):
+        _stream_watch(db, rows, uenc, ienc, active_movies, active_series, batch_size,
+                      match={"userId": {"$in": touched[s:s + chunk]}})
+    watch_users = uenc.rows(touched)
+
+    # === 2) users.likedItems ===
+    liked = _ids_changed(db[USERS_COL], "updatedAt", since) if USERS_COL in cols else []
+    for s in range(0, len(liked), chunk):
+        _stream_likes(db, rows, uenc, ienc, active_movies, active_series, batch_size,
+                      match={"_id": {"$in": liked[s:s + chunk]}})
+    like_users = uenc.rows(liked)
+
+    # === 3) movies.reviews[].rating ===
+    reviewed = _ids_changed(db[MOVIES_COL], "updatedAt", since) if MOVIES_COL in cols else []
+    for s in range(0, len(reviewed), chunk):
+        _stream_reviews(db, rows, uenc, ienc, active_movies, batch_size,
+                        match={"_id": {"$in": reviewed[s:s + chunk]}})
+    review_items = ienc.rows(reviewed, is_series=False)
+
+    # Xoá cột sẽ được thay bằng delta; item không còn active → xoá toàn bộ điểm
+    P[np.isin(uu, watch_users), SRC_WATCH] = 0
+    P[np.isin(uu, like_users), SRC_LIKE] = 0
+    P[np.isin(ii, review_items), SRC_RATING] = 0
+    inactive = np.array([j for j, c in enumerate(ienc.codes) if c[1:] not in (active_series if c[0] else active_movies)],
+                        dtype=np.int64)
+    P[np.isin(ii, inactive)] = 0
+
+    du, di, dP = _rows_to_parts(rows)
+    uu, ii, P = merge_rows(np.concatenate([uu, du]), np.concatenate([ii, di]), np.concatenate([P, dP]))
+    keep = (P != 0).any(axis=1)
+    print(f"[INFO] delta: playback users={len(touched)} liked users={len(liked)} "
+          f"movies={len(reviewed)} rows={len(rows)} inactive items={inactive.size}")
+    return uenc.ids, ienc.ids, uu[keep], ii[keep], P[keep]
+
+
+# =========================================================
+# Write artifacts
+# =========================================================
+def write_artifacts(users, items, uu, ii, P, export_started, mode: str, csv: bool = False):
+    os.makedirs("artifacts", exist_ok=True)
+    uu, ii, P = merge_rows(uu, ii, P)  # sort theo (user, item) → train dựng CSR không cần sort lại
+    with open("artifacts/user_id_map.json", "w", encoding="utf-8") as f:
+        json.dump({"users": users}, f, ensure_ascii=False)
+    with open("artifacts/item_id_map.json", "w", encoding="utf-8") as f:
+        json.dump({"items": items}, f, ensure_ascii=False)
+
+    # Cột nhị phân int32/int32/float32 (+ điểm theo nguồn cho lần --incremental sau)
+    d = save_interactions("artifacts", uu, ii, P, len(users), len(items))
+    print(f"[INFO] Saved {d}/ (rows={uu.shape[0]})")
+    if csv:
+        write_csv("artifacts/interactions.csv", uu, ii, P.sum(axis=1))
+        print("[INFO] Saved artifacts/interactions.csv")
+
+    with open(STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump({"watermark": export_started.isoformat(), "mode": mode,
+                   "users": len(users), "items": len(items), "rows": int(uu.shape[0])}, f)
+
+    # "Đã xem" = cặp có điểm từ playback_state
+    w = P[:, SRC_WATCH] > 0
+    seen_rows = [[] for _ in users]
+    for u, i in zip(uu[w].tolist(), ii[w].tolist()):
+        seen_rows[u].append(i)
+    n_seen = save_seen_index("artifacts/seen_items.npz", seen_rows, export_started)
+    print(f"[INFO] Saved artifacts/seen_items.npz (pairs={n_seen})")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export user–item interactions for ALS")
+    ap.add_argument("--mode", choices=["full", "stream"], default=os.getenv("EXPORT_MODE", "full"))
+    ap.add_argument("--incremental", action="store_true",
+                    help="merge changes since the last export into the previous artifacts")
+    ap.add_argument("--batch-size", type=int, default=int(os.getenv("EXPORT_BATCH_SIZE", "5000")))
+    ap.add_argument("--csv", action="store_true", default=os.getenv("EXPORT_CSV", "0") == "1",
+                    help="also write artifacts/interactions.csv (debug only)")
+    args = ap.parse_args(argv)
+
+    print(f"[INFO] MONGO_URL={MONGO_URL}")
+    print(f"[INFO] DB_NAME={DB_NAME}")
+    print(f"[INFO] WATCH_COLLECTION={WATCH_COL}")
+    print(f"[INFO] USERS_COLLECTION={USERS_COL}")
+    print(f"[INFO] MOVIES_COLLECTION={MOVIES_COL}")
+    print(f"[INFO] SERIES_COLLECTION={SERIES_COL}")
+    print(f"[INFO] mode={args.mode}{' incremental' if args.incremental else ''}")
+
+    # === Connect ===
+    export_started = datetime.datetime.utcnow()  # watermark cho overlay "đã xem" + lần incremental sau
+    t0 = time.time()
+    client = MongoClient(MONGO_URL)
+    db = client[DB_NAME]
+    cols = set(db.list_collection_names())
+    print(f"[INFO] Collections found: {sorted(cols)}")
+
+    # === Active items ===
+    active_movies, active_series = load_active(db, cols)
+    if not active_movies and not active_series:
+        print("[ERROR] No active movies/series found in DB.")
+        sys.exit(1)
+
+    res, mode = None, args.mode
+    if args.incremental:
+        # delta query dựa vào index lastActionAt / updatedAt — cảnh báo nếu sẽ scan collection
+        SchemaProbe(db, required_indexes(WATCH_COL, USERS_COL, MOVIES_COL)).refresh()
+        res, mode = export_incremental(db, cols, active_movies, active_series, args.batch_size), "incremental"
+        if res is None:
+            mode = "stream"
+    if res is None and mode == "stream":
+        res = export_stream(db, cols, active_movies, active_series, args.batch_size)
+    elif res is None:
+        res = export_full(db, cols, active_movies, active_series)
+
+    # === Write artifacts ===
+    if res is None:
+        print("[ERROR] No interactions found!")
+        sys.exit(1)
+    users, items, uu, ii, P = res
+    write_artifacts(users, items, uu, ii, P, export_started, mode, csv=args.csv)
+
+    # Category id theo item + vector sở thích theo user (watch + like), căn theo index của model
+    try:
+        prof = build_category_profile(db, users, items, uu, ii, P[:, SRC_WATCH] + P[:, SRC_LIKE],
+                                      movies_col=MOVIES_COL, series_col=SERIES_COL)
+        print(f"[INFO] Saved artifacts/category_profile.npz: {prof.stats()}")
+    except Exception as e:
+        print("[WARN] category profile build failed:", e)
+
+    print(f"[DONE] Exported users={len(users)} items={len(items)} interactions={uu.shape[0]} "
+          f"in {time.time() - t0:.1f}s")
+    print("[NEXT] Run: python train_als.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# fold_in.py — Online fold-in: factor vector cho user mới/stale mà không train lại
+# Giải bước least-squares của ALS với V cố định (cùng công thức implicit.cpu.als):
+#   A = VᵀV + λI + Σ_i (c_i − 1) v_i v_iᵀ ,  b = Σ_i c_i v_i ,  u = A⁻¹ b
+#   c_i = FOLDIN_ALPHA × score_i, score theo trọng số của export_interactions.py
+import os, time, datetime, threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from export_interactions import watch_score, LIKE_WEIGHT
+from id_codec import item_code, rows_for
+from seen_index import playback_item_code
+
+FOLDIN_ENABLED = os.getenv("FOLDIN_ENABLED", "1") == "1"
+FOLDIN_STALE   = os.getenv("FOLDIN_STALE", "1") == "1"       # user đã có nhưng có lượt xem sau export
+FOLDIN_TTL     = float(os.getenv("FOLDIN_TTL", "300"))
+FOLDIN_SIZE    = int(os.getenv("FOLDIN_SIZE", "20000"))
+FOLDIN_DAYS    = int(os.getenv("FOLDIN_DAYS", "0"))          # 0 = toàn bộ lịch sử của user
+FOLDIN_MIN_ITEMS = int(os.getenv("FOLDIN_MIN_ITEMS", "1"))
+# Mặc định lấy alpha / regularization từ train_meta.json của model; env chỉ dùng khi artifacts cũ không có
+FOLDIN_ALPHA   = float(os.getenv("FOLDIN_ALPHA", "15.0"))
+FOLDIN_REG     = float(os.getenv("FOLDIN_REG", "0.02"))
+
+
+def solve_user(V: np.ndarray, YtY: np.ndarray, items: np.ndarray, scores: np.ndarray,
+               alpha: float = FOLDIN_ALPHA, reg: float = FOLDIN_REG) -> np.ndarray:
+    """Một dense solve (factors × factors) cho một user."""
+    Vi = np.asarray(V[items], dtype=np.float64)
+    c = alpha * scores.astype(np.float64)
+    A = YtY + reg * np.eye(YtY.shape[0]) + (Vi * (c - 1.0)[:, None]).T @ Vi
+    b = Vi.T @ c
+    return np.linalg.solve(A, b).astype(np.float32)
+
+
+class FoldIn:
+    """
+    user → (vector, item idx, score) với LRU + TTL. Vector gắn với model version:
+    model reload → entry cũ tự hết hiệu lực.
+    """
+
+    def __init__(self, db, playback_col: str, users_col: str = "users",
+                 ttl: float = FOLDIN_TTL, max_size: int = FOLDIN_SIZE):
+        self.db = db
+        self.playback_col = playback_col
+        self.users_col = users_col
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # uid -> (expires, version, result)
+        self._gram: Dict[str, np.ndarray] = {}                  # model version -> VᵀV
+        self._lock = threading.Lock()
+        self.solves = 0
+        self.hits = 0
+
+    def _yty(self, m) -> np.ndarray:
+        g = self._gram.get(m.version)
+        if g is None:
+            V = np.asarray(m.V, dtype=np.float64)
+            g = V.T @ V
+            self._gram = {m.version: g}  # chỉ giữ version hiện tại
+        return g
+
+    _PB_PROJ = {"userId": 1, "movieId": 1, "seasonNumber": 1, "episodeNumber": 1, "progressPct": 1, "finished": 1}
+
+    def _playback_query(self, user_match) -> dict:
+        q = {"userId": user_match}
+        if FOLDIN_DAYS > 0:
+            q["lastActionAt"] = {"$gte": datetime.datetime.utcnow() - datetime.timedelta(days=FOLDIN_DAYS)}
+        return q
+
+    def interactions(self, m, oid) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(item idx, score, watched) từ playback_state + likedItems, trọng số như export_interactions.py."""
+        docs = list(self.db[self.playback_col].find(self._playback_query(oid), self._PB_PROJ))
+        udoc = self.db[self.users_col].find_one({"_id": oid}, {"likedItems": 1}) or {}
+        return self._scores(m, docs, udoc)
+
+    def interactions_many(self, m, oids: list) -> Dict:
+        """Như interactions() cho nhiều user: một query $in mỗi collection → {oid: (items, scores, watched)}."""
+        docs: Dict = {o: [] for o in oids}
+        for w in self.db[self.playback_col].find(self._playback_query({"$in": oids}), self._PB_PROJ):
+            if w.get("userId") in docs:
+                docs[w["userId"]].append(w)
+        udocs = {d["_id"]: d for d in self.db[self.users_col].find({"_id": {"$in": oids}}, {"likedItems": 1})}
+        return {o: self._scores(m, docs[o], udocs.get(o) or {}) for o in oids}
+
+    @staticmethod
+    def _scores(m, docs: list, udoc: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Item code (id_codec) của cả lịch sử → một lần tra index thay vì dựng chuỗi key từng dòng."""
+        scores: Dict[int, float] = {}
+        watched = set()
+        rows = rows_for(m.item_index, [playback_item_code(w) for w in docs], item=True)
+        for w, i in zip(docs, rows.tolist()):
+            if i >= 0:
+                scores[i] = scores.get(i, 0.0) + watch_score(w.get("progressPct", 0), w.get("finished"))
+                watched.add(i)
+        likes = [it for it in (udoc.get("likedItems") or [])
+                 if isinstance(it, dict) and it.get("kind") in ("Movie", "Series") and it.get("refId")]
+        rows = rows_for(m.item_index, [item_code(it["refId"], it["kind"] == "Series") for it in likes], item=True)
+        for i in rows.tolist():
+            if i >= 0:
+                scores[i] = scores.get(i, 0.0) + LIKE_WEIGHT
+        items = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        return (items, np.fromiter(scores.values(), dtype=np.float32, count=len(scores)),
+                np.fromiter(watched, dtype=np.int64, count=len(watched)))
+
+    def _cached(self, m, uid: str, now: float):
+        """(hit, result) — hit=False khi không có / hết hạn / khác model version."""
+        with self._lock:
+            ent = self._cache.get(uid)
+            if ent is not None and ent[0] > now and ent[1] == m.version:
+                self._cache.move_to_end(uid)
+                self.hits += 1
+                return True, ent[2]
+        return False, None
+
+    def _solve(self, m, uid: str, now: float, items, scores, watched) -> Optional[dict]:
+        res = None
+        if items.size >= FOLDIN_MIN_ITEMS:
+            meta = getattr(m, "train_meta", None) or {}
+            res = {"vector": solve_user(m.V, self._yty(m), items, scores,
+                                        alpha=float(meta.get("alpha", FOLDIN_ALPHA)),
+                                        reg=float(meta.get("regularization", FOLDIN_REG))),
+                   "items": items, "scores": scores, "watched": watched}
+            self.solves += 1
+
+        with self._lock:
+            self._cache[uid] = (now + self.ttl, m.version, res)
+            self._cache.move_to_end(uid)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return res
+
+    def get(self, m, uid: str, oid) -> Optional[dict]:
+        """{"vector", "items", "scores", "watched"} hoặc None nếu user chưa đủ tương tác."""
+        now = time.monotonic()
+        hit, res = self._cached(m, uid, now)
+        if hit:
+            return res
+        return self._solve(m, uid, now, *self.interactions(m, oid))
+
+    def get_many(self, m, users: Dict[str, object]) -> Dict[str, Optional[dict]]:
+        """{uid: oid} → {uid: kết quả như get()}; user chưa có trong cache đọc DB chung một lần."""
+        now = time.monotonic()
+        out: Dict[str, Optional[dict]] = {}
+        miss = {}
+        for uid, oid in users.items():
+            hit, res = self._cached(m, uid, now)
+            if hit:
+                out[uid] = res
+            else:
+                miss[uid] = oid
+        if miss:
+            inter = self.interactions_many(m, list(set(miss.values())))
+            for uid, oid in miss.items():
+                out[uid] = self._solve(m, uid, now, *inter[oid])
+        return out
+
+    def invalidate(self, uid: str):
+        with self._lock:
+            self._cache.pop(uid, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._cache)
+        return {"enabled": FOLDIN_ENABLED, "stale": FOLDIN_STALE, "size": size, "ttl": self.ttl,
+                "solves": self.solves, "hits": self.hits}
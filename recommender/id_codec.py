@@ -0,0 +1,228 @@
+# id_codec.py — ObjectId ↔ binary 12 byte ↔ dense int (thay chuỗi hex 24 ký tự trong export / train / serve)
+#   user code : 12 byte ObjectId                                  (dtype S12)
+#   item code : 1 byte kind (bit 0: 0 = movie, 1 = series) + 12 byte (dtype S13)
+#   Thứ tự sort của code trùng với sort chuỗi "<hex>" / "movie:<hex>" < "series:<hex>" → map cũ vẫn khớp.
+#   CodeIndex : sorted codes + order (int32) → np.searchsorted, mmap được; cùng API với id_index.IdIndex
+#   Lưu ý: phần tử đọc từ mảng S* bị numpy cắt byte 0 ở cuối → luôn lấy bytes qua code_list() / tobytes().
+import os
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+from bson import ObjectId
+
+OID_BYTES = 12
+USER_DTYPE = np.dtype(f"S{OID_BYTES}")
+ITEM_DTYPE = np.dtype(f"S{OID_BYTES + 1}")
+KIND_SERIES = 1
+KIND_PREFIX = (b"\x00", b"\x01")  # [is_series] → byte đầu của item code
+KIND_NAMES = ("movie", "series")
+
+
+def oid_bytes(x) -> Optional[bytes]:
+    """ObjectId | hex 24 ký tự | {"$oid": ...} | 12 byte → 12 byte; id khác (không phải ObjectId) → None."""
+    if isinstance(x, ObjectId):
+        return x.binary
+    if isinstance(x, dict):
+        x = x.get("$oid")
+    if isinstance(x, bytes):
+        return x if len(x) == OID_BYTES else None
+    if isinstance(x, str) and len(x) == 2 * OID_BYTES:
+        try:
+            return bytes.fromhex(x)
+        except ValueError:
+            return None
+    return None
+
+
+def item_code(oid, is_series: bool) -> Optional[bytes]:
+    b = oid_bytes(oid)
+    return KIND_PREFIX[bool(is_series)] + b if b is not None else None
+
+
+def key_code(key: str, item: bool) -> Optional[bytes]:
+    """"<hex>" (user) / "movie:<hex>" / "series:<hex>" → code; chuỗi không hợp lệ → None."""
+    if not item:
+        return oid_bytes(key)
+    kind, _, oid = key.partition(":")
+    if kind not in KIND_NAMES:
+        return None
+    return item_code(oid, kind == "series")
+
+
+def code_key(code: bytes, item: bool) -> str:
+    if not item:
+        return bytes(code).ljust(OID_BYTES, b"\0").hex()
+    code = bytes(code).ljust(OID_BYTES + 1, b"\0")
+    return f"{KIND_NAMES[code[0] & KIND_SERIES]}:{code[1:].hex()}"
+
+
+def _dtype(item: bool) -> np.dtype:
+    return ITEM_DTYPE if item else USER_DTYPE
+
+
+def encode_keys(keys: Sequence[str], item: bool) -> np.ndarray:
+    """Vectorized: một lần bytes.fromhex cho cả list. Id không phải ObjectId → ValueError."""
+    n = len(keys)
+    if not item:
+        hexes = keys
+        kinds = None
+    else:
+        parts = [k.partition(":") for k in keys]
+        if any(p[0] not in KIND_NAMES for p in parts):
+            raise ValueError("item key must be 'movie:<id>' or 'series:<id>'")
+        kinds = np.fromiter((p[0] == "series" for p in parts), dtype=np.uint8, count=n)
+        hexes = [p[2] for p in parts]
+    if any(len(h) != 2 * OID_BYTES for h in hexes):
+        raise ValueError("id is not a 24-char ObjectId hex string")
+    raw = np.frombuffer(bytes.fromhex("".join(hexes)), dtype=np.uint8).reshape(n, OID_BYTES)
+    if kinds is not None:
+        raw = np.concatenate([kinds[:, None], raw], axis=1)
+    return as_codes(raw)
+
+
+def as_codes(raw: np.ndarray) -> np.ndarray:
+    """(n, width) uint8 → (n,) S<width>."""
+    raw = np.ascontiguousarray(raw, dtype=np.uint8)
+    return raw.view(f"S{raw.shape[1]}").reshape(raw.shape[0])
+
+
+def code_list(codes: np.ndarray) -> List[bytes]:
+    """Mảng S* → list bytes đủ độ dài (không bị cắt byte 0 cuối như khi đọc từng phần tử)."""
+    w = codes.dtype.itemsize
+    buf = np.ascontiguousarray(codes).tobytes()
+    return [buf[j:j + w] for j in range(0, len(buf), w)]
+
+
+def decode_codes(codes, item: bool) -> List[str]:
+    """Vectorized code → id string: một lần .hex() cho cả mảng rồi cắt."""
+    codes = np.asarray(codes, dtype=_dtype(item))
+    n, w = codes.shape[0], codes.dtype.itemsize
+    raw = np.ascontiguousarray(codes).view(np.uint8).reshape(n, w)
+    h = raw[:, w - OID_BYTES:].tobytes().hex()
+    hexes = [h[j:j + 2 * OID_BYTES] for j in range(0, len(h), 2 * OID_BYTES)]
+    if not item:
+        return hexes
+    return [f"{KIND_NAMES[k & KIND_SERIES]}:{x}" for k, x in zip(raw[:, 0].tolist(), hexes)]
+
+
+def save_code_arrays(art_dir: str, name: str, keys: List[str], item: bool) -> bool:
+    """
+    <name>_codes.npy        : code theo thứ tự hàng của factor matrix
+    <name>_codes_sorted.npy : cùng code, đã sort (searchsorted trên memmap)
+    <name>_codes_order.npy  : vị trí sorted → hàng (int32)
+    False nếu có id không phải ObjectId (caller dùng id_index.save_id_arrays).
+    """
+    try:
+        codes = encode_keys(keys, item)
+    except ValueError:
+        return False
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    np.save(os.path.join(art_dir, f"{name}_codes.npy"), codes)
+    np.save(os.path.join(art_dir, f"{name}_codes_sorted.npy"), codes[order])
+    np.save(os.path.join(art_dir, f"{name}_codes_order.npy"), order)
+    return True
+
+
+class CodeList:
+    """Read-only sequence view (row → id string) over a code array."""
+
+    def __init__(self, codes: np.ndarray, item: bool):
+        self.codes = codes
+        self.item = item
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, i) -> str:
+        return code_key(self.codes[int(i)], self.item)
+
+    def __iter__(self):
+        for s in range(0, len(self), 65536):
+            yield from decode_codes(self.codes[s:s + 65536], self.item)
+
+    def keys(self, idx) -> List[str]:
+        """Nhiều hàng một lần (result list, candidate pool)."""
+        return decode_codes(self.codes[np.asarray(idx, dtype=np.int64)], self.item)
+
+
+class CodeIndex:
+    """Mapping-like id string → row over (sorted codes, order) using np.searchsorted."""
+
+    def __init__(self, sorted_codes: np.ndarray, order: np.ndarray, item: bool):
+        self.sorted = sorted_codes
+        self.order = order
+        self.item = item
+
+    @classmethod
+    def from_keys(cls, keys: Sequence[str], item: bool) -> "CodeIndex":
+        codes = encode_keys(keys, item)
+        order = np.argsort(codes, kind="stable").astype(np.int32)
+        return cls(codes[order], order, item)
+
+    @classmethod
+    def load(cls, art_dir: str, name: str, item: bool, mmap: bool = True) -> "CodeIndex":
+        mode = "r" if mmap else None
+        srt = np.load(os.path.join(art_dir, f"{name}_codes_sorted.npy"), mmap_mode=mode)
+        order = np.load(os.path.join(art_dir, f"{name}_codes_order.npy"), mmap_mode=mode)
+        if srt.shape[0] != order.shape[0] or srt.dtype != _dtype(item):
+            raise RuntimeError(f"{name} code arrays mismatch")
+        return cls(srt, order, item)
+
+    def __len__(self) -> int:
+        return self.sorted.shape[0]
+
+    def get_code(self, code: Optional[bytes], default: Optional[int] = None) -> Optional[int]:
+        if code is None or len(code) != self.sorted.dtype.itemsize:
+            return default
+        i = int(self.lookup_codes([code])[0])  # so sánh trên mảng S* (phần tử đơn lẻ bị cắt byte 0 cuối)
+        return i if i >= 0 else default
+
+    def get(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        return self.get_code(key_code(key, self.item) if isinstance(key, str) else None, default)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> int:
+        i = self.get(key)
+        if i is None:
+            raise KeyError(key)
+        return i
+
+    def lookup_codes(self, codes) -> np.ndarray:
+        """Vectorized: rows for many codes (bytes list / S array), -1 where missing."""
+        q = np.asarray(codes, dtype=self.sorted.dtype)
+        if not q.size or not self.sorted.shape[0]:
+            return np.full(q.shape[0], -1, dtype=np.int64)
+        j = np.minimum(np.searchsorted(self.sorted, q), self.sorted.shape[0] - 1)
+        return np.where(self.sorted[j] == q, self.order[j], -1).astype(np.int64)
+
+    def lookup(self, keys: Iterable[str]) -> np.ndarray:
+        """Như IdIndex.lookup: id strings → rows, -1 where missing / không hợp lệ."""
+        codes = [key_code(k, self.item) for k in keys]
+        ok = np.array([c is not None for c in codes], dtype=bool)
+        rows = self.lookup_codes([c if c is not None else b"" for c in codes])
+        return np.where(ok, rows, -1)
+
+
+def index_for(keys: Sequence[str], item: bool):
+    """CodeIndex khi mọi id là ObjectId; ngược lại dict (map cũ có id tự do)."""
+    try:
+        return CodeIndex.from_keys(keys, item)
+    except ValueError:
+        return {k: i for i, k in enumerate(keys)}
+
+
+def rows_for(index, codes: List[Optional[bytes]], item: bool) -> np.ndarray:
+    """Code → row qua CodeIndex (một searchsorted) hoặc dict (decode từng code); -1 = không có."""
+    if isinstance(index, CodeIndex):
+        ok = np.array([c is not None for c in codes], dtype=bool)
+        return np.where(ok, index.lookup_codes([c if c is not None else b"" for c in codes]), -1)
+    return np.array([-1 if c is None else index.get(code_key(c, item), -1) for c in codes], dtype=np.int64)
+
+
+def item_keys(items, idx) -> List[str]:
+    """Item index → "movie:<id>" / "series:<id>" (vectorized với CodeList)."""
+    if isinstance(items, CodeList):
+        return items.keys(idx)
+    return [items[i] for i in idx]
@@ -0,0 +1,102 @@
+# id_index.py — id ↔ row lookup trên mảng numpy đã sort (thay list + dict Python)
+# Các mảng được lưu .npy và mở bằng mmap_mode='r' → page cache dùng chung giữa các worker.
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+
+def save_id_arrays(art_dir: str, name: str, ids: List[str]):
+    """
+    <name>_ids.npy        : ids theo thứ tự hàng của factor matrix (fixed-width bytes)
+    <name>_ids_sorted.npy : cùng ids, đã sort (np.searchsorted chạy thẳng trên memmap)
+    <name>_ids_order.npy  : vị trí sorted → hàng
+    """
+    arr = np.array([s.encode("ascii") for s in ids], dtype=f"S{max((len(s) for s in ids), default=1)}")
+    order = np.argsort(arr, kind="stable").astype(np.int64)
+    np.save(os.path.join(art_dir, f"{name}_ids.npy"), arr)
+    np.save(os.path.join(art_dir, f"{name}_ids_sorted.npy"), arr[order])
+    np.save(os.path.join(art_dir, f"{name}_ids_order.npy"), order)
+
+
+def _ascii(key: str) -> Optional[bytes]:
+    try:
+        return key.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+
+
+class IdList:
+    """Read-only sequence view (row → id string) over a bytes array."""
+
+    def __init__(self, keys: np.ndarray):
+        self.keys = keys
+
+    def __len__(self) -> int:
+        return self.keys.shape[0]
+
+    def __getitem__(self, i) -> str:
+        return self.keys[int(i)].decode("ascii")
+
+    def __iter__(self):
+        for k in self.keys:
+            yield k.decode("ascii")
+
+
+class IdIndex:
+    """Mapping-like id → row over (sorted keys, order) using np.searchsorted."""
+
+    def __init__(self, sorted_keys: np.ndarray, order: np.ndarray):
+        self.sorted = sorted_keys
+        self.order = order
+
+    @classmethod
+    def from_ids(cls, ids: List[str]) -> "IdIndex":
+        arr = np.array([s.encode("ascii") for s in ids], dtype=f"S{max((len(s) for s in ids), default=1)}")
+        order = np.argsort(arr, kind="stable")
+        return cls(arr[order], order)
+
+    @classmethod
+    def load(cls, art_dir: str, name: str, mmap: bool = True) -> "IdIndex":
+        mode = "r" if mmap else None
+        srt = np.load(os.path.join(art_dir, f"{name}_ids_sorted.npy"), mmap_mode=mode)
+        order = np.load(os.path.join(art_dir, f"{name}_ids_order.npy"), mmap_mode=mode)
+        if srt.shape[0] != order.shape[0]:
+            raise RuntimeError(f"{name} id arrays mismatch")
+        return cls(srt, order)
+
+    def __len__(self) -> int:
+        return self.sorted.shape[0]
+
+    def get(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        if not key or len(key) > self.sorted.dtype.itemsize:
+            return default
+        try:
+            b = key.encode("ascii")
+        except UnicodeEncodeError:
+            return default
+        j = int(np.searchsorted(self.sorted, b))
+        if j < self.sorted.shape[0] and self.sorted[j] == b:
+            return int(self.order[j])
+        return default
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> int:
+        i = self.get(key)
+        if i is None:
+            raise KeyError(key)
+        return i
+
+    def lookup(self, keys: Iterable[str]) -> np.ndarray:
+        """Vectorized: rows for many ids, -1 where missing."""
+        keys = [_ascii(k) for k in keys]
+        # không encode được (non-ASCII) → như get(): coi là thiếu, không bỏ ký tự rồi khớp nhầm id khác
+        fits = np.array([k is not None and len(k) <= self.sorted.dtype.itemsize for k in keys], dtype=bool)
+        keys = [k or b"" for k in keys]
+        q = np.array(keys, dtype=self.sorted.dtype)
+        if not q.size or not self.sorted.shape[0]:
+            return np.full(q.shape[0], -1, dtype=np.int64)
+        j = np.minimum(np.searchsorted(self.sorted, q), self.sorted.shape[0] - 1)
+        return np.where((self.sorted[j] == q) & fits, self.order[j], -1).astype(np.int64)
@@ -0,0 +1,405 @@
+# ingest_worker.py — Ingest playback_state liên tục thay vì chờ batch export
+#   Nguồn: change stream trên playback_state (cần replica set); không có → polling theo lastActionAt.
+#   Mỗi lần flush: tính lại cột watch của các user vừa đổi (cùng pipeline + WATCH_* với
+#   export_interactions.py), merge vào artifacts/interactions/ (ghi atomically), lưu resume token /
+#   watermark vào artifacts/ingest_state.json → restart đọc tiếp, không mất sự kiện (có thể lặp, vô hại).
+#   Báo API: POST /events/playback/batch ngay khi đọc được (overlay "đã xem", fold-in, result cache)
+#   → serve_api có thể đặt SEEN_POLL_SECONDS=0 khi chạy worker này.
+# Ví dụ:
+#   python ingest_worker.py --notify http://localhost:8000
+#   python ingest_worker.py --source poll --poll-seconds 2 --flush-seconds 10
+# Replica set 1 node để thử change stream trên máy dev:
+#   mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0 &  mongosh --port 27018 --eval 'rs.initiate()'
+#   MONGO_URL=mongodb://localhost:27018/?directConnection=true python ingest_worker.py
+import os, json, time, signal, argparse, datetime, threading, urllib.request
+from typing import Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from export_interactions import (MONGO_URL, DB_NAME, WATCH_COL, SRC_WATCH, STATE_PATH, _Columns, _Encoder,
+                                 _rows_to_parts, _stream_watch, load_active, merge_rows)
+from interactions_io import has_interactions, load_interactions, replace_interactions
+
+INGEST_STATE_PATH    = "artifacts/ingest_state.json"
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "30"))
+INGEST_POLL_SECONDS  = float(os.getenv("INGEST_POLL_SECONDS", "5"))
+INGEST_NOTIFY_URL    = os.getenv("INGEST_NOTIFY_URL", "")   # nhiều API instance: phân tách bằng dấu phẩy
+
+PROJECTION = {"userId": 1, "movieId": 1, "seasonNumber": 1, "episodeNumber": 1, "lastActionAt": 1}
+# Server không phải replica set → polling
+_NO_CHANGE_STREAM = (40573, 40324)
+_HISTORY_LOST = 286
+
+
+class InteractionStore:
+    """artifacts/interactions/ + id maps trong RAM; apply_watch() thay cột watch của các user vừa đổi."""
+
+    def __init__(self, art_dir: str = "artifacts"):
+        self.art_dir = art_dir
+        self.load()
+
+    def _export_mtime(self) -> float:
+        p = os.path.join(self.art_dir, os.path.basename(STATE_PATH))
+        return os.path.getmtime(p) if os.path.exists(p) else 0.0
+
+    def load(self):
+        self.exported_at = self._export_mtime()
+        with open(os.path.join(self.art_dir, "user_id_map.json"), "r", encoding="utf-8") as f:
+            self.uenc = _Encoder(json.load(f)["users"])
+        with open(os.path.join(self.art_dir, "item_id_map.json"), "r", encoding="utf-8") as f:
+            self.ienc = _Encoder(json.load(f)["items"], item=True)
+        prev = load_interactions(self.art_dir, mmap=False, parts=True)
+        self.uu, self.ii, self.P = prev["user_idx"], prev["item_idx"], prev["parts"]
+        self.saved_sizes = (len(self.uenc), len(self.ienc))  # số id đã có trong map trên đĩa
+        self.dirty = False
+
+    def apply_watch(self, db, user_ids: List, active_movies, active_series,
+                    batch_size: int = 5000, chunk: int = 1000) -> int:
+        """Tính lại điểm watch (toàn bộ lịch sử) của user_ids rồi thay vào store. Trả về số dòng mới."""
+        if self._export_mtime() != self.exported_at:
+            # export_interactions.py vừa ghi snapshot mới → lấy nó làm base, không ghi đè bằng bản cũ
+            print("[INFO] new batch export detected — reloading store")
+            self.load()
+        rows = _Columns()
+        for s in range(0, len(user_ids), chunk):
+            _stream_watch(db, rows, self.uenc, self.ienc, active_movies, active_series, batch_size,
+                          match={"userId": {"$in": user_ids[s:s + chunk]}})
+        touched = self.uenc.rows(user_ids)
+        P = self.P.copy()
+        P[np.isin(self.uu, touched), SRC_WATCH] = 0
+        du, di, dP = _rows_to_parts(rows)
+        uu, ii, P = merge_rows(np.concatenate([self.uu, du]), np.concatenate([self.ii, di]),
+                               np.concatenate([P, dP]))
+        keep = (P != 0).any(axis=1)
+        self.uu, self.ii, self.P = uu[keep], ii[keep], P[keep]
+        self.dirty = True
+        return len(rows)
+
+    def save(self):
+        """
+        Id maps trước (chỉ append), rồi store → store trên đĩa luôn khớp với map đã ghi.
+        Map chỉ ghi lại khi có id mới: file map đổi → artifact_version đổi → API reload (mất overlay, cache).
+        """
+        for (name, key, enc), saved in zip((("user_id_map.json", "users", self.uenc),
+                                            ("item_id_map.json", "items", self.ienc)), self.saved_sizes):
+            if len(enc) == saved:
+                continue
+            tmp = os.path.join(self.art_dir, name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({key: enc.ids}, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.art_dir, name))
+        self.saved_sizes = (len(self.uenc), len(self.ienc))
+        replace_interactions(self.art_dir, self.uu, self.ii, self.P, len(self.uenc), len(self.ienc),
+                             extra={"ingested_at": datetime.datetime.utcnow().isoformat()})
+        self.dirty = False
+
+    def stats(self) -> dict:
+        return {"users": len(self.uenc), "items": len(self.ienc), "rows": int(self.uu.shape[0])}
+
+
+class ChangeStreamSource:
+    """playback_state.watch(); resume token để restart đọc tiếp đúng chỗ."""
+    name = "change_stream"
+    unresolved = 0
+
+    def __init__(self, col, resume_token=None):
+        self.col = col
+        self.token = resume_token
+        self.stream = None
+
+    def open(self):
+        kw = {"full_document": "updateLookup", "max_await_time_ms": 1000}
+        if self.token:
+            kw["resume_after"] = self.token
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        try:
+            # pre-image (MongoDB 6+, changeStreamPreAndPostImages) để biết user của document bị xoá
+            self.stream = self.col.watch(pipeline, full_document_before_change="whenAvailable", **kw)
+        except OperationFailure as e:
+            if e.code in _NO_CHANGE_STREAM or e.code == _HISTORY_LOST:
+                raise
+            self.stream = self.col.watch(pipeline, **kw)
+
+    def read(self, max_events: int, max_wait: float) -> List[dict]:
+        if self.stream is None:
+            self.open()
+        out: List[dict] = []
+        deadline = time.monotonic() + max_wait
+        while len(out) < max_events and time.monotonic() < deadline:
+            change = self.stream.try_next()
+            self.token = self.stream.resume_token
+            if change is None:
+                if out:
+                    break
+                continue
+            doc = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+            if doc is None:
+                # delete không có pre-image (hoặc document đã bị xoá trước updateLookup) → lần export sau sửa
+                self.unresolved += 1
+                continue
+            out.append(doc)
+        return out
+
+    def state(self) -> dict:
+        return {"resume_token": self.token}
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class PollSource:
+    """find(lastActionAt > watermark) sort (lastActionAt, _id); cùng mốc thời gian thì theo _id."""
+    name = "poll"
+    unresolved = 0
+
+    def __init__(self, col, watermark: Optional[datetime.datetime], last_id=None, interval: float = INGEST_POLL_SECONDS):
+        self.col = col
+        self.watermark = watermark
+        self.last_id = last_id
+        self.interval = interval
+
+    def read(self, max_events: int, max_wait: float) -> List[dict]:
+        if self.watermark is None:
+            q = {"lastActionAt": {"$ne": None}}
+        elif self.last_id is None:
+            q = {"lastActionAt": {"$gt": self.watermark}}
+        else:
+            q = {"$or": [{"lastActionAt": {"$gt": self.watermark}},
+                         {"lastActionAt": self.watermark, "_id": {"$gt": self.last_id}}]}
+        docs = list(self.col.find(q, PROJECTION).sort([("lastActionAt", 1), ("_id", 1)]).limit(max_events))
+        if docs:
+            self.watermark, self.last_id = docs[-1]["lastActionAt"], docs[-1]["_id"]
+        else:
+            time.sleep(min(self.interval, max_wait))
+        return docs
+
+    def state(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class ApiNotifier:
+    """POST /events/playback/batch tới mỗi API instance; lỗi chỉ cảnh báo (API vẫn tự poll overlay được)."""
+
+    def __init__(self, urls: str, timeout: float = 2.0, chunk: int = 500):
+        self.urls = [u.rstrip("/") for u in urls.split(",") if u.strip()]
+        self.timeout = timeout
+        self.chunk = chunk
+        self.sent = 0
+        self.errors = 0
+
+    def send(self, events: List[dict]):
+        for base in self.urls:
+            for s in range(0, len(events), self.chunk):
+                body = json.dumps({"events": events[s:s + self.chunk]}).encode("utf-8")
+                req = urllib.request.Request(f"{base}/events/playback/batch", data=body,
+                                             headers={"Content-Type": "application/json"})
+                try:
+                    with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                        r.read()
+                    self.sent += len(events[s:s + self.chunk])
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[WARN] notify {base} failed:", e)
+
+
+def _event(doc: dict) -> Optional[dict]:
+    if not doc.get("userId") or not doc.get("movieId"):
+        return None
+    return {"userId": str(doc["userId"]), "movieId": str(doc["movieId"]),
+            "seasonNumber": doc.get("seasonNumber"), "episodeNumber": doc.get("episodeNumber")}
+
+
+def load_state(path: str = INGEST_STATE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("watermark"):
+        state["watermark"] = datetime.datetime.fromisoformat(state["watermark"])
+    return state
+
+
+def _export_watermark() -> Optional[datetime.datetime]:
+    if not os.path.exists(STATE_PATH):
+        return None
+    with open(STATE_PATH, "r", encoding="utf-8") as f:
+        wm = json.load(f).get("watermark")
+    return datetime.datetime.fromisoformat(wm) if wm else None
+
+
+def save_state(state: dict, path: str = INGEST_STATE_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, default=lambda o: o.isoformat() if isinstance(o, datetime.datetime) else str(o))
+    os.replace(tmp, path)
+
+
+class IngestWorker:
+    def __init__(self, db, store: InteractionStore, source: str = "auto", notifier: Optional[ApiNotifier] = None,
+                 flush_seconds: float = INGEST_FLUSH_SECONDS, poll_seconds: float = INGEST_POLL_SECONDS,
+                 batch: int = 1000, max_pending: int = 50000, active_seconds: float = 600.0,
+                 state_path: str = INGEST_STATE_PATH):
+        self.db, self.store, self.notifier = db, store, notifier
+        self.flush_seconds, self.poll_seconds = flush_seconds, poll_seconds
+        self.batch, self.max_pending, self.active_seconds = batch, max_pending, active_seconds
+        self.state_path = state_path
+        self.state = load_state(state_path)
+        self.pending: Dict[str, object] = {}     # str(userId) → userId gốc (ObjectId) cho $in
+        # lần chạy đầu: đọc bù từ watermark của lần export gần nhất
+        self.watermark: Optional[datetime.datetime] = self.state.get("watermark") or _export_watermark()
+        self.stop = threading.Event()
+        self.counts = {"events": 0, "flushes": 0, "rows": 0}
+        self._active_at = 0.0
+        self.active_movies, self.active_series = set(), set()
+        self.source = self._open_source(source)
+
+    def _open_source(self, kind: str):
+        col = self.db[WATCH_COL]
+        if kind in ("auto", "stream"):
+            src = ChangeStreamSource(col, self.state.get("resume_token"))
+            try:
+                src.open()
+                print(f"[INFO] source=change_stream (resume={'yes' if src.token else 'no'})")
+                if not src.token and self.watermark is not None:
+                    self._catch_up(col)
+                return src
+            except Exception as e:  # standalone mongod: OperationFailure; driver giả lập: không có watch()
+                code = getattr(e, "code", None)
+                if kind == "stream" and code != _HISTORY_LOST:
+                    raise
+                if code == _HISTORY_LOST:
+                    # oplog đã trôi qua resume token → đọc bù theo watermark rồi mở stream mới
+                    print("[WARN] change stream history lost — catching up by lastActionAt")
+                    self.state.pop("resume_token", None)
+                    return self._open_source(kind)
+                print(f"[WARN] change stream unavailable ({e}) — polling lastActionAt every {self.poll_seconds}s")
+        print(f"[INFO] source=poll since {self.watermark.isoformat() if self.watermark else 'beginning'}")
+        last_id = self.state.get("last_id")
+        return PollSource(col, self.watermark, ObjectId(last_id) if last_id and ObjectId.is_valid(last_id) else last_id,
+                          self.poll_seconds)
+
+    def _catch_up(self, col):
+        """Đọc hết lastActionAt > watermark (khoảng trống giữa lần chạy trước và stream mới)."""
+        src = PollSource(col, self.watermark, None, 0)
+        while True:
+            docs = src.read(self.batch, 0)
+            if not docs:
+                break
+            self._collect(docs)
+
+    def _refresh_active(self):
+        if time.monotonic() - self._active_at >= self.active_seconds:
+            self.active_movies, self.active_series = load_active(self.db, set(self.db.list_collection_names()))
+            self._active_at = time.monotonic()
+
+    def _collect(self, docs: List[dict]):
+        events = []
+        for d in docs:
+            ev = _event(d)
+            if ev is None:
+                continue
+            events.append(ev)
+            self.pending[ev["userId"]] = d["userId"]
+            ts = d.get("lastActionAt")
+            if isinstance(ts, datetime.datetime) and (self.watermark is None or ts > self.watermark):
+                self.watermark = ts
+        self.counts["events"] += len(events)
+        if events and self.notifier is not None:
+            self.notifier.send(events)
+
+    def flush(self):
+        """Pending users → store trên đĩa → state. State chỉ tiến sau khi store đã ghi xong."""
+        if self.pending:
+            self._refresh_active()
+            t = time.perf_counter()
+            rows = self.store.apply_watch(self.db, list(self.pending.values()), self.active_movies, self.active_series)
+            self.store.save()
+            self.counts["flushes"] += 1
+            self.counts["rows"] += rows
+            print(f"[INFO] flush: users={len(self.pending)} rows={rows} store={self.store.stats()} "
+                  f"in {time.perf_counter() - t:.2f}s")
+            self.pending.clear()
+        save_state(self._source_state(), self.state_path)
+
+    def _source_state(self) -> dict:
+        state = dict(self.source.state(), source=self.source.name, watermark=self.watermark)
+        if isinstance(self.source, PollSource) and self.source.last_id is not None:
+            state["last_id"] = str(self.source.last_id)
+        return state
+
+    def run(self, once: bool = False):
+        last_flush = time.monotonic()
+        while not self.stop.is_set():
+            try:
+                docs = self.source.read(self.batch, max_wait=1.0)
+            except PyMongoError as e:
+                print("[WARN] source read failed, reopening:", e)
+                self.source.close()
+                self.state.update(self._source_state())
+                if getattr(e, "code", None) == _HISTORY_LOST:
+                    self.state.pop("resume_token", None)  # mở stream mới + đọc bù theo watermark
+                else:
+                    self.stop.wait(self.poll_seconds)
+                self.source = self._open_source("auto" if self.source.name == "change_stream" else "poll")
+                continue
+            self._collect(docs)
+            if time.monotonic() - last_flush >= self.flush_seconds or len(self.pending) >= self.max_pending:
+                self.flush()
+                last_flush = time.monotonic()
+            if once and not docs:
+                break
+        self.flush()
+        self.source.close()
+        if self.source.unresolved:
+            print(f"[WARN] {self.source.unresolved} change events without document (deletes) — fixed by next export")
+
+    def stats(self) -> dict:
+        return dict(self.counts, source=self.source.name, pending=len(self.pending),
+                    watermark=self.watermark.isoformat() if self.watermark else None,
+                    notified=self.notifier.sent if self.notifier else 0)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tail playback_state and keep artifacts/interactions up to date")
+    ap.add_argument("--source", choices=["auto", "stream", "poll"], default=os.getenv("INGEST_SOURCE", "auto"))
+    ap.add_argument("--notify", type=str, default=INGEST_NOTIFY_URL, help="serve_api base URL(s), phân tách bằng dấu phẩy")
+    ap.add_argument("--flush-seconds", type=float, default=INGEST_FLUSH_SECONDS)
+    ap.add_argument("--poll-seconds", type=float, default=INGEST_POLL_SECONDS)
+    ap.add_argument("--batch", type=int, default=1000, help="số sự kiện tối đa mỗi lần đọc")
+    ap.add_argument("--max-pending", type=int, default=50000, help="flush sớm khi có chừng này user chờ")
+    ap.add_argument("--once", action="store_true", help="đọc đến khi hết sự kiện mới, flush rồi thoát (cron / test)")
+    args = ap.parse_args(argv)
+
+    if not has_interactions("artifacts"):
+        raise SystemExit("[ERROR] Missing artifacts/interactions/. Run export_interactions.py first.")
+    print(f"[INFO] MONGO_URL={MONGO_URL} DB_NAME={DB_NAME} WATCH_COLLECTION={WATCH_COL}")
+    client = MongoClient(MONGO_URL)
+    db = client[DB_NAME]
+    store = InteractionStore("artifacts")
+    print(f"[INFO] store: {store.stats()}")
+    notifier = ApiNotifier(args.notify) if args.notify else None
+    worker = IngestWorker(db, store, args.source, notifier, args.flush_seconds, args.poll_seconds,
+                          args.batch, args.max_pending)
+
+    def _stop(*_):
+        print("[INFO] stopping (flush pending)...")
+        worker.stop.set()
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    worker.run(once=args.once)
+    print(f"[DONE] {worker.stats()}")
+    client.close()
+    return worker
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# interactions_io.py — Binary columnar interaction artifact (thay interactions.csv)
+#   artifacts/interactions/
+#     user_idx.npy  int32   (sorted theo (user, item) → đúng thứ tự CSR)
+#     item_idx.npy  int32
+#     score.npy     float32 (tổng các nguồn)
+#     parts.npy     float32 (n, 3): watch / like / rating — cho export --incremental
+#     meta.json     {"n_users", "n_items", "rows"}
+import os, json, shutil
+from typing import Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+INTERACTIONS_DIR = "interactions"
+
+
+def save_interactions(art_dir: str, uu: np.ndarray, ii: np.ndarray, P: np.ndarray,
+                      n_users: int, n_items: int, extra: Optional[dict] = None, name: str = INTERACTIONS_DIR) -> str:
+    """uu/ii must already be unique and sorted by (user, item)."""
+    d = os.path.join(art_dir, name)
+    os.makedirs(d, exist_ok=True)
+    np.save(os.path.join(d, "user_idx.npy"), uu.astype(np.int32, copy=False))
+    np.save(os.path.join(d, "item_idx.npy"), ii.astype(np.int32, copy=False))
+    np.save(os.path.join(d, "score.npy"), P.sum(axis=1).astype(np.float32))
+    np.save(os.path.join(d, "parts.npy"), P.astype(np.float32, copy=False))
+    meta = {"n_users": int(n_users), "n_items": int(n_items), "rows": int(uu.shape[0]), **(extra or {})}
+    with open(os.path.join(d, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return d
+
+
+def replace_interactions(art_dir: str, uu: np.ndarray, ii: np.ndarray, P: np.ndarray,
+                         n_users: int, n_items: int, extra: Optional[dict] = None) -> str:
+    """Như save_interactions nhưng ghi vào thư mục tạm rồi đổi tên → reader không thấy file ghi dở."""
+    tmp = save_interactions(art_dir, uu, ii, P, n_users, n_items, extra, name=INTERACTIONS_DIR + ".tmp")
+    d = os.path.join(art_dir, INTERACTIONS_DIR)
+    old = d + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(d):
+        os.rename(d, old)
+    os.rename(tmp, d)
+    shutil.rmtree(old, ignore_errors=True)
+    return d
+
+
+def has_interactions(art_dir: str) -> bool:
+    return os.path.exists(os.path.join(art_dir, INTERACTIONS_DIR, "meta.json"))
+
+
+def load_interactions(art_dir: str, mmap: bool = True, parts: bool = False) -> dict:
+    d = os.path.join(art_dir, INTERACTIONS_DIR)
+    mode = "r" if mmap else None
+    with open(os.path.join(d, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    out = {
+        "meta": meta,
+        "user_idx": np.load(os.path.join(d, "user_idx.npy"), mmap_mode=mode),
+        "item_idx": np.load(os.path.join(d, "item_idx.npy"), mmap_mode=mode),
+        "score": np.load(os.path.join(d, "score.npy"), mmap_mode=mode),
+    }
+    if parts:
+        out["parts"] = np.load(os.path.join(d, "parts.npy"), mmap_mode=mode)
+    if out["user_idx"].shape[0] != meta["rows"]:
+        raise RuntimeError("interactions artifact is truncated")
+    return out
+
+
+def to_csr(user_idx: np.ndarray, item_idx: np.ndarray, data: np.ndarray, n_users: int, n_items: int) -> csr_matrix:
+    """
+    (users, items) CSR straight from the sorted columns: indptr từ bincount,
+    indices/data dùng lại mảng (memmap) không copy.
+    """
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(np.bincount(user_idx, minlength=n_users), out=indptr[1:])
+    return csr_matrix((data, item_idx, indptr), shape=(n_users, n_items), copy=False)
+
+
+def write_csv(path: str, uu: np.ndarray, ii: np.ndarray, ss: np.ndarray, chunk: int = 500000):
+    """Debug output (định dạng cũ: user_idx,item_idx,score)."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("user_idx,item_idx,score\n")
+        for s in range(0, uu.shape[0], chunk):
+            f.writelines(f"{u},{i},{round(v, 6)}\n" for u, i, v in
+                         zip(uu[s:s + chunk].tolist(), ii[s:s + chunk].tolist(), ss[s:s + chunk].tolist()))
@@ -0,0 +1,152 @@
+# item_cache.py — In-process cache for movie/series metadata
+# Key: "movie:<id>" / "series:<id>" (giống item_id_map.json)
+import time, asyncio, threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+def _split_key(key: str):
+    parts = key.split(":", 1)
+    return (parts[0], parts[1]) if len(parts) == 2 else ("movie", key)
+
+
+class ItemMetaCache:
+    """
+    LRU + TTL cache in front of a metadata loader.
+
+    `loader(kind, oid_list) -> {oid: meta}` is only called for keys that are
+    missing or expired. Items that do not exist in the DB are cached as
+    "negative" entries so deleted titles are not re-queried on every request.
+    """
+
+    def __init__(self, loader: Callable[[str, List[str]], Dict[str, dict]],
+                 ttl: float = 600.0, max_size: int = 50000):
+        self.loader = loader
+        self.ttl = float(ttl)
+        self.max_size = int(max_size)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, meta|None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def _put(self, key: str, meta: Optional[dict], now: float):
+        self._data[key] = (now + self.ttl, meta)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, keys: Iterable[str], now: float):
+        res: Dict[str, dict] = {}
+        missing: Dict[str, List[str]] = {}
+        with self._lock:
+            for k in keys:
+                ent = self._data.get(k)
+                if ent is not None and ent[0] > now:
+                    self._data.move_to_end(k)
+                    self.hits += 1
+                    if ent[1] is not None:
+                        res[k] = ent[1]
+                    continue
+                self.misses += 1
+                kind, oid = _split_key(k)
+                missing.setdefault(kind, []).append(oid)
+        return res, {kind: oids for kind, oids in missing.items() if kind in ("movie", "series")}
+
+    def _store(self, missing: Dict[str, List[str]], chunks: List[Dict[str, dict]], now: float) -> Dict[str, dict]:
+        loaded: Dict[str, dict] = {}
+        for (kind, oids), chunk in zip(missing.items(), chunks):
+            self.loads += 1
+            for oid in oids:
+                loaded[f"{kind}:{oid}"] = chunk.get(oid)
+        with self._lock:
+            for k, m in loaded.items():
+                self._put(k, m, now)
+        return {k: m for k, m in loaded.items() if m is not None}
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """Return {key: meta} for every key that exists in the DB."""
+        now = time.monotonic()
+        res, missing = self._lookup(keys, now)
+        if missing:
+            res.update(self._store(missing, [self.loader(kind, oids) for kind, oids in missing.items()], now))
+        return res
+
+    async def get_many_async(self, keys: Iterable[str],
+                             aloader: Callable[[str, List[str]], Awaitable[Dict[str, dict]]]) -> Dict[str, dict]:
+        """Như get_many; movie/series còn thiếu được load đồng thời bằng `aloader` (async driver)."""
+        now = time.monotonic()
+        res, missing = self._lookup(keys, now)
+        if missing:
+            chunks = await asyncio.gather(*(aloader(kind, oids) for kind, oids in missing.items()))
+            res.update(self._store(missing, list(chunks), now))
+        return res
+
+    def warm(self, keys: Iterable[str], batch: int = 1000) -> int:
+        """Preload keys (e.g. toàn bộ item_id_map.json) in batches."""
+        keys = list(keys)
+        for i in range(0, len(keys), batch):
+            self.invalidate(keys[i:i + batch])
+            self.get_many(keys[i:i + batch])
+        return len(keys)
+
+    def invalidate(self, keys: Optional[Iterable[str]] = None) -> int:
+        """Drop given keys (or everything when keys is None)."""
+        with self._lock:
+            if keys is None:
+                n = len(self._data)
+                self._data.clear()
+                return n
+            n = 0
+            for k in keys:
+                if self._data.pop(k, None) is not None:
+                    n += 1
+            return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+def watch_catalog_changes(db, cache: ItemMetaCache, stop: threading.Event,
+                          on_change: Optional[Callable[[str], None]] = None):
+    """
+    Invalidate cache entries from MongoDB change streams on movies/series.
+    on_change(item_key) chạy sau mỗi invalidation (vd. xoá response cache đang chứa metadata cũ).
+    Requires a replica set; returns silently (with a warning) otherwise.
+    """
+    def _run(col_name: str, kind: str):
+        try:
+            with db[col_name].watch(
+                [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}],
+                max_await_time_ms=1000,
+            ) as stream:
+                while not stop.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    oid = str(change.get("documentKey", {}).get("_id"))
+                    cache.invalidate([f"{kind}:{oid}"])
+                    if on_change is not None:
+                        on_change(f"{kind}:{oid}")
+        except Exception as e:
+            print(f"[WARN] item cache watcher on '{col_name}' stopped:", e)
+
+    threads = []
+    for col_name, kind in (("movies", "movie"), ("series", "series")):
+        t = threading.Thread(target=_run, args=(col_name, kind), daemon=True,
+                             name=f"item-cache-watch-{kind}")
+        t.start()
+        threads.append(t)
+    return threads
@@ -0,0 +1,101 @@
+# loadtest_api.py — p50/p99 của serve_api: đường sync so với async (SERVE_ASYNC)
+# Ví dụ (một process, SERVE_ASYNC=both):
+#   python loadtest_api.py --target sync=http://localhost:8002 --target async=http://localhost:8002/async
+# Hoặc hai instance (SERVE_ASYNC=0 trên :8002, SERVE_ASYNC=1 trên :8003):
+#   python loadtest_api.py --target sync=http://localhost:8002 --target async=http://localhost:8003
+import argparse, json, random, time, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+def _request(base: str, kind: str, users: List[str], items: List[str], rng: random.Random, n: int, batch: int):
+    if kind == "user":
+        return urllib.request.Request(f"{base}/recommend/user/{rng.choice(users)}?n={n}")
+    if kind == "cold":
+        return urllib.request.Request(f"{base}/recommend/user/{'%024x' % rng.getrandbits(96)}?n={n}")
+    if kind == "similar":
+        k, oid = rng.choice(items).split(":", 1)
+        return urllib.request.Request(f"{base}/recommend/similar/{k}/{oid}?n={n}")
+    body = json.dumps({"userIds": rng.sample(users, min(batch, len(users))), "n": n}).encode()
+    return urllib.request.Request(f"{base}/recommend/users", data=body,
+                                  headers={"Content-Type": "application/json"}, method="POST")
+
+
+def _one(req, timeout: float) -> Tuple[float, bool]:
+    t = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            r.read()
+            ok = r.status == 200
+    except Exception:
+        ok = False
+    return (time.perf_counter() - t) * 1000.0, ok
+
+
+def run_target(base: str, plan: List[str], users, items, args) -> Dict[str, dict]:
+    rng = random.Random(args.seed)
+    reqs = [(k, _request(base, k, users, items, rng, args.n, args.batch)) for k in plan]
+    for k, r in reqs[:args.warmup]:
+        _one(r, args.timeout)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        res = list(ex.map(lambda kr: (kr[0], *_one(kr[1], args.timeout)), reqs))
+    wall = time.perf_counter() - t0
+
+    out = {}
+    for kind in sorted(set(plan)) + ["all"]:
+        lat = np.array([l for k, l, ok in res if ok and (kind == "all" or k == kind)])
+        err = sum(1 for k, _, ok in res if not ok and (kind == "all" or k == kind))
+        out[kind] = {
+            "n": int(lat.size), "errors": err,
+            "p50": float(np.percentile(lat, 50)) if lat.size else None,
+            "p90": float(np.percentile(lat, 90)) if lat.size else None,
+            "p99": float(np.percentile(lat, 99)) if lat.size else None,
+            "rps": (lat.size / wall) if kind == "all" else None,
+        }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--target", action="append", required=True, help="name=base_url (lặp lại để so sánh)")
+    ap.add_argument("--artifacts", type=str, default="artifacts")
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--warmup", type=int, default=100)
+    ap.add_argument("--mix", type=str, default="user=6,cold=2,similar=1,batch=1")
+    ap.add_argument("--n", type=int, default=8)
+    ap.add_argument("--batch", type=int, default=20, help="userIds per /recommend/users call")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    with open(f"{args.artifacts}/user_id_map.json", "r", encoding="utf-8") as f:
+        users = json.load(f)["users"]
+    with open(f"{args.artifacts}/item_id_map.json", "r", encoding="utf-8") as f:
+        items = json.load(f)["items"]
+
+    weights = {k: int(v) for k, v in (p.split("=") for p in args.mix.split(","))}
+    rng = random.Random(args.seed)
+    plan = rng.choices(list(weights), weights=list(weights.values()), k=args.requests)
+    print(f"[INFO] requests={args.requests} concurrency={args.concurrency} mix={weights} "
+          f"users={len(users)} items={len(items)}")
+
+    results = {}
+    for t in args.target:
+        name, base = t.split("=", 1)
+        results[name] = run_target(base.rstrip("/"), plan, users, items, args)
+
+    fmt = lambda v: f"{v:8.2f}" if v is not None else "       -"
+    for kind in sorted(set(plan)) + ["all"]:
+        for name, res in results.items():
+            r = res[kind]
+            print(f"{kind:>8} {name:>8} | n={r['n']:6d} err={r['errors']:4d} | p50={fmt(r['p50'])}ms "
+                  f"p90={fmt(r['p90'])}ms p99={fmt(r['p99'])}ms" + (f" | {r['rps']:8.1f} req/s" if r["rps"] else ""))
+
+
+if __name__ == "__main__":
+    main()
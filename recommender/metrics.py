@@ -0,0 +1,206 @@
+# metrics.py — Timing span theo stage + counter cho hot path của serve_api, xuất Prometheus text (/metrics)
+#   METRICS_ENABLED=0 : tắt (span / counter thành no-op)
+#   SERVER_TIMING=1   : thêm header Server-Timing (span của chính request đó) vào response /recommend/*
+# Chi phí mỗi span: 2 × perf_counter + một lần lấy lock — đủ rẻ để bật trên production.
+import os, time, inspect, functools, threading, contextvars
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+SERVER_TIMING   = os.getenv("SERVER_TIMING", "0") == "1"
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# (stage, giây) của request hiện tại — None ngoài request (thread nền: chỉ ghi histogram)
+_request_spans: contextvars.ContextVar = contextvars.ContextVar("reco_request_spans", default=None)
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: str = "") -> str:
+    parts = ['%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """Counter + histogram trong RAM (một process / worker), render theo text format 0.0.4."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._hists: Dict[Tuple[str, Labels], list] = {}   # [bucket counts..., +Inf], sum, count
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = (name, _labels(labels))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def gauge(self, name: str, fn: Callable[[], float], help: str = ""):
+        """Giá trị đọc lúc scrape (cache size, model users, ...)."""
+        self._gauges[name] = fn
+        if help:
+            self._help[name] = help
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get((name, _labels(labels)), 0.0)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            hists = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._hists.items())
+        out: List[str] = []
+        typed = set()
+
+        def head(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    out.append(f"# HELP {name} {self._help[name]}")
+                out.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), v in counters:
+            head(name, "counter")
+            out.append(f"{name}{_fmt_labels(labels)} {v:g}")
+        for (name, labels), (counts, total, n) in hists:
+            head(name, "histogram")
+            acc = 0
+            for b, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="%s"' % ("+Inf" if b == float("inf") else f"{b:g}")
+                out.append(f"{name}_bucket{_fmt_labels(labels, le)} {acc}")
+            out.append(f"{name}_sum{_fmt_labels(labels)} {total:.6f}")
+            out.append(f"{name}_count{_fmt_labels(labels)} {n}")
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                v = float(fn())
+            except Exception:
+                continue
+            head(name, "gauge")
+            out.append(f"{name} {v:g}")
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("reco_stage_seconds", "Time spent per hot-path stage")
+metrics.describe("reco_request_seconds", "End-to-end latency of /recommend/* requests")
+metrics.describe("reco_mongo_commands_total", "Mongo commands issued by the API process")
+metrics.describe("reco_candidates_total", "Candidates produced before filtering")
+metrics.describe("reco_candidates_dropped_total", "Candidates removed by category / metadata filters")
+
+
+class span:
+    """with span("fetch_items"): ... → histogram reco_stage_seconds{stage} + Server-Timing của request."""
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        metrics.observe("reco_stage_seconds", dt, stage=self.name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.name, dt))
+        return False
+
+
+def timed(name: str):
+    """Decorator: cả hàm là một span (sync hoặc async)."""
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*a, **kw):
+                with span(name):
+                    return await fn(*a, **kw)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            with span(name):
+                return fn(*a, **kw)
+        return wrapper
+    return deco if METRICS_ENABLED else (lambda fn: fn)
+
+
+def begin_request() -> list:
+    """Gắn list span cho request hiện tại (contextvar → theo sang threadpool / task con)."""
+    spans: list = []
+    _request_spans.set(spans)
+    return spans
+
+
+def server_timing(spans: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """Header Server-Timing: cộng dồn span cùng tên, giữ thứ tự xuất hiện (ms)."""
+    agg: Dict[str, float] = {}
+    for name, dt in spans:
+        agg[name] = agg.get(name, 0.0) + dt
+    parts = [f"{name};dur={dt * 1000.0:.2f}" for name, dt in agg.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000.0:.2f}")
+    return ", ".join(parts)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Đếm command Mongo theo (command, collection) + thời gian driver đo được.
+    Gắn vào client: MongoClient(url, event_listeners=[MongoCommandMetrics()]).
+    Callback chạy trong thread / task gọi query → thời gian Mongo cũng vào Server-Timing ("mongo").
+    """
+    IGNORE = frozenset(("hello", "ismaster", "isMaster", "ping", "buildInfo", "endSessions",
+                        "saslStart", "saslContinue", "killCursors"))
+
+    def started(self, event):
+        if event.command_name in self.IGNORE:
+            return
+        coll = event.command.get(event.command_name)
+        metrics.inc("reco_mongo_commands_total", command=event.command_name,
+                    collection=coll if isinstance(coll, str) else "")
+
+    def succeeded(self, event):
+        if event.command_name in self.IGNORE:
+            return
+        dt = event.duration_micros / 1e6
+        metrics.observe("reco_mongo_command_seconds", dt, command=event.command_name)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append(("mongo", dt))
+
+    def failed(self, event):
+        metrics.inc("reco_mongo_command_failures_total", command=event.command_name)
+
+
+def mongo_listeners() -> list:
+    return [MongoCommandMetrics()] if METRICS_ENABLED else []
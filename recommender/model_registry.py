@@ -0,0 +1,294 @@
+# model_registry.py — Versioned ALS model + hot reload (không cần restart uvicorn)
+import os, json, time, hashlib, threading
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from id_index import IdIndex, IdList, save_id_arrays
+from id_codec import CodeIndex, CodeList, save_code_arrays, index_for
+from seen_index import SeenIndex
+from category_profile import CategoryProfile, PROFILE_PATH
+from topk_table import TopKTable
+from similarity_index import load_similarity_index
+
+# File quyết định version: đổi bất kỳ file nào → version mới
+ARTIFACT_FILES = (
+    "user_id_map.json", "item_id_map.json", "als_model.npz",
+    "user_factors.npy", "item_factors.npy", "user_ids.npy", "item_ids.npy", "user_codes.npy", "item_codes.npy",
+    "seen_items.npz", "topk_users_idx.npy", "topk_items_idx.npy", "ann_ivf.npz", "ann_ivf_vectors.npy",
+    "category_profile.npz", "train_meta.json", "shard.json",
+)
+
+
+# load() đọc code / id arrays khi có → JSON map không còn quyết định model (ingest_worker.py ghi thêm id vào đó)
+_JSON_MAPS = ("user_id_map.json", "item_id_map.json")
+_ID_ARRAYS = ("user_codes.npy", "user_ids.npy")
+
+
+def artifact_version(art_dir: str) -> str:
+    """Fingerprint (name, size, mtime) of the artifact files — giống nhau giữa các worker."""
+    h = hashlib.sha1()
+    skip = _JSON_MAPS if any(os.path.exists(os.path.join(art_dir, n)) for n in _ID_ARRAYS) else ()
+    for name in ARTIFACT_FILES:
+        if name in skip:
+            continue
+        p = os.path.join(art_dir, name)
+        if os.path.exists(p):
+            st = os.stat(p)
+            h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:12]
+
+
+class ALSModel:
+    """
+    Immutable bundle of everything one request needs. Handlers grab one
+    instance at the start, so a reload never changes the model mid-request.
+    """
+
+    def __init__(self, version: str, users: Sequence[str], items: Sequence[str], U: np.ndarray, V: np.ndarray,
+                 user_index=None, item_index=None,
+                 seen: Optional[SeenIndex] = None, topk: Optional[TopKTable] = None, sim_index=None,
+                 profile: Optional[CategoryProfile] = None):
+        self.version = version
+        self.loaded_at = time.time()
+        self.users = users
+        self.items = items
+        self.U = U
+        self.V = V
+        # CodeIndex (id_codec: ObjectId 12 byte, mmap hoặc dựng từ JSON), IdIndex (chuỗi, mmap) hoặc dict (id tự do)
+        self.user_index = user_index if user_index is not None else index_for(users, item=False)
+        self.item_index = item_index if item_index is not None else index_for(items, item=True)
+        self.seen = seen
+        self.topk = topk
+        self.sim_index = sim_index
+        self.profile = profile
+        self.train_meta: dict = {}   # train_meta.json (alpha, regularization, convergence...)
+        self.shard: Optional[dict] = None  # shard.json khi ARTIFACTS_DIR là một shard (sharding.py)
+        self.ring = None                    # ShardRing của shard (shard.json / manifest.json bên cạnh)
+
+    @classmethod
+    def load(cls, art_dir: str, playback_col=None, serve_mode: str = "live") -> "ALSModel":
+        version = artifact_version(art_dir)
+        p = lambda name: os.path.join(art_dir, name)
+
+        if os.path.exists(p("user_factors.npy")) and os.path.exists(p("user_codes_sorted.npy")):
+            # binary code (id_codec): 12 / 13 byte mỗi id thay vì chuỗi hex 24 / 31 byte
+            U = np.load(p("user_factors.npy"), mmap_mode="r")
+            V = np.load(p("item_factors.npy"), mmap_mode="r")
+            users = CodeList(np.load(p("user_codes.npy"), mmap_mode="r"), item=False)
+            items = CodeList(np.load(p("item_codes.npy"), mmap_mode="r"), item=True)
+            user_index = CodeIndex.load(art_dir, "user", item=False)
+            item_index = CodeIndex.load(art_dir, "item", item=True)
+            if len(user_index) != len(users) or len(item_index) != len(items):
+                raise RuntimeError("Id index mismatch")
+        elif os.path.exists(p("user_factors.npy")) and os.path.exists(p("user_ids_sorted.npy")):
+            # mmap: các worker chia sẻ page cache thay vì mỗi worker một bản copy
+            U = np.load(p("user_factors.npy"), mmap_mode="r")
+            V = np.load(p("item_factors.npy"), mmap_mode="r")
+            users = IdList(np.load(p("user_ids.npy"), mmap_mode="r"))
+            items = IdList(np.load(p("item_ids.npy"), mmap_mode="r"))
+            user_index = IdIndex.load(art_dir, "user")
+            item_index = IdIndex.load(art_dir, "item")
+            if len(user_index) != len(users) or len(item_index) != len(items):
+                raise RuntimeError("Id index mismatch")
+        else:
+            with open(p("user_id_map.json"), "r", encoding="utf-8") as f:
+                users = json.load(f)["users"]
+            with open(p("item_id_map.json"), "r", encoding="utf-8") as f:
+                items = json.load(f)["items"]  # "movie:<id>" or "series:<id>"
+            data = np.load(p("als_model.npz"))
+            U = data["user_factors"]
+            V = data["item_factors"]
+            user_index = item_index = None
+
+        # auto-fix if swapped
+        if U.shape[0] == len(items) and V.shape[0] == len(users):
+            U, V = V, U
+
+        if U.shape[0] != len(users) or V.shape[0] != len(items):
+            raise RuntimeError("Model/Mapping mismatch")
+
+        m = cls(version, users, items, U, V, user_index, item_index)
+
+        # Similarity index (SIM_INDEX=exact|ivf) cho live scoring
+        m.sim_index = load_similarity_index(V, art_dir)
+
+        # Precomputed top-K (SERVE_MODE=precomputed)
+        if serve_mode == "precomputed":
+            try:
+                m.topk = TopKTable.load(art_dir, len(users), len(items))
+            except Exception as e:
+                print("[WARN] top-K table unavailable, serving live:", e)
+
+        # Seen-items index (CSR từ export_interactions.py; fallback: quét playback_state 1 lần)
+        try:
+            m.seen = SeenIndex.load(os.path.join(art_dir, "seen_items.npz"), len(users), len(items))
+        except Exception as e:
+            print("[WARN] seen index artifact unusable, building from DB:", e)
+            if playback_col is not None:
+                try:
+                    m.seen = SeenIndex.from_db(playback_col, m.user_index, m.item_index)
+                except Exception as e2:
+                    print("[ERROR] seen index build failed:", e2)
+
+        # Category profile (export_interactions.py); thiếu → serve_api tính theo request như cũ
+        try:
+            m.profile = CategoryProfile.load(p(PROFILE_PATH), len(users), len(items))
+        except Exception as e:
+            print("[WARN] category profile unavailable:", e)
+
+        # Tham số train (train_als.py); artifacts cũ không có file này
+        if os.path.exists(p("train_meta.json")):
+            try:
+                with open(p("train_meta.json"), "r", encoding="utf-8") as f:
+                    m.train_meta = json.load(f)
+            except Exception as e:
+                print("[WARN] train_meta.json unreadable:", e)
+
+        # Sharded serving: chỉ U của các user thuộc shard này, V đầy đủ
+        if os.path.exists(p("shard.json")):
+            with open(p("shard.json"), "r", encoding="utf-8") as f:
+                m.shard = json.load(f)
+            m.ring = _shard_ring(art_dir, m.shard)
+
+        if artifact_version(art_dir) != version:
+            raise RuntimeError("artifacts changed while loading")
+        return m
+
+    def owns(self, uids: Sequence[str]) -> np.ndarray:
+        """Mask: uid thuộc shard này theo ring (kể cả user chưa có trong U) — luôn True khi không shard."""
+        if self.ring is None:
+            return np.ones(len(uids), dtype=bool)
+        return self.ring.indices_of(uids) == self.ring.shards.index(self.shard["id"])
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "users": len(self.users),
+            "items": len(self.items),
+            "serve_mode": "precomputed" if self.topk is not None else "live",
+            "shard": self.shard["id"] if self.shard else None,
+        }
+
+
+def _shard_ring(art_dir: str, shard: dict):
+    """Ring từ shard.json; shard chia bởi bản cũ → manifest.json ở thư mục cha (artifacts/shards/)."""
+    from sharding import MANIFEST_NAME, ShardRing, load_manifest  # sharding import model_registry
+    if shard.get("ring"):
+        return ShardRing(shard["ring"]["shards"], int(shard["ring"]["vnodes"]))
+    path = os.path.join(os.path.dirname(os.path.abspath(art_dir)), MANIFEST_NAME)
+    try:
+        return ShardRing.from_manifest(load_manifest(path))
+    except Exception as e:
+        print(f"[WARN] shard {shard.get('id')}: no ring ({e}) — playback of other shards' users is not filtered")
+        return None
+
+
+def save_ids(art_dir: str, name: str, ids: List[str], item: bool):
+    """Code arrays (id_codec) khi mọi id là ObjectId, ngược lại id string; xoá định dạng còn lại để load() không đọc nhầm bản cũ."""
+    if save_code_arrays(art_dir, name, ids, item):
+        stale = ("ids", "ids_sorted", "ids_order")
+    else:
+        save_id_arrays(art_dir, name, ids)
+        stale = ("codes", "codes_sorted", "codes_order")
+    for suffix in stale:
+        path = os.path.join(art_dir, f"{name}_{suffix}.npy")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def save_mmap_artifacts(art_dir: str, U: np.ndarray, V: np.ndarray, users: List[str], items: List[str]):
+    """Raw .npy factors + sorted id arrays (đọc bằng ALSModel.load với mmap_mode='r')."""
+    np.save(os.path.join(art_dir, "user_factors.npy"), np.ascontiguousarray(U, dtype=np.float32))
+    np.save(os.path.join(art_dir, "item_factors.npy"), np.ascontiguousarray(V, dtype=np.float32))
+    save_ids(art_dir, "user", users, item=False)
+    save_ids(art_dir, "item", items, item=True)
+
+
+class ModelRegistry:
+    """
+    Holds the current ALSModel. reload() loads + validates a new version
+    off the request path, then swaps the reference atomically.
+    """
+
+    def __init__(self, art_dir: str, loader: Callable[[str], ALSModel]):
+        self.art_dir = art_dir
+        self.loader = loader
+        self._current: Optional[ALSModel] = None
+        self._reload_lock = threading.Lock()
+        self.on_swap: List[Callable[[ALSModel], None]] = []
+        self.last_error: Optional[str] = None
+        self.reloads = 0
+
+    @property
+    def current(self) -> Optional[ALSModel]:
+        return self._current
+
+    def reload(self, force: bool = False) -> dict:
+        if not self._reload_lock.acquire(blocking=False):
+            return {"status": "in_progress"}
+        try:
+            cur = self._current
+            version = artifact_version(self.art_dir)
+            if cur is not None and cur.version == version and not force:
+                return {"status": "unchanged", "version": version}
+            try:
+                new = self.loader(self.art_dir)
+            except Exception as e:
+                self.last_error = str(e)
+                print("[ERROR] model load failed:", e)
+                return {"status": "failed", "error": str(e),
+                        "version": cur.version if cur else None}
+            self._current = new  # gán tham chiếu = atomic; request cũ vẫn giữ model cũ
+            self.last_error = None
+            self.reloads += 1
+            for cb in self.on_swap:
+                try:
+                    cb(new)
+                except Exception as e:
+                    print("[WARN] on_swap callback failed:", e)
+            print(f"[INFO] model version {new.version} live (users={len(new.users)} items={len(new.items)})")
+            return {"status": "swapped", "version": new.version,
+                    "previous": cur.version if cur else None}
+        finally:
+            self._reload_lock.release()
+
+    def reload_async(self, force: bool = False):
+        threading.Thread(target=self.reload, kwargs={"force": force}, daemon=True,
+                         name="model-reload").start()
+
+    def watch(self, interval: float, stop: threading.Event):
+        """Poll artifact fingerprints; reload when they change."""
+        def _run():
+            while not stop.wait(interval):
+                cur = self._current
+                if cur is None or artifact_version(self.art_dir) != cur.version:
+                    self.reload()
+        t = threading.Thread(target=_run, daemon=True, name="model-watch")
+        t.start()
+        return t
+
+    def stats(self) -> dict:
+        cur = self._current
+        return {
+            "current": cur.stats() if cur else None,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == "__main__":
+    # Chuyển artifacts hiện có (JSON maps + als_model.npz) sang định dạng mmap
+    import sys
+    art = sys.argv[1] if len(sys.argv) > 1 else "artifacts"
+    with open(os.path.join(art, "user_id_map.json"), "r", encoding="utf-8") as f:
+        _users = json.load(f)["users"]
+    with open(os.path.join(art, "item_id_map.json"), "r", encoding="utf-8") as f:
+        _items = json.load(f)["items"]
+    _d = np.load(os.path.join(art, "als_model.npz"))
+    _U, _V = _d["user_factors"], _d["item_factors"]
+    if _U.shape[0] == len(_items) and _V.shape[0] == len(_users):
+        _U, _V = _V, _U
+    save_mmap_artifacts(art, _U, _V, _users, _items)
+    print(f"[INFO] Saved mmap artifacts in {art}/ (users={len(_users)} items={len(_items)})")
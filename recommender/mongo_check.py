@@ -1,14 +1,34 @@
-# mongo_check.py
-import os
+# mongo_check.py — Kiểm tra tham chiếu hỏng trên toàn DB (bulk) hoặc chi tiết một user
+#   users.likedItems : refId sai kiểu / kind lạ (invalid), không còn trong catalog (stale), sai kind, trùng
+#   playback_state   : thiếu userId/movieId (invalid), user đã xoá / phim đã xoá (orphaned), sai kind
+#   movies/series.reviews : review của user đã xoá
+# Catalog (movies + series _id) giữ trong RAM như export_interactions.py; userId tra bằng $in theo batch.
+# Mỗi collection chia theo khoảng _id → nhiều cursor chạy song song trong thread pool.
+#   python mongo_check.py                                   # toàn DB, in summary
+#   python mongo_check.py --workers 16 --details issues.jsonl --json summary.json
+#   python mongo_check.py --user 68fa6149d1ca6f56541a4074   # như bản cũ: lịch sử xem + likedItems của một user
+import os, json, time, argparse, datetime, threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from bson import ObjectId
 
+from mongo_client import pool_options
+
 load_dotenv()
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME   = os.getenv("DB_NAME", "Movie-web")
-WATCH_COL = os.getenv("WATCH_COLLECTION", "playback_state")
-USER_ID   = os.getenv("TEST_USER_ID", "68fa6149d1ca6f56541a4074") 
+MONGO_URL  = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME    = os.getenv("DB_NAME", "Movie-web")
+WATCH_COL  = os.getenv("WATCH_COLLECTION", "playback_state")
+USERS_COL  = os.getenv("USERS_COLLECTION", "users")
+MOVIES_COL = os.getenv("MOVIES_COLLECTION", "movies")
+SERIES_COL = os.getenv("SERIES_COLLECTION", "series")
+USER_ID    = os.getenv("TEST_USER_ID", "68fa6149d1ca6f56541a4074")
+
+KINDS = ("Movie", "Series")
+
 
 def as_oid(x):
     if isinstance(x, ObjectId):
@@ -18,57 +38,331 @@ def as_oid(x):
     except Exception:
         return None
 
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
-
-print(f"============================================================")
-print(f"KIỂM TRA USER: {USER_ID}")
-print(f"============================================================\n")
-
-# A. Lịch sử xem
-print(f"A. Lịch sử xem gần đây (collection: {WATCH_COL})")
-print("-" * 80)
-watch = list(
-    db[WATCH_COL].find(
-        {"userId": as_oid(USER_ID)},
-        {"movieId": 1, "seasonNumber": 1, "episodeNumber": 1, "lastActionAt": 1}
-    ).sort("lastActionAt", -1).limit(10)
-)
-if not watch:
-    print("(Không có dữ liệu)")
-else:
-    for w in watch:
-        mid = w.get("movieId")
-        kind = "series" if (w.get("seasonNumber") is not None or w.get("episodeNumber") is not None) else "movie"
-        print(f"{kind.upper():7} | {mid}")
-        doc = None
-        if mid:
-            doc = db.movies.find_one({"_id": as_oid(mid)}, {"title": 1, "category": 1}) \
-               or db.series.find_one({"_id": as_oid(mid)}, {"title": 1, "category": 1})
-        if doc:
-            print(f"   └→ {doc.get('title')}")
-            print(f"      ⏱ {w.get('lastActionAt')} | Thể loại: {doc.get('category') or '(không có)'}")
-        else:
-            print("   └→ ❌ Không tìm thấy phim/series này trong DB")
-
-# B. likedItems
-print("\nB. Danh sách yêu thích (users.likedItems)")
-print("-" * 80)
-u = db.users.find_one({"_id": as_oid(USER_ID)}, {"likedItems": 1})
-items = u.get("likedItems") if u else []
-if not items:
-    print("(Không có mục)")
-else:
+
+# =========================================================
+# Bulk
+# =========================================================
+class Report:
+    """Đếm issue theo (section, loại) + vài ví dụ mỗi loại; chi tiết đầy đủ ra JSONL nếu có."""
+
+    def __init__(self, examples: int = 5, details_path: Optional[str] = None):
+        self.counts: Counter = Counter()
+        self.examples: Dict[str, List[dict]] = {}
+        self.max_examples = examples
+        self._details = open(details_path, "w", encoding="utf-8") if details_path else None
+        self._lock = threading.Lock()
+
+    def merge(self, counts: Counter, issues: List[dict]):
+        """Gộp kết quả một batch (một lần lấy lock mỗi batch)."""
+        with self._lock:
+            self.counts.update(counts)
+            for it in issues:
+                ex = self.examples.setdefault(it["check"], [])
+                if len(ex) < self.max_examples:
+                    ex.append(it)
+                if self._details is not None:
+                    self._details.write(json.dumps(it, default=str) + "\n")
+
+    def close(self):
+        if self._details is not None:
+            self._details.close()
+
+
+OTHER_IDS = "non-objectid"   # khoảng đặc biệt: mọi _id không phải ObjectId (string, số, ...)
+
+
+def id_ranges(col, parts: int):
+    """
+    Chia _id (ObjectId) thành `parts` khoảng theo thời gian tạo → mỗi khoảng một cursor riêng.
+    Bound ObjectId chỉ khớp _id kiểu ObjectId (so sánh theo kiểu BSON) → _id kiểu khác quét
+    riêng trong khoảng OTHER_IDS.
+    """
+    if parts <= 1:
+        return [(None, None)]
+    # _id kiểu khác nằm ở hai đầu thứ tự BSON → chỉ cần nhìn _id nhỏ / lớn nhất
+    ends = [col.find_one({}, {"_id": 1}, sort=[("_id", d)]) for d in (1, -1)]
+    if not ends[0]:
+        return [(None, None)]
+    has_other = not all(isinstance(d["_id"], ObjectId) for d in ends)
+    oid_q = {"_id": {"$type": "objectId"}}
+    first = col.find_one(oid_q, {"_id": 1}, sort=[("_id", 1)]) if has_other else ends[0]
+    last = col.find_one(oid_q, {"_id": 1}, sort=[("_id", -1)]) if has_other else ends[1]
+    if first is None:
+        return [(None, None)]  # không có ObjectId nào: một cursor cho cả collection
+    t0, t1 = first["_id"].generation_time.timestamp(), last["_id"].generation_time.timestamp() + 1
+    cuts = [ObjectId.from_datetime(datetime.datetime.fromtimestamp(t0 + (t1 - t0) * k / parts, tz=datetime.timezone.utc))
+            for k in range(1, parts)]
+    # hai đầu cũng dùng bound ObjectId để khoảng đầu / cuối không bắt lại _id kiểu khác
+    bounds = [ObjectId("0" * 24)] + cuts + [None]
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+    return ranges + [OTHER_IDS] if has_other else ranges
+
+
+def _range_query(rng, extra: Optional[dict] = None) -> dict:
+    q = dict(extra or {})
+    if rng == OTHER_IDS:
+        q["_id"] = {"$not": {"$type": "objectId"}}
+        return q
+    lo, hi = rng
+    if lo is not None or hi is not None:
+        q["_id"] = {k: v for k, v in (("$gte", lo), ("$lt", hi)) if v is not None}
+    return q
+
+
+def load_catalog(db) -> Dict[str, Set[ObjectId]]:
+    return {"Movie": {d["_id"] for d in db[MOVIES_COL].find({}, {"_id": 1})},
+            "Series": {d["_id"] for d in db[SERIES_COL].find({}, {"_id": 1})}}
+
+
+def _existing_users(db, ids) -> Set[ObjectId]:
+    ids = list(ids)
+    return {d["_id"] for d in db[USERS_COL].find({"_id": {"$in": ids}}, {"_id": 1})} if ids else set()
+
+
+def check_liked(db, rng, catalog, report: Report, batch: int):
+    """users.likedItems trong khoảng _id: chỉ cần catalog (RAM), không query thêm."""
+    counts, issues = Counter(), []
+    cur = db[USERS_COL].find(_range_query(rng, {"likedItems.0": {"$exists": True}}),
+                             {"likedItems": 1}).batch_size(batch)
+    for u in cur:
+        counts["liked.users"] += 1
+        seen = set()
+        for it in u.get("likedItems") or []:
+            counts["liked.refs"] += 1
+            if not isinstance(it, dict):
+                counts["liked.invalid"] += 1
+                issues.append({"check": "liked.invalid", "userId": u["_id"],
+                               "type": type(it).__name__, "item": repr(it)[:200]})
+                continue
+            oid, kind = as_oid(it.get("refId")), (it.get("kind") or "").strip()
+            if oid is None or kind not in KINDS:
+                counts["liked.invalid"] += 1
+                issues.append({"check": "liked.invalid", "userId": u["_id"], "item": it})
+            elif (oid, kind) in seen:
+                counts["liked.duplicate"] += 1
+                issues.append({"check": "liked.duplicate", "userId": u["_id"], "refId": oid, "kind": kind})
+            elif oid not in catalog[kind]:
+                other = "Series" if kind == "Movie" else "Movie"
+                check = "liked.wrong_kind" if oid in catalog[other] else "liked.stale"
+                counts[check] += 1
+                issues.append({"check": check, "userId": u["_id"], "refId": oid, "kind": kind})
+            seen.add((oid, kind))
+        if counts["liked.users"] % batch == 0:
+            report.merge(counts, issues)
+            counts, issues = Counter(), []
+    report.merge(counts, issues)
+
+
+def _playback_batch(db, rows: List[dict], catalog, counts: Counter, issues: List[dict]):
+    users = _existing_users(db, {w["userId"] for w in rows if isinstance(w.get("userId"), ObjectId)})
+    for w in rows:
+        counts["playback.rows"] += 1
+        uid, mid = w.get("userId"), as_oid(w.get("movieId"))
+        if not isinstance(uid, ObjectId) or mid is None:
+            counts["playback.invalid"] += 1
+            issues.append({"check": "playback.invalid", "_id": w["_id"], "userId": uid, "movieId": w.get("movieId")})
+            continue
+        if uid not in users:
+            counts["playback.orphaned_user"] += 1
+            issues.append({"check": "playback.orphaned_user", "_id": w["_id"], "userId": uid})
+        kind = "Series" if (w.get("seasonNumber") is not None or w.get("episodeNumber") is not None) else "Movie"
+        if mid not in catalog[kind]:
+            other = "Series" if kind == "Movie" else "Movie"
+            check = "playback.wrong_kind" if mid in catalog[other] else "playback.orphaned_item"
+            counts[check] += 1
+            issues.append({"check": check, "_id": w["_id"], "userId": uid, "movieId": mid, "kind": kind})
+
+
+def check_playback(db, rng, catalog, report: Report, batch: int):
+    """playback_state trong khoảng _id: catalog trong RAM, userId tra $in theo batch."""
+    cur = db[WATCH_COL].find(_range_query(rng), {"userId": 1, "movieId": 1, "seasonNumber": 1, "episodeNumber": 1})
+    buf: List[dict] = []
+    for w in cur.batch_size(batch):
+        buf.append(w)
+        if len(buf) >= batch:
+            counts, issues = Counter(), []
+            _playback_batch(db, buf, catalog, counts, issues)
+            report.merge(counts, issues)
+            buf = []
+    if buf:
+        counts, issues = Counter(), []
+        _playback_batch(db, buf, catalog, counts, issues)
+        report.merge(counts, issues)
+
+
+def check_reviews(db, col_name: str, rng, report: Report, batch: int):
+    """reviews[].userId của movies/series trong khoảng _id → user đã xoá."""
+    pipeline = [{"$match": _range_query(rng, {"reviews.0": {"$exists": True}})},
+                {"$unwind": "$reviews"},
+                {"$project": {"u": "$reviews.userId"}}]
+    buf: List[dict] = []
+
+    def _flush():
+        users = _existing_users(db, {r["u"] for r in buf if isinstance(r.get("u"), ObjectId)})
+        counts, issues = Counter(), []
+        for r in buf:
+            counts["reviews.rows"] += 1
+            if r.get("u") not in users:
+                counts["reviews.orphaned_user"] += 1
+                issues.append({"check": "reviews.orphaned_user", "collection": col_name, "itemId": r["_id"],
+                               "userId": r.get("u")})
+        report.merge(counts, issues)
+
+    for r in db[col_name].aggregate(pipeline, allowDiskUse=True, batchSize=batch):
+        buf.append(r)
+        if len(buf) >= batch:
+            _flush()
+            buf = []
+    if buf:
+        _flush()
+
+
+def bulk_check(db, workers: int = 8, parts_per_worker: int = 4, batch: int = 5000,
+               report: Optional[Report] = None, checks=("liked", "playback", "reviews")) -> Report:
+    report = report or Report()
+    t = time.perf_counter()
+    catalog = load_catalog(db)
+    print(f"[INFO] catalog: movies={len(catalog['Movie'])} series={len(catalog['Series'])} "
+          f"({time.perf_counter() - t:.1f}s)")
+
+    parts = max(1, workers * parts_per_worker)
+    tasks = []
+    if "liked" in checks:
+        tasks += [(check_liked, (db, r, catalog, report, batch)) for r in id_ranges(db[USERS_COL], parts)]
+    if "playback" in checks:
+        tasks += [(check_playback, (db, r, catalog, report, batch)) for r in id_ranges(db[WATCH_COL], parts)]
+    if "reviews" in checks:
+        for col_name in (MOVIES_COL, SERIES_COL):
+            tasks += [(check_reviews, (db, col_name, r, report, batch)) for r in id_ranges(db[col_name], workers)]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mongo-check") as ex:
+        for f in [ex.submit(fn, *args) for fn, args in tasks]:
+            f.result()
+    return report
+
+
+def print_summary(report: Report, sec: float):
+    c = report.counts
+    print("=" * 60)
+    print(f"KIỂM TRA TOÀN DB: {DB_NAME}")
+    print("=" * 60)
+    print(f"[users.likedItems] users={c['liked.users']} refs={c['liked.refs']} | invalid={c['liked.invalid']} "
+          f"stale={c['liked.stale']} wrong_kind={c['liked.wrong_kind']} duplicate={c['liked.duplicate']}")
+    print(f"[{WATCH_COL}] rows={c['playback.rows']} | invalid={c['playback.invalid']} "
+          f"orphaned_user={c['playback.orphaned_user']} orphaned_item={c['playback.orphaned_item']} "
+          f"wrong_kind={c['playback.wrong_kind']}")
+    print(f"[reviews] rows={c['reviews.rows']} | orphaned_user={c['reviews.orphaned_user']}")
+    for check, ex in sorted(report.examples.items()):
+        print(f"\n→ {check} (ví dụ {len(ex)}/{c[check]}):")
+        for it in ex:
+            print("   ", {k: str(v) for k, v in it.items() if k != "check"})
+    docs = c["liked.users"] + c["playback.rows"] + c["reviews.rows"]
+    print(f"\n[DONE] {docs} documents/rows in {sec:.1f}s ({docs / max(sec, 1e-9):,.0f}/s)")
+
+
+# =========================================================
+# Một user (chi tiết, như bản cũ)
+# =========================================================
+def check_user(db, user_id: str):
+    print("============================================================")
+    print(f"KIỂM TRA USER: {user_id}")
+    print("============================================================\n")
+
+    # A. Lịch sử xem
+    print(f"A. Lịch sử xem gần đây (collection: {WATCH_COL})")
+    print("-" * 80)
+    watch = list(
+        db[WATCH_COL].find(
+            {"userId": as_oid(user_id)},
+            {"movieId": 1, "seasonNumber": 1, "episodeNumber": 1, "lastActionAt": 1}
+        ).sort("lastActionAt", -1).limit(10)
+    )
+    # một $in cho mỗi collection thay vì find_one theo từng dòng
+    mids = [m for m in {as_oid(w.get("movieId")) for w in watch} if m is not None]
+    docs = {d["_id"]: d for col in (MOVIES_COL, SERIES_COL)
+            for d in db[col].find({"_id": {"$in": mids}}, {"title": 1, "name": 1, "category": 1})} if mids else {}
+    if not watch:
+        print("(Không có dữ liệu)")
+    else:
+        for w in watch:
+            mid = w.get("movieId")
+            kind = "series" if (w.get("seasonNumber") is not None or w.get("episodeNumber") is not None) else "movie"
+            print(f"{kind.upper():7} | {mid}")
+            doc = docs.get(as_oid(mid)) if mid else None
+            if doc:
+                print(f"   └→ {doc.get('title') or doc.get('name')}")
+                print(f"      ⏱ {w.get('lastActionAt')} | Thể loại: {doc.get('category') or '(không có)'}")
+            else:
+                print("   └→ ❌ Không tìm thấy phim/series này trong DB")
+
+    # B. likedItems
+    print("\nB. Danh sách yêu thích (users.likedItems)")
+    print("-" * 80)
+    u = db[USERS_COL].find_one({"_id": as_oid(user_id)}, {"likedItems": 1})
+    items = u.get("likedItems") if u else []
+    if not items:
+        print("(Không có mục)")
+        return
+    by_kind = {k: [as_oid(it.get("refId")) for it in items
+                   if isinstance(it, dict) and (it.get("kind") or "").strip() == k] for k in KINDS}
+    found = {k: {d["_id"]: d for d in db[MOVIES_COL if k == "Movie" else SERIES_COL].find(
+        {"_id": {"$in": [o for o in ids if o is not None]}}, {"title": 1, "name": 1, "category": 1})}
+        for k, ids in by_kind.items()}
     for it in items:
+        if not isinstance(it, dict):
+            print(f"→ [INVALID] Bản ghi ({type(it).__name__}):", repr(it)[:200])
+            continue
         rid = it.get("refId")
         kind = (it.get("kind") or "").strip()
         oid = as_oid(rid)
-        if not oid or kind not in ("Movie", "Series"):
+        if not oid or kind not in KINDS:
             print("→ [INVALID] Bản ghi:", it)
             continue
-        col = db.movies if kind == "Movie" else db.series
-        doc = col.find_one({"_id": oid}, {"title": 1, "category": 1})
+        doc = found[kind].get(oid)
         if doc:
-            print(f"✓ {kind:6} | {doc.get('title')} | category: {doc.get('category') or '(không có)'}")
+            print(f"✓ {kind:6} | {doc.get('title') or doc.get('name')} | category: {doc.get('category') or '(không có)'}")
         else:
             print(f"→ [STALE] {kind} refId={rid} không còn tồn tại trong DB")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk reference diagnostics (likedItems, playback_state, reviews)")
+    ap.add_argument("--user", type=str, nargs="?", const=USER_ID, default=None,
+                    help="chỉ kiểm tra một user (mặc định TEST_USER_ID)")
+    ap.add_argument("--workers", type=int, default=min(16, (os.cpu_count() or 1) * 2))
+    ap.add_argument("--parts", type=int, default=4, help="số khoảng _id mỗi worker (cân bằng tải)")
+    ap.add_argument("--batch", type=int, default=5000, help="số document mỗi batch / mỗi $in")
+    ap.add_argument("--checks", type=str, default="liked,playback,reviews")
+    ap.add_argument("--examples", type=int, default=5, help="số ví dụ in ra mỗi loại lỗi")
+    ap.add_argument("--details", type=str, default=None, help="ghi từng issue ra JSONL")
+    ap.add_argument("--json", type=str, default=None, help="ghi summary ra file")
+    args = ap.parse_args(argv)
+
+    client = MongoClient(MONGO_URL, **dict(pool_options(), maxPoolSize=max(args.workers * 2, 10)))
+    db = client[DB_NAME]
+    if args.user:
+        check_user(db, args.user)
+        return None
+
+    print(f"[INFO] MONGO_URL={MONGO_URL} DB_NAME={DB_NAME} workers={args.workers}")
+    t = time.perf_counter()
+    report = Report(args.examples, args.details)
+    try:
+        bulk_check(db, args.workers, args.parts, args.batch, report, tuple(args.checks.split(",")))
+    finally:
+        report.close()
+    sec = time.perf_counter() - t
+    print_summary(report, sec)
+    if args.details:
+        print(f"[INFO] Saved {args.details}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"db": DB_NAME, "sec": round(sec, 3), "counts": dict(report.counts),
+                       "examples": report.examples}, f, indent=2, default=str)
+        print(f"[INFO] Saved {args.json}")
+    client.close()
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# mongo_client.py — Connection pool / timeout options (env) cho client sync và async
+import os
+
+MONGO_MAX_POOL_SIZE   = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE   = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_MS     = int(os.getenv("MONGO_MAX_IDLE_MS", "0"))                # 0 = không giới hạn
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))        # 0 = không timeout
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))  # chờ connection rảnh
+
+
+def pool_options() -> dict:
+    """kwargs dùng chung cho MongoClient / AsyncMongoClient / Motor (0 = mặc định driver)."""
+    opts = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    if MONGO_MAX_IDLE_MS:
+        opts["maxIdleTimeMS"] = MONGO_MAX_IDLE_MS
+    if MONGO_SOCKET_TIMEOUT_MS:
+        opts["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        opts["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return opts
+
+
+def async_client(url: str, **kw):
+    """PyMongo Async (pymongo >= 4.9); fallback Motor. Tạo trong event loop của app."""
+    try:
+        from pymongo import AsyncMongoClient
+        return AsyncMongoClient(url, **pool_options(), **kw)
+    except ImportError:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(url, **pool_options(), **kw)
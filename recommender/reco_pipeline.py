@@ -0,0 +1,236 @@
+# reco_pipeline.py — recommend() hai tầng: retrieve rẻ, nhiều ứng viên → filter + re-rank vectorized
+#   Stage 1 (retrieve, mỗi source một span):
+#     retrieve_als        RETRIEVE_ALS item đầu từ topk row / sim_index (đã bỏ item đã xem)
+#     retrieve_trending   RETRIEVE_TRENDING item trending (snapshot trong RAM), category sở thích trước
+#     retrieve_neighbours RETRIEVE_NEIGHBOURS item tương tự cho mỗi seed (RETRIEVE_SEEDS item user
+#                         hợp nhất theo ALS), chỉ giữ item cùng category với seed
+#   Stage 2:
+#     filter   bỏ item đã xem, pref = category được phép (feature mềm, không loại) → RERANK_POOL item
+#     rerank   ALS + trending (recency) + neighbour + rate + year, giảm điểm item trùng category / kind
+#              với các item đã chọn (greedy, kiểu MMR)
+#   Dùng cho cả /recommend/user và /recommend/users (batch: ALS retrieval một U_batch @ V.T theo khối).
+#   Size = 0 → tắt source đó; RECO_PIPELINE=0 → đường cũ (n*5 ALS, lọc category, fallback trending).
+#   W_PREF ≥ tổng các weight còn lại → item đúng sở thích luôn đứng trước, item khác chỉ để lấp đầy list.
+import os, datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from category_profile import norm_category
+from id_codec import item_code, item_keys, rows_for
+from metrics import metrics, span
+
+PIPELINE_ENABLED    = os.getenv("RECO_PIPELINE", "1") == "1"
+RETRIEVE_ALS        = int(os.getenv("RETRIEVE_ALS", "150"))         # < TOPK_K để vẫn đọc được topk row
+RETRIEVE_TRENDING   = int(os.getenv("RETRIEVE_TRENDING", "100"))
+RETRIEVE_SEEDS      = int(os.getenv("RETRIEVE_SEEDS", "5"))
+RETRIEVE_NEIGHBOURS = int(os.getenv("RETRIEVE_NEIGHBOURS", "20"))   # mỗi seed
+RERANK_POOL         = int(os.getenv("RERANK_POOL", "100"))          # số item fetch metadata + re-rank
+W_ALS       = float(os.getenv("RERANK_W_ALS", "0.55"))
+W_TRENDING  = float(os.getenv("RERANK_W_TRENDING", "0.15"))
+W_NEIGHBOUR = float(os.getenv("RERANK_W_NEIGHBOUR", "0.15"))
+W_RATE      = float(os.getenv("RERANK_W_RATE", "0.10"))
+W_YEAR      = float(os.getenv("RERANK_W_YEAR", "0.05"))
+W_PREF      = float(os.getenv("RERANK_W_PREF", "1.0"))
+DIV_CATEGORY = float(os.getenv("RERANK_DIV_CATEGORY", "0.15"))  # mỗi item đã chọn cùng category → điểm × (1 - x)
+DIV_KIND     = float(os.getenv("RERANK_DIV_KIND", "0.05"))      # tương tự cho movie / series
+RATE_MAX     = float(os.getenv("RERANK_RATE_MAX", "5"))
+YEAR_SPAN    = float(os.getenv("RERANK_YEAR_SPAN", "30"))       # year feature: 1 = năm nay, 0 = cũ hơn span năm
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _rank_score(k: int) -> np.ndarray:
+    """1 cho vị trí đầu, giảm tuyến tính về 1/k — điểm theo thứ hạng cho source không có score chung."""
+    return (1.0 - np.arange(k, dtype=np.float32) / max(k, 1)).astype(np.float32)
+
+
+def _minmax(x: np.ndarray) -> np.ndarray:
+    if not x.size:
+        return x
+    lo, hi = float(x.min()), float(x.max())
+    return ((x - lo) / (hi - lo)).astype(np.float32) if hi > lo else np.ones_like(x, dtype=np.float32)
+
+
+def _num(v) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TrendingIndex:
+    """Trending snapshot → (item idx, score / max) theo model; dựng lại khi snapshot hoặc model đổi."""
+
+    def __init__(self):
+        self._cached = (None, (_EMPTY, np.empty(0, dtype=np.float32)))
+
+    def get(self, m, snap) -> Tuple[np.ndarray, np.ndarray]:
+        if snap is None:
+            return _EMPTY, np.empty(0, dtype=np.float32)
+        key = (id(snap), snap.built_at, m.version)
+        cached_key, val = self._cached
+        if cached_key == key:
+            return val
+        rows = rows_for(m.item_index, [item_code(it["movieId"], it["kind"] == "series") for it in snap.ranked],
+                        item=True)
+        ok = rows >= 0
+        score = np.array([it["score"] for it in snap.ranked], dtype=np.float32)[ok]
+        val = (rows[ok], score / max(float(score.max()), 1e-12) if score.size else score)
+        self._cached = (key, val)  # một tuple → đọc/ghi atomic giữa các thread
+        return val
+
+
+trending_index = TrendingIndex()
+
+
+class Pool:
+    """Ứng viên sau filter: item idx + feature đã chuẩn hoá về [0, 1] (pref: None = chưa biết, tính từ metadata)."""
+    __slots__ = ("idx", "keys", "als", "trending", "neighbour", "pref")
+
+    def __init__(self, m, idx, als, trending, neighbour, pref):
+        self.idx = idx
+        self.keys = item_keys(m.items, idx)
+        self.als = als
+        self.trending = trending
+        self.neighbour = neighbour
+        self.pref = pref
+
+
+# === stage 1: retrieve ===
+def retrieve_als(als: Callable[[int], np.ndarray], n: int) -> Tuple[np.ndarray, np.ndarray]:
+    if RETRIEVE_ALS <= 0:
+        return _EMPTY, np.empty(0, dtype=np.float32)
+    with span("retrieve_als"):
+        idx = np.asarray(als(max(RETRIEVE_ALS, n)), dtype=np.int64)
+    return idx, _rank_score(idx.size)
+
+
+def retrieve_trending(m, snap, seen: np.ndarray, allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Top RETRIEVE_TRENDING chưa xem; có category mask → item đúng sở thích trước (stable theo score)."""
+    if RETRIEVE_TRENDING <= 0:
+        return _EMPTY, np.empty(0, dtype=np.float32)
+    with span("retrieve_trending"):
+        idx, score = trending_index.get(m, snap)
+        if seen.size:
+            ok = ~np.isin(idx, seen)
+            idx, score = idx[ok], score[ok]
+        if allowed is not None and m.profile is not None:
+            order = np.argsort(~allowed[m.profile.item_cat[idx] + 1], kind="stable")
+            idx, score = idx[order], score[order]
+    return idx[:RETRIEVE_TRENDING], score[:RETRIEVE_TRENDING]
+
+
+def retrieve_neighbours(m, u: np.ndarray, seen: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Seed = RETRIEVE_SEEDS item đã xem có u·v cao nhất; neighbour = topk item row hoặc sim_index,
+    chỉ giữ item cùng category với seed (profile), điểm theo thứ hạng, max qua các seed.
+    """
+    if RETRIEVE_SEEDS <= 0 or RETRIEVE_NEIGHBOURS <= 0 or not seen.size:
+        return _EMPTY, np.empty(0, dtype=np.float32)
+    with span("retrieve_neighbours"):
+        seeds = seen[np.argsort(-(m.V[seen] @ u))[:RETRIEVE_SEEDS]]
+        k = min(RETRIEVE_NEIGHBOURS, len(m.items) - 1)
+        out_idx, out_score = [], []
+        for s in seeds.tolist():
+            row = m.topk.item_row(s) if m.topk is not None else None
+            if row is None or row.size < k:
+                row, _ = m.sim_index.search(m.V[s], k, exclude=np.array([s]))
+            row = np.asarray(row[:k], dtype=np.int64)
+            score = _rank_score(row.size)
+            if m.profile is not None and m.profile.item_cat[s] >= 0:
+                same = m.profile.item_cat[row] == m.profile.item_cat[s]
+                row, score = row[same], score[same]
+            out_idx.append(row)
+            out_score.append(score)
+        idx, score = np.concatenate(out_idx), np.concatenate(out_score)
+        ok = ~np.isin(idx, seen)
+    return idx[ok], score[ok]
+
+
+# === stage 2: filter + re-rank ===
+def _union(sources: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Gộp các source → idx unique + ma trận (num_sources, C) score (0 = không đến từ source đó)."""
+    allidx = np.concatenate([i for i, _ in sources])
+    idx, inv = np.unique(allidx, return_inverse=True)
+    F = np.zeros((len(sources), idx.size), dtype=np.float32)
+    off = 0
+    for j, (i, s) in enumerate(sources):
+        np.maximum.at(F[j], inv[off:off + i.size], s)
+        off += i.size
+    return idx, F
+
+
+def candidates(m, u: np.ndarray, seen: np.ndarray, allowed: Optional[np.ndarray], snap,
+               als: Callable[[int], np.ndarray], n: int) -> Pool:
+    """Stage 1 (3 source) + filter → Pool tối đa max(RERANK_POOL, n) item, xếp sơ bộ không cần metadata."""
+    sources = [retrieve_als(als, n), retrieve_trending(m, snap, seen, allowed), retrieve_neighbours(m, u, seen)]
+    for name, (i, _) in zip(("als", "trending", "neighbour"), sources):
+        metrics.inc("reco_candidates_total", i.size, source=name)
+
+    with span("filter"):
+        idx, F = _union(sources)
+        if seen.size and idx.size:
+            ok = ~np.isin(idx, seen)
+            idx, F = idx[ok], F[:, ok]
+        # ALS feature = u·v của mọi ứng viên (kể cả từ trending / neighbour) — một lần gather + GEMV
+        aff = _minmax(np.asarray(m.V[idx] @ u, dtype=np.float32)) if idx.size else np.empty(0, dtype=np.float32)
+        pref = None
+        if allowed is not None and m.profile is not None:
+            pref = allowed[m.profile.item_cat[idx] + 1]
+        pre = W_ALS * aff + W_TRENDING * F[1] + W_NEIGHBOUR * F[2] + (W_PREF * pref if pref is not None else 0.0)
+        take = min(max(RERANK_POOL, n), idx.size)
+        if take < idx.size:
+            top = np.argpartition(-pre, take - 1)[:take]
+            idx, aff, F = idx[top], aff[top], F[:, top]
+            pref = pref[top] if pref is not None else None
+            metrics.inc("reco_candidates_dropped_total", pre.size - take, stage="pool")
+    return Pool(m, idx, aff, F[1], F[2], pref)
+
+
+def rerank(pool: Pool, meta: Dict[str, dict], n: int, pref: Optional[Set[str]] = None) -> List[str]:
+    """
+    Điểm cuối = W_PREF·pref + base · (1 - DIV_CATEGORY)^{#đã chọn cùng category} · (1 - DIV_KIND)^{#cùng kind}.
+    base ∈ [0, 1] khi tổng các weight = 1 → giảm điểm diversity không đẩy item ngoài sở thích lên trước.
+    """
+    with span("rerank"):
+        keys = pool.keys
+        has = np.array([k in meta for k in keys], dtype=bool)
+        if not has.any():
+            return []
+        md = [meta.get(k) or {} for k in keys]
+        rate = np.clip(np.array([_num(d.get("rate")) for d in md], dtype=np.float32) / max(RATE_MAX, 1e-9), 0, 1)
+        year = np.array([_num(d.get("year")) for d in md], dtype=np.float32)
+        year = np.clip(1.0 - (datetime.date.today().year - year) / max(YEAR_SPAN, 1e-9), 0, 1)
+        cat_names = [norm_category(d.get("category")) for d in md]
+        codes = {c: j for j, c in enumerate(sorted(set(cat_names)))}
+        cat = np.array([codes[c] for c in cat_names], dtype=np.int64)
+        kind = np.array([k.startswith("series:") for k in keys], dtype=np.int64)
+
+        in_pref = pool.pref
+        if in_pref is None:
+            in_pref = np.array([c in pref for c in cat_names], dtype=bool) if pref else np.ones(len(keys), dtype=bool)
+        base = (W_ALS * pool.als + W_TRENDING * pool.trending + W_NEIGHBOUR * pool.neighbour
+                + W_RATE * rate + W_YEAR * year)
+        bonus = W_PREF * in_pref
+
+        # greedy: n lượt argmax trên ≤ RERANK_POOL item
+        keep_cat, keep_kind = 1.0 - DIV_CATEGORY, 1.0 - DIV_KIND
+        cat_cnt = np.zeros(len(codes), dtype=np.float32)
+        kind_cnt = np.zeros(2, dtype=np.float32)
+        avail = has.copy()
+        sel: List[int] = []
+        for _ in range(min(n, int(has.sum()))):
+            gain = bonus + base * keep_cat ** cat_cnt[cat] * keep_kind ** kind_cnt[kind]
+            gain[~avail] = -np.inf
+            j = int(np.argmax(gain))
+            sel.append(j)
+            avail[j] = False
+            cat_cnt[cat[j]] += 1
+            kind_cnt[kind[j]] += 1
+    if len(sel) < n:
+        metrics.inc("reco_pipeline_short_total")
+    off = int((~in_pref[sel]).sum())
+    if off:
+        metrics.inc("reco_pipeline_off_pref_total", off)
+    return [keys[j] for j in sel]
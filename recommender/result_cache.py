@@ -0,0 +1,224 @@
+# result_cache.py — Cache response của /recommend/user và /recommend/similar
+# Key gồm model version → reload model là cache cũ tự hết hiệu lực (không cần xoá).
+#   user:<version>:<uid>              field = n   (TTL ngắn, xoá khi có /events/playback)
+#   similar:<version>:<kind>:<oid>    field = n
+# Tầng 1: LRU trong process. Tầng 2 (tuỳ chọn, RESULT_CACHE_URL=redis://...): dùng chung giữa
+# các worker / instance; client bất kỳ có hget/hset/expire/delete (vd. fakeredis) thay được.
+# Không có tầng 2: /events/playback chỉ xoá cache của worker nhận event; worker khác xoá user:* của
+# user đó khi poll overlay "đã xem" (SEEN_POLL_SECONDS) thấy lượt xem mới.
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+RESULT_CACHE_ENABLED     = os.getenv("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_SIZE        = int(os.getenv("RESULT_CACHE_SIZE", "20000"))
+RESULT_CACHE_USER_TTL    = float(os.getenv("RESULT_CACHE_USER_TTL", "60"))
+RESULT_CACHE_SIMILAR_TTL = float(os.getenv("RESULT_CACHE_SIMILAR_TTL", "600"))
+RESULT_CACHE_LOCAL_TTL   = float(os.getenv("RESULT_CACHE_LOCAL_TTL", "5"))   # trần TTL tầng 1 khi có tầng 2
+RESULT_CACHE_URL         = os.getenv("RESULT_CACHE_URL", "")
+RESULT_CACHE_PREFIX      = os.getenv("RESULT_CACHE_PREFIX", "reco:")
+
+
+def user_key(version: str, uid: str) -> str:
+    return f"user:{version}:{uid}"
+
+def similar_key(version: str, kind: str, oid: str) -> str:
+    return f"similar:{version}:{kind}:{oid}"
+
+
+def _json_default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    return str(o)
+
+def encode(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+def etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=10).hexdigest() + '"'
+
+def etag_matches(tag: str, if_none_match: Optional[str]) -> bool:
+    """If-None-Match (list, weak W/ tag, hoặc "*") khớp ETag của body hiện tại → 304."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return tag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+
+
+class MemoryBackend:
+    """LRU theo key; mỗi field có hạn riêng."""
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE):
+        self.max_size = int(max_size)
+        self._data: "OrderedDict[str, Dict[str, Tuple[float, bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def hget(self, key: str, field: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            fields = self._data.get(key)
+            ent = fields.get(field) if fields is not None else None
+            if ent is None:
+                return None
+            if ent[0] <= now:
+                del fields[field]
+                return None
+            self._data.move_to_end(key)
+            return ent[1]
+
+    def hset(self, key: str, field: str, value: bytes, ttl: float):
+        with self._lock:
+            self._data.setdefault(key, {})[field] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, prefix: str = "") -> int:
+        with self._lock:
+            if not prefix:
+                n = len(self._data)
+                self._data.clear()
+                return n
+            keys = [k for k in self._data if k.startswith(prefix)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        return {"type": "memory", "size": size, "max_size": self.max_size, "evictions": self.evictions}
+
+
+class RedisBackend:
+    """Redis hash mỗi key; TTL tính từ lần ghi cuối của key."""
+
+    def __init__(self, client, prefix: str = RESULT_CACHE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = RESULT_CACHE_PREFIX) -> "RedisBackend":
+        import redis  # optional dependency
+        return cls(redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.5), prefix)
+
+    def hget(self, key: str, field: str) -> Optional[bytes]:
+        return self.client.hget(self.prefix + key, field)
+
+    def hset(self, key: str, field: str, value: bytes, ttl: float):
+        pipe = self.client.pipeline()
+        pipe.hset(self.prefix + key, field, value)
+        pipe.expire(self.prefix + key, max(1, int(ttl)))
+        pipe.execute()
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def clear(self, prefix: str = "") -> int:
+        n = 0
+        for k in self.client.scan_iter(match=self.prefix + prefix + "*", count=1000):
+            n += self.client.delete(k)
+        return n
+
+    def stats(self) -> dict:
+        return {"type": "redis", "prefix": self.prefix}
+
+
+class ResultCache:
+    """
+    Tầng 1 (local) + tầng 2 (shared, tuỳ chọn). Lỗi ở tầng 2 chỉ làm miss, không làm hỏng request.
+    Khi có tầng 2, entry ở tầng 1 sống tối đa local_ttl giây → invalidation từ worker khác
+    có hiệu lực sau tối đa local_ttl.
+    """
+
+    def __init__(self, local: Optional[MemoryBackend] = None, shared=None, local_ttl: float = RESULT_CACHE_LOCAL_TTL):
+        self.local = local or MemoryBackend()
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _ttl_local(self, ttl: float) -> float:
+        return min(ttl, self.local_ttl) if self.shared is not None else ttl
+
+    def get(self, key: str, field) -> Optional[bytes]:
+        field = str(field)
+        body = self.local.hget(key, field)
+        if body is not None:
+            self.hits += 1
+            return body
+        if self.shared is not None:
+            try:
+                body = self.shared.hget(key, field)
+            except Exception as e:
+                self.errors += 1
+                print("[WARN] result cache (shared) get failed:", e)
+                body = None
+            if body is not None:
+                self.shared_hits += 1
+                self.local.hset(key, field, body, self.local_ttl)
+                return body
+        self.misses += 1
+        return None
+
+    def put(self, key: str, field, body: bytes, ttl: float):
+        field = str(field)
+        self.local.hset(key, field, body, self._ttl_local(ttl))
+        if self.shared is not None:
+            try:
+                self.shared.hset(key, field, body, ttl)
+            except Exception as e:
+                self.errors += 1
+                print("[WARN] result cache (shared) set failed:", e)
+
+    def invalidate(self, key: str):
+        self.local.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception as e:
+                self.errors += 1
+                print("[WARN] result cache (shared) delete failed:", e)
+
+    def clear(self, prefix: str = "") -> int:
+        """Xoá mọi entry (hoặc chỉ key bắt đầu bằng prefix, vd. "similar:")."""
+        n = self.local.clear(prefix)
+        if self.shared is not None:
+            try:
+                n += self.shared.clear(prefix)
+            except Exception as e:
+                self.errors += 1
+                print("[WARN] result cache (shared) clear failed:", e)
+        return n
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RESULT_CACHE_ENABLED,
+            "local": self.local.stats(),
+            "shared": self.shared.stats() if self.shared is not None else None,
+            "hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses, "errors": self.errors,
+        }
+
+
+def make_result_cache() -> ResultCache:
+    """Theo env: luôn có LRU local; RESULT_CACHE_URL → thêm Redis (lỗi kết nối / thiếu package → chỉ local)."""
+    shared = None
+    if RESULT_CACHE_URL:
+        try:
+            shared = RedisBackend.from_url(RESULT_CACHE_URL)
+            shared.client.ping()
+        except Exception as e:
+            print("[WARN] result cache shared backend unavailable, using in-process only:", e)
+            shared = None
+    return ResultCache(MemoryBackend(RESULT_CACHE_SIZE), shared)
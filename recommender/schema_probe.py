@@ -0,0 +1,127 @@
+# schema_probe.py — Cache collection/index layout; kiểm tra index cho các query nóng
+# Thay db.list_collection_names() trên request path bằng snapshot refresh nền.
+#   ENSURE_INDEXES=1 : tự tạo index còn thiếu (mặc định chỉ cảnh báo)
+#   python schema_probe.py [--create]   # kiểm tra / tạo index từ CLI (ops, trước khi deploy)
+import os, time, threading
+from typing import Dict, List, Optional, Set, Tuple
+
+SCHEMA_PROBE_SECONDS = float(os.getenv("SCHEMA_PROBE_SECONDS", "600"))
+ENSURE_INDEXES       = os.getenv("ENSURE_INDEXES", "0") == "1"
+
+IndexSpec = Tuple[Tuple[str, int], ...]
+
+
+def required_indexes(playback_col: str = "playback_state", users_col: str = "users",
+                     movies_col: str = "movies", trending_col: str = "") -> Dict[str, List[IndexSpec]]:
+    """Index mà các query nóng cần (collection → key specs)."""
+    req = {
+        playback_col: [
+            (("userId", 1), ("lastActionAt", 1)),  # profile cold start: {userId, lastActionAt >= since}
+            (("lastActionAt", 1),),                # seen overlay poll, trending window, export --incremental
+        ],
+        users_col: [(("updatedAt", 1),)],          # export --incremental
+        movies_col: [(("updatedAt", 1),)],
+    }
+    if trending_col:
+        req[trending_col] = [(("score", -1),)]
+    return req
+
+
+def _covers(existing: IndexSpec, spec: IndexSpec) -> bool:
+    """Index có sẵn dùng được nếu spec là prefix của key pattern."""
+    return existing[:len(spec)] == spec
+
+
+def _label(name: str, spec: IndexSpec) -> str:
+    return f"{name}{{{', '.join(f'{k}: {v}' for k, v in spec)}}}"
+
+
+class SchemaProbe:
+    def __init__(self, db, required: Dict[str, List[IndexSpec]], create: bool = ENSURE_INDEXES):
+        self.db = db
+        self.required = required
+        self.create = create
+        self.collections: Optional[Set[str]] = None   # None = chưa probe được
+        self.indexes: Dict[str, List[IndexSpec]] = {}
+        self.missing: Dict[str, List[IndexSpec]] = {}
+        self.created: List[str] = []
+        self.probed_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> dict:
+        with self._lock:
+            try:
+                cols = set(self.db.list_collection_names())
+                indexes, missing = {}, {}
+                for name, specs in self.required.items():
+                    if name not in cols:
+                        continue
+                    have = [tuple((k, int(v) if isinstance(v, (int, float)) else v) for k, v in ix["key"].items())
+                            for ix in self.db[name].list_indexes()]
+                    indexes[name] = have
+                    lack = [s for s in specs if not any(_covers(h, s) for h in have)]
+                    for spec in lack:
+                        if self.create:
+                            self.db[name].create_index(list(spec))
+                            self.created.append(_label(name, spec))
+                            print(f"[INFO] created index {_label(name, spec)}")
+                        else:
+                            missing.setdefault(name, []).append(spec)
+                # refresh định kỳ: chỉ log khi tập index thiếu thay đổi, không lặp lại mỗi lần probe
+                before = [(k, s) for k, v in self.missing.items() for s in v]
+                after = [(k, s) for k, v in missing.items() for s in v]
+                for name, spec in after:
+                    if (name, spec) not in before:
+                        print(f"[WARN] missing index {_label(name, spec)} — queries on it will scan the collection "
+                              f"(ENSURE_INDEXES=1 or `python schema_probe.py --create`)")
+                for name, spec in before:
+                    if (name, spec) not in after and name in cols:
+                        print(f"[INFO] index {_label(name, spec)} now present")
+                self.collections, self.indexes, self.missing = cols, indexes, missing
+                self.probed_at = time.time()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print("[WARN] schema probe failed:", e)
+            return self.stats()
+
+    def has(self, collection: str) -> bool:
+        """Collection tồn tại? Chưa probe được → giả định có (query rỗng vẫn an toàn)."""
+        cols = self.collections
+        return True if cols is None else collection in cols
+
+    def run(self, interval: float, stop: threading.Event):
+        def _loop():
+            while not stop.wait(interval):
+                self.refresh()
+        t = threading.Thread(target=_loop, daemon=True, name="schema-probe")
+        t.start()
+        return t
+
+    def stats(self) -> dict:
+        return {
+            "collections": sorted(self.collections) if self.collections is not None else None,
+            "missing_indexes": {k: [dict(s) for s in v] for k, v in self.missing.items()},
+            "created_indexes": list(self.created),
+            "probed_at": self.probed_at,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Check (and optionally create) indexes used by the recommender")
+    ap.add_argument("--create", action="store_true")
+    args = ap.parse_args()
+    _db = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))[os.getenv("DB_NAME", "Movie-web")]
+    probe = SchemaProbe(_db, required_indexes(os.getenv("WATCH_COLLECTION", "playback_state"),
+                                              os.getenv("USERS_COLLECTION", "users"),
+                                              os.getenv("MOVIES_COLLECTION", "movies"),
+                                              os.getenv("TRENDING_COLLECTION", "")), create=args.create)
+    res = probe.refresh()
+    print("[INFO] missing:", res["missing_indexes"] or "none", "| created:", res["created_indexes"] or "none")
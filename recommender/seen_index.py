@@ -0,0 +1,250 @@
+# seen_index.py — Per-user "đã xem" index (CSR) + overlay cho lượt xem sau lần export
+import os, datetime, threading
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from id_codec import item_code, oid_bytes, rows_for
+
+SEEN_MASK_SCORE = -1e9
+SEEN_OVERLAY_COMPACT = int(os.getenv("SEEN_OVERLAY_COMPACT", "10000"))  # cặp trong dict → gộp vào CSR delta
+SEEN_OVERLAY_MAX     = int(os.getenv("SEEN_OVERLAY_MAX", "5000000"))    # tổng cặp overlay giữa hai lần export (0 = không giới hạn)
+
+
+def playback_item_key(w: dict) -> Optional[str]:
+    """playback_state row → 'movie:<id>' / 'series:<id>' (giống export_interactions.py)."""
+    mid = w.get("movieId")
+    if not mid:
+        return None
+    is_series = (w.get("seasonNumber") is not None) or (w.get("episodeNumber") is not None)
+    return f"{'series' if is_series else 'movie'}:{str(mid)}"
+
+
+def playback_item_code(w: dict) -> Optional[bytes]:
+    """Như playback_item_key nhưng trả item code 13 byte (id_codec) — tra hàng loạt bằng rows_for."""
+    mid = w.get("movieId")
+    if not mid:
+        return None
+    return item_code(mid, (w.get("seasonNumber") is not None) or (w.get("episodeNumber") is not None))
+
+
+class SeenIndex:
+    """
+    Base: CSR (indptr, indices) aligned with user_id_map.json / item_id_map.json,
+    built by export_interactions.py from playback_state.
+    Overlay: watches newer than `since` — {userId: set(item_idx)} cho lượt mới nhất, gộp vào
+    CSR delta (_delta_rows → _delta_ptr/_delta_idx) khi vượt SEEN_OVERLAY_COMPACT cặp;
+    tổng overlay dừng ở SEEN_OVERLAY_MAX cặp (lượt vượt quá bị bỏ, tới lần export sau).
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, since: Optional[datetime.datetime],
+                 compact_at: int = SEEN_OVERLAY_COMPACT, max_pairs: int = SEEN_OVERLAY_MAX):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.since = since
+        self.overlay: Dict[str, Set[int]] = {}
+        self.compact_at = compact_at
+        self.max_pairs = max_pairs
+        self._pending = 0
+        self._delta_rows: Dict[str, int] = {}
+        self._delta_ptr = np.zeros(1, dtype=np.int64)
+        self._delta_idx = np.empty(0, dtype=np.int32)
+        self.compactions = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    @property
+    def num_users(self) -> int:
+        return self.indptr.shape[0] - 1
+
+    @classmethod
+    def load(cls, path: str, num_users: int, num_items: int) -> "SeenIndex":
+        data = np.load(path)
+        indptr, indices = data["indptr"], data["indices"]
+        if indptr.shape[0] != num_users + 1 or (indices.size and indices.max() >= num_items):
+            raise RuntimeError("Seen index/Mapping mismatch")
+        since = None
+        if "since" in data.files and int(data["since"]) > 0:
+            since = datetime.datetime.fromtimestamp(int(data["since"]), tz=datetime.timezone.utc).replace(tzinfo=None)
+        return cls(indptr, indices, since)
+
+    @classmethod
+    def from_db(cls, col, user_index: Dict[str, int], item_index: Dict[str, int]) -> "SeenIndex":
+        """Fallback when the artifact is missing: one streaming scan of playback_state."""
+        since = datetime.datetime.utcnow()
+        rows = [[] for _ in range(len(user_index))]
+        cur = col.find({}, {"userId": 1, "movieId": 1, "seasonNumber": 1, "episodeNumber": 1}).batch_size(10000)
+        docs = []
+        for w in cur:
+            docs.append(w)
+            if len(docs) == 10000:
+                _append_rows(rows, docs, user_index, item_index)
+                docs = []
+        _append_rows(rows, docs, user_index, item_index)
+        return cls(*build_csr(rows), since)
+
+    def _delta(self, uid: str) -> Optional[np.ndarray]:
+        r = self._delta_rows.get(uid)
+        return None if r is None else self._delta_idx[self._delta_ptr[r]:self._delta_ptr[r + 1]]
+
+    def seen(self, uidx: Optional[int], uid: str) -> np.ndarray:
+        """Item indices the user has watched (base ∪ overlay)."""
+        parts = [self.indices[self.indptr[uidx]:self.indptr[uidx + 1]]] if uidx is not None else []
+        with self._lock:
+            delta = self._delta(uid)
+            pending = self.overlay.get(uid)
+            if pending:
+                pending = np.fromiter(pending, dtype=np.int32, count=len(pending))
+        parts += [a for a in (delta, pending) if a is not None and len(a)]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+    def pairs(self, uidxs: np.ndarray, uids) -> "tuple[np.ndarray, np.ndarray]":
+        """(row, item_idx) of every seen pair for a batch of users; row = position in batch."""
+        rows, cols = _csr_pairs(self.indptr, self.indices, np.asarray(uidxs, dtype=np.int64))
+        with self._lock:
+            if not self._delta_rows and not self.overlay:
+                return rows, cols
+            drows = np.fromiter((self._delta_rows.get(u, -1) for u in uids), dtype=np.int64, count=len(uids))
+            has = np.flatnonzero(drows >= 0)
+            dr, dc = _csr_pairs(self._delta_ptr, self._delta_idx, drows[has])
+            pr, pc = [], []
+            for r, uid in enumerate(uids):
+                p = self.overlay.get(uid)
+                if p:
+                    pr.append(np.full(len(p), r, dtype=np.int64))
+                    pc.append(np.fromiter(p, dtype=np.int32, count=len(p)))
+        return (np.concatenate([rows, has[dr]] + pr).astype(rows.dtype, copy=False),
+                np.concatenate([cols, dc] + pc).astype(cols.dtype, copy=False))
+
+    def mask(self, scores: np.ndarray, uidx: Optional[int], uid: str) -> np.ndarray:
+        """In-place: scores[seen] = -1e9 (một phép gán vector hoá)."""
+        scores[self.seen(uidx, uid)] = SEEN_MASK_SCORE
+        return scores
+
+    def has_overlay(self, uid: str) -> bool:
+        """User có lượt xem mới sau lần export (factor vector có thể đã cũ)."""
+        with self._lock:
+            return uid in self._delta_rows or bool(self.overlay.get(uid))
+
+    def add(self, uid: str, item_idx: int):
+        item_idx = int(item_idx)
+        with self._lock:
+            pending = self.overlay.get(uid)
+            if pending is not None and item_idx in pending:
+                return
+            delta = self._delta(uid)
+            if delta is not None and np.any(delta == item_idx):
+                return
+            if self.max_pairs and self._pending + self._delta_idx.size >= self.max_pairs:
+                if not self.dropped:
+                    print(f"[WARN] seen overlay full ({self.max_pairs} pairs) — new watches ignored "
+                          "until the next export_interactions.py + model reload")
+                self.dropped += 1
+                return
+            self.overlay.setdefault(uid, set()).add(item_idx)
+            self._pending += 1
+            if self.compact_at and self._pending >= self.compact_at:
+                self._compact()
+
+    def _compact(self):
+        """Dict overlay → CSR delta (gọi khi đang giữ _lock); lượt mới của một user nối vào cuối hàng của nó."""
+        users = list(self.overlay)
+        rows = np.fromiter((self._delta_rows.setdefault(u, len(self._delta_rows)) for u in users),
+                           dtype=np.int64, count=len(users))
+        counts = np.fromiter((len(self.overlay[u]) for u in users), dtype=np.int64, count=len(users))
+        items = np.fromiter((i for u in users for i in self.overlay[u]), dtype=np.int32, count=int(counts.sum()))
+        n_rows = len(self._delta_rows)
+        ptr = np.zeros(n_rows + 1, dtype=np.int64)
+        ptr[:self._delta_ptr.shape[0]] = self._delta_ptr
+        ptr[self._delta_ptr.shape[0]:] = self._delta_ptr[-1]
+        order = np.argsort(np.repeat(rows, counts), kind="stable")
+        self._delta_idx = np.insert(self._delta_idx, np.repeat(ptr[rows + 1], counts)[order], items[order])
+        grow = np.zeros(n_rows, dtype=np.int64)
+        grow[rows] = counts
+        ptr[1:] += np.cumsum(grow)
+        self._delta_ptr = ptr
+        self.overlay = {}
+        self._pending = 0
+        self.compactions += 1
+
+    def poll(self, col, item_index: Dict[str, int], touched: Optional[Set[str]] = None,
+             owns: Optional[Callable[[List[str]], np.ndarray]] = None) -> int:
+        """
+        Pull playback rows with lastActionAt > since into the overlay; touched ← userId có lượt xem mới.
+        owns (sharded: ALSModel.owns) → chỉ giữ user thuộc shard này, overlay không chứa user của shard khác.
+        """
+        now = datetime.datetime.utcnow()
+        q = {"lastActionAt": {"$gt": self.since}} if self.since else {}
+        cur = col.find(q, {"userId": 1, "movieId": 1, "seasonNumber": 1, "episodeNumber": 1})
+        docs = [w for w in cur if w.get("userId")]
+        if owns is not None and docs:
+            mask = owns([str(w["userId"]) for w in docs])
+            docs = [w for w, ok in zip(docs, mask.tolist()) if ok]
+        if touched is not None:
+            touched.update(str(w["userId"]) for w in docs)
+        iidx = rows_for(item_index, [playback_item_code(w) for w in docs], item=True)
+        n = 0
+        for w, i in zip(docs, iidx.tolist()):
+            if i >= 0:
+                self.add(str(w["userId"]), i)
+                n += 1
+        self.since = now
+        return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            overlay_users = len(self._delta_rows.keys() | self.overlay.keys())
+            pending, delta = self._pending, int(self._delta_idx.size)
+            delta_bytes = self._delta_idx.nbytes + self._delta_ptr.nbytes
+        return {
+            "users": self.num_users,
+            "pairs": int(self.indices.size),
+            "overlay_users": overlay_users,
+            "overlay_pairs": pending + delta,
+            "overlay_pending": pending,
+            "overlay_delta_pairs": delta,
+            "overlay_delta_bytes": delta_bytes,
+            "overlay_max": self.max_pairs,
+            "overlay_dropped": self.dropped,
+            "compactions": self.compactions,
+            "since": self.since.isoformat() if self.since else None,
+        }
+
+
+def _csr_pairs(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray):
+    """(vị trí trong `rows`, item_idx) của mọi phần tử trong các hàng `rows` của CSR — không vòng lặp Python."""
+    starts = indptr[rows]
+    lens = indptr[rows + 1] - starts
+    pos = np.repeat(np.arange(rows.size), lens)
+    offs = np.arange(int(lens.sum())) - np.repeat(np.cumsum(lens) - lens, lens)
+    return pos, indices[np.repeat(starts, lens) + offs]
+
+
+def _append_rows(rows, docs, user_index, item_index):
+    """Một batch playback docs → rows[uidx].append(iidx), tra user / item bằng một lần searchsorted mỗi loại."""
+    uidx = rows_for(user_index, [oid_bytes(w.get("userId")) for w in docs], item=False)
+    iidx = rows_for(item_index, [playback_item_code(w) for w in docs], item=True)
+    for u, i in zip(uidx.tolist(), iidx.tolist()):
+        if u >= 0 and i >= 0:
+            rows[u].append(i)
+
+
+def build_csr(rows):
+    """list[list[int]] (một list item_idx cho mỗi user) → (indptr, indices), unique + sorted."""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    parts = []
+    for i, r in enumerate(rows):
+        arr = np.unique(np.asarray(r, dtype=np.int32))
+        parts.append(arr)
+        indptr[i + 1] = indptr[i] + arr.size
+    indices = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+    return indptr, indices.astype(np.int32)
+
+
+def save_seen_index(path: str, rows, since: datetime.datetime):
+    indptr, indices = build_csr(rows)
+    np.savez(path, indptr=indptr, indices=indices,
+             since=np.int64(int(since.replace(tzinfo=datetime.timezone.utc).timestamp())))
+    return int(indices.size)
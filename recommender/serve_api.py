@@ -1,15 +1,31 @@
 # serve_api.py — Personalized ALS Recommender (likedItems + category as string)
-import os, json
-from typing import List, Dict, Set
+import time, threading
+from typing import List, Dict, Optional, Tuple
 
-import numpy as np
-from bson import ObjectId
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from dotenv import load_dotenv
-
-load_dotenv()
+from fastapi.responses import PlainTextResponse
+
+from item_cache import watch_catalog_changes
+from seen_index import playback_item_key
+from id_codec import item_keys
+from metrics import metrics, begin_request, server_timing, SERVER_TIMING
+from result_cache import user_key, similar_key, RESULT_CACHE_USER_TTL, RESULT_CACHE_SIMILAR_TTL
+from schema_probe import SCHEMA_PROBE_SECONDS
+from trending import TRENDING_REFRESH_SECONDS
+import reco_pipeline
+from model_registry import ALSModel
+# Config, db, registry, cache, helper: serve_core.py (dùng chung với serve_async.py)
+from serve_core import (
+    DB_NAME, PLAYBACK_COL, ITEM_CACHE_WARM, ITEM_CACHE_WATCH, SEEN_POLL_SECONDS, BATCH_MAX_USERS,
+    MODEL_WATCH_SECONDS, SERVE_ASYNC, CACHE_CONTROL_USER, CACHE_CONTROL_SIMILAR,
+    db, schema, registry, item_cache, trending, folder, result_cache,
+    _model, _fetch_items, _user_profile_categories, _users_profile_categories, _user_pref,
+    _trending_filtered, _fold_in, _similar_candidates, _user_keys, _pipeline_pool, _assemble,
+    _batch_candidates, _batch_results, _batch_folds, _fold_keys, _batch_meta_keys, _fold_results,
+    _batch_pools, _pool_keys, _pool_results,
+    _result_get, _result_put, _json_response, _fill_trending,
+)
 
 app = FastAPI(title="Movie/Series Recommendation")
 app.add_middleware(
@@ -19,320 +35,325 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+_bg_stop = threading.Event()
 
-MONGO_URL   = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME     = os.getenv("DB_NAME", "Movie-web")
-PLAYBACK_COL = os.getenv("WATCH_COLLECTION", "playback_state")  # đồng bộ tên env WATCH_COLLECTION
-
-db = MongoClient(MONGO_URL)[DB_NAME]
-
-# === Load artifacts ===
-try:
-    with open("artifacts/user_id_map.json", "r", encoding="utf-8") as f:
-        users = json.load(f)["users"]
-    with open("artifacts/item_id_map.json", "r", encoding="utf-8") as f:
-        items = json.load(f)["items"]  # "movie:<id>" or "series:<id>"
-
-    data = np.load("artifacts/als_model.npz")
-    U = data["user_factors"]
-    V = data["item_factors"]
-
-    # auto-fix if swapped
-    if U.shape[0] == len(items) and V.shape[0] == len(users):
-        U, V = V, U
-
-    user_index = {u: i for i, u in enumerate(users)}
-    item_index = {k: i for i, k in enumerate(items)}
-
-    if U.shape[0] != len(users) or V.shape[0] != len(items):
-        raise RuntimeError("Model/Mapping mismatch")
-
-    MODEL_READY = True
-except Exception as e:
-    print("[ERROR] model load failed:", e)
-    users = items = []
-    user_index = item_index = {}
-    U = V = None
-    MODEL_READY = False
-
-
-# === helpers ===
-def _as_oid(s: str):
-    try:
-        return ObjectId(s)
-    except Exception:
-        return None
-
-def _split_item_key(key: str):
-    parts = key.split(":", 1)
-    return (parts[0], parts[1]) if len(parts) == 2 else ("movie", key)
 
-def _fetch_meta(kind: str, oid_str_list: List[str]) -> Dict[str, dict]:
-    """
-    Fetch movie/series metadata by ids (string form).
-    IMPORTANT: category is a STRING in schema.
-    """
-    oids = [ObjectId(x) for x in oid_str_list if x and _as_oid(x)]
-    if not oids:
-        return {}
-
-    proj = {
-        "title": 1, "name": 1,
-        "posterUrl": 1, "image": 1, "titleImage": 1,
-        "year": 1, "category": 1, "rate": 1
-    }
-    col = db.movies if kind == "movie" else db.series
-    cur = col.find({"_id": {"$in": oids}}, proj)
-
-    meta = {}
-    for d in cur:
-        title = d.get("title") or d.get("name") or ""
-        poster = d.get("posterUrl") or d.get("image") or d.get("titleImage") or ""
-        # category is string; keep as-is (FE hiển thị)
-        meta[str(d["_id"])] = {
-            "title": title,
-            "posterUrl": poster,
-            "image": d.get("image"),
-            "titleImage": d.get("titleImage"),
-            "year": d.get("year"),
-            "category": d.get("category") or "",   # string
-            "rate": d.get("rate", 0),
-        }
-    return meta
-
-def _fetch_items(item_keys: List[str]) -> Dict[str, dict]:
-    """Fetch metadata for mixed list of 'movie:<id>' / 'series:<id>' keys."""
-    by_kind = {"movie": [], "series": []}
-    for k in item_keys:
-        kind, oid = _split_item_key(k)
-        by_kind.setdefault(kind, []).append(oid)
-
-    res = {}
-    if by_kind["movie"]:
-        chunk = _fetch_meta("movie", by_kind["movie"])
-        for oid, doc in chunk.items():
-            res[f"movie:{oid}"] = doc
-    if by_kind["series"]:
-        chunk = _fetch_meta("series", by_kind["series"])
-        for oid, doc in chunk.items():
-            res[f"series:{oid}"] = doc
-    return res
-
-def _user_profile_categories(user_id: str, days: int = 60) -> Set[str]:
-    """
-    Collect user's preferred categories from:
-    - playback_state (dựa theo season/episode để biết movie/series)
-    - users.likedItems [{refId, kind}]
-    Return lowercase set of categories (strings).
-    """
-    import datetime
-    pref: Set[str] = set()
-    oid = _as_oid(user_id)
-    if not oid:
-        return pref
-
-    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-
-    # A) playback_state → quyết định kind theo season/episode
-    if PLAYBACK_COL in db.list_collection_names():
-        cur = db[PLAYBACK_COL].find(
-            {"userId": oid, "lastActionAt": {"$gte": since}},
-            {"movieId": 1, "seasonNumber": 1, "episodeNumber": 1}
-        )
-        movie_ids, series_ids = [], []
-        for w in cur:
-            mid = w.get("movieId")
-            if not mid:
-                continue
-            is_series = (w.get("seasonNumber") is not None) or (w.get("episodeNumber") is not None)
-            if is_series:
-                series_ids.append(str(mid))
-            else:
-                movie_ids.append(str(mid))
-
-        if movie_ids:
-            mv = _fetch_meta("movie", movie_ids)
-            for m in mv.values():
-                c = (m.get("category") or "").strip().lower()
-                if c: pref.add(c)
-        if series_ids:
-            sr = _fetch_meta("series", series_ids)
-            for m in sr.values():
-                c = (m.get("category") or "").strip().lower()
-                if c: pref.add(c)
-
-    # B) likedItems
-    udoc = db.users.find_one({"_id": oid}, {"likedItems": 1}) or {}
-    for it in (udoc.get("likedItems") or []):
-        if not isinstance(it, dict): 
+# === lifecycle ===
+def _seen_poll_loop():
+    while not _bg_stop.wait(SEEN_POLL_SECONDS):
+        m = registry.current
+        if m is None or m.seen is None:
             continue
-        ref = _as_oid(str(it.get("refId")))
-        kind = it.get("kind")
-        if not (ref and kind in ("Movie", "Series")):
-            continue
-        col = db.movies if kind == "Movie" else db.series
-        d = col.find_one({"_id": ref}, {"category": 1}) or {}
-        c = (d.get("category") or "").strip().lower()
-        if c: pref.add(c)
-
-    return pref
-
-def _trending_filtered(pref: Set[str], topN=12):
+        touched = set()
+        try:
+            m.seen.poll(db[PLAYBACK_COL], m.item_index, touched, owns=m.owns if m.ring is not None else None)
+        except Exception as e:
+            print("[WARN] seen overlay poll failed:", e)
+        _invalidate_users(m, touched)
+
+def _invalidate_users(m: ALSModel, uids):
     """
-    Trending fallback from playback_state, filtered by user's categories (if any).
-    category is string; match lowercase.
+    Lượt xem mới thấy qua poll (có thể do worker / instance khác nhận /events/playback):
+    không có tầng cache chung → worker này tự xoá user:* + fold-in của các user đó.
     """
-    import datetime
-    since = datetime.datetime.utcnow() - datetime.timedelta(days=30)
-    if PLAYBACK_COL not in db.list_collection_names():
-        return []
-
-    pipe = [
-        {"$match": {"lastActionAt": {"$gte": since}}},
-        {"$group": {"_id": "$movieId", "c": {"$sum": 1}}},
-        {"$sort": {"c": -1}},
-        {"$limit": topN * 3},
-    ]
-    raw = list(db[PLAYBACK_COL].aggregate(pipe, allowDiskUse=True))
-    ids = [str(r["_id"]) for r in raw if r.get("_id")]
-
-    mv = _fetch_meta("movie", ids)
-    sr = _fetch_meta("series", ids)
-
-    res = []
-    for r in raw:
-        oid = str(r["_id"])
-        m = mv.get(oid) or sr.get(oid)
-        if not m:
-            continue
-        c = (m.get("category") or "").strip().lower()
-        if pref and c not in pref:
-            continue
-        kind = "movie" if oid in mv else "series"
-        res.append({
-            "kind": kind,
-            "movieId": oid,
-            **m
-        })
-        if len(res) >= topN:
-            break
-    return res
+    if not uids:
+        return
+    for uid in uids:
+        folder.invalidate(uid)
+        if result_cache.shared is None:
+            result_cache.invalidate(user_key(m.version, uid))
+    metrics.inc("reco_seen_poll_invalidations_total", len(uids))
+
+def _catalog_changed(key: str):
+    """Change stream movies/series: similar:* chứa metadata cũ của item (ở mọi list có nó) → xoá cả nhóm."""
+    n = result_cache.clear("similar:")
+    metrics.inc("reco_catalog_cache_clears_total")
+    if n:
+        print(f"[INFO] catalog change {key}: cleared {n} similar-items cache entries")
+
+def _warm_item_cache(m: ALSModel):
+    try:
+        n = item_cache.warm(m.items)
+        print(f"[INFO] item cache warmed: {n} keys")
+    except Exception as e:
+        print("[WARN] item cache warm-up failed:", e)
+
+@app.on_event("startup")
+def _startup():
+    schema.refresh()
+    if SCHEMA_PROBE_SECONDS > 0:
+        schema.run(SCHEMA_PROBE_SECONDS, _bg_stop)
+    m = registry.current
+    if ITEM_CACHE_WARM:
+        if m is not None:
+            _warm_item_cache(m)
+        registry.on_swap.append(_warm_item_cache)
+    if ITEM_CACHE_WATCH:
+        watch_catalog_changes(db, item_cache, _bg_stop, on_change=_catalog_changed)
+    # warm trending trước khi nhận request: snapshot() không tự refresh trên request path
+    print("[INFO] trending:", trending.refresh())
+    if trending.snapshot() is None and TRENDING_REFRESH_SECONDS <= 0:
+        print("[WARN] trending snapshot unavailable — cold start trả rỗng tới khi POST /admin/trending/refresh")
+    if TRENDING_REFRESH_SECONDS > 0:
+        trending.run(TRENDING_REFRESH_SECONDS, _bg_stop)
+    if SEEN_POLL_SECONDS > 0:
+        threading.Thread(target=_seen_poll_loop, daemon=True, name="seen-overlay-poll").start()
+    if MODEL_WATCH_SECONDS > 0:
+        registry.watch(MODEL_WATCH_SECONDS, _bg_stop)
+
+@app.on_event("shutdown")
+def _shutdown():
+    _bg_stop.set()
+
+
+# === metrics ===
+metrics.gauge("reco_model_users", lambda: len(registry.current.users), "Users in the serving model")
+metrics.gauge("reco_model_items", lambda: len(registry.current.items), "Items in the serving model")
+metrics.gauge("reco_item_cache_size", lambda: item_cache.stats()["size"])
+metrics.gauge("reco_item_cache_hits", lambda: item_cache.stats()["hits"])
+metrics.gauge("reco_item_cache_misses", lambda: item_cache.stats()["misses"])
+metrics.gauge("reco_seen_overlay_pairs", lambda: registry.current.seen.stats()["overlay_pairs"])
+metrics.gauge("reco_seen_overlay_bytes", lambda: registry.current.seen.stats()["overlay_delta_bytes"])
+metrics.gauge("reco_seen_overlay_dropped", lambda: registry.current.seen.stats()["overlay_dropped"])
+metrics.gauge("reco_fold_in_cache_size", lambda: folder.stats()["size"])
+metrics.gauge("reco_result_cache_size", lambda: result_cache.local.stats()["size"])
+metrics.gauge("reco_trending_age_seconds", lambda: time.time() - trending.stats()["built_at"])
+
+@app.middleware("http")
+async def _request_timing(request: Request, call_next):
+    """Span của request /recommend/* → histogram theo route; SERVER_TIMING=1 → header Server-Timing."""
+    if "/recommend/" not in request.url.path:
+        return await call_next(request)
+    spans = begin_request()
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    dt = time.perf_counter() - t0
+    route = request.scope.get("route")
+    path = getattr(route, "path", "other")
+    metrics.observe("reco_request_seconds", dt, route=path)
+    metrics.inc("reco_requests_total", route=path, status=response.status_code)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(spans, dt)
+    return response
 
 
 # === routes ===
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text format: span theo stage, counter cold start / fallback / lọc candidate, Mongo command."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/healthz")
 def healthz():
+    m = registry.current
     return {
         "ok": True,
-        "users": len(users),
-        "items": len(items),
-        "model_ready": MODEL_READY,
-        "db": DB_NAME
+        "users": len(m.users) if m else 0,
+        "items": len(m.items) if m else 0,
+        "model_ready": m is not None,
+        "model": registry.stats(),
+        "db": DB_NAME,
+        "item_cache": item_cache.stats(),
+        "seen_index": m.seen.stats() if m and m.seen is not None else None,
+        "serve_mode": "precomputed" if m and m.topk is not None else "live",
+        "topk": m.topk.stats() if m and m.topk is not None else None,
+        "sim_index": m.sim_index.stats() if m and m.sim_index is not None else None,
+        "category_profile": m.profile.stats() if m and m.profile is not None else None,
+        "trending": trending.stats(),
+        "schema": schema.stats(),
+        "fold_in": folder.stats(),
+        "result_cache": result_cache.stats(),
     }
 
-@app.get("/recommend/user/{uid}")
-def recommend(uid: str, n: int = Query(8, ge=1, le=50)):
-    if not MODEL_READY:
-        raise HTTPException(status_code=503, detail="Model not ready")
+@app.post("/admin/model/reload")
+def reload_model(wait: bool = Query(False), force: bool = Query(False)):
+    """
+    Load artifacts mới (sau train_als.py) rồi swap atomically.
+    Mặc định chạy nền; ?wait=true để chờ kết quả.
+    """
+    if wait:
+        return registry.reload(force=force)
+    registry.reload_async(force=force)
+    return {"status": "scheduled", "current": registry.stats()["current"]}
 
-    # Cold start or unknown user in factor map → trending theo category (nếu có)
-    if uid not in user_index:
+@app.post("/admin/items/refresh")
+def refresh_items(keys: Optional[List[str]] = Body(None, embed=True)):
+    """
+    Invalidate item metadata cache.
+    - body {"keys": ["movie:<id>", ...]} → chỉ làm mới các key này
+    - không có body → xoá toàn bộ rồi warm lại từ item_id_map.json
+    """
+    results = result_cache.clear()  # response đã cache chứa metadata cũ
+    if keys:
+        dropped = item_cache.invalidate(keys)
+        item_cache.get_many(keys)
+        return {"invalidated": dropped, "reloaded": len(keys), "results_cleared": results}
+    m = registry.current
+    dropped = item_cache.invalidate()
+    warmed = item_cache.warm(m.items) if m else 0
+    return {"invalidated": dropped, "reloaded": warmed, "results_cleared": results}
+
+@app.post("/admin/trending/refresh")
+def refresh_trending():
+    """Dựng lại trending snapshot ngay (mặc định refresh nền mỗi TRENDING_REFRESH_SECONDS)."""
+    return trending.refresh()
+
+@app.post("/events/playback")
+def playback_event(
+    userId: str = Body(...),
+    movieId: str = Body(...),
+    seasonNumber: Optional[int] = Body(None),
+    episodeNumber: Optional[int] = Body(None),
+):
+    """Node server báo lượt xem mới → cập nhật overlay "đã xem" ngay, không chờ poll."""
+    key, known = _apply_playback(_model(), {"userId": userId, "movieId": movieId,
+                                            "seasonNumber": seasonNumber, "episodeNumber": episodeNumber})
+    return {"ok": True, "itemKey": key, "known": known}
+
+@app.post("/events/playback/batch")
+def playback_events(events: List[dict] = Body(..., embed=True)):
+    """
+    Nhiều lượt xem một lần (ingest_worker.py) — cùng xử lý với /events/playback.
+    Shard: bỏ qua user của shard khác (ingest_worker có thể notify mọi shard với cùng batch).
+    """
+    m = _model()
+    valid = [ev for ev in events if ev.get("userId") and ev.get("movieId")]
+    owned = m.owns([str(ev["userId"]) for ev in valid]).tolist()
+    known = 0
+    for ev, ok in zip(valid, owned):
+        if ok:
+            known += _apply_playback(m, ev)[1]
+    metrics.inc("reco_playback_events_total", len(events), route="batch")
+    return {"ok": True, "events": len(events), "known": known, "skipped": len(owned) - sum(owned)}
+
+def _apply_playback(m: ALSModel, ev: dict) -> Tuple[Optional[str], bool]:
+    uid = str(ev["userId"])
+    key = playback_item_key(ev)
+    idx = m.item_index.get(key or "")
+    if m.seen is not None and idx is not None:
+        m.seen.add(uid, idx)
+    folder.invalidate(uid)  # lần sau fold-in lại với lượt xem mới
+    result_cache.invalidate(user_key(m.version, uid))
+    return key, idx is not None
+
+def _recommend_user(m: ALSModel, uid: str, n: int) -> dict:
+    uidx = m.user_index.get(uid)
+    fold = _fold_in(m, uid, uidx)
+
+    # Cold start (không có trong factor map, chưa có tương tác để fold-in) → trending theo category
+    if uidx is None and fold is None:
+        metrics.inc("reco_cold_start_total", route="user")
         pref = _user_profile_categories(uid)
         items_out = _trending_filtered(pref, topN=n)
         return {"userId": uid, "items": items_out, "cold_start": True}
 
-    uidx = user_index[uid]
-    uvec = U[uidx]
-    scores = V @ uvec  # (num_items,)
-
-    # Mask watched
-    watched_keys = set()
-    if PLAYBACK_COL in db.list_collection_names():
-        cur = db[PLAYBACK_COL].find(
-            {"userId": _as_oid(uid)},
-            {"movieId": 1, "seasonNumber": 1, "episodeNumber": 1}
-        )
-        for w in cur:
-            mid = w.get("movieId")
-            if not mid:
-                continue
-            is_series = (w.get("seasonNumber") is not None) or (w.get("episodeNumber") is not None)
-            kind = "series" if is_series else "movie"
-            watched_keys.add(f"{kind}:{str(mid)}")
-
-    for key in watched_keys:
-        idx = item_index.get(key)
-        if idx is not None:
-            scores[idx] = -1e9
-
-    # User category preferences (lowercase set)
-    pref = _user_profile_categories(uid)
-
-    # Lấy nhiều ứng viên rồi lọc theo category
-    top_take = min(max(n * 5, n), scores.shape[0])
-    idx = np.argpartition(-scores, range(top_take))[:top_take]
-    idx = idx[np.argsort(-scores[idx])]
-
-    keys = [items[i] for i in idx]
-    meta = _fetch_items(keys)
-
-    result = []
-    for i in idx:
-        key = items[i]
-        kind, oid = _split_item_key(key)
-        m = meta.get(key)
-        if not m:
-            continue
-        c = (m.get("category") or "").strip().lower()
-        if pref and c not in pref:
-            continue
-        result.append({
-            "kind": kind,
-            "movieId": oid,
-            **m
-        })
-        if len(result) >= n:
-            break
+    # User category preferences (lowercase set + mask theo category id)
+    pref, allowed = _user_pref(m, uid, uidx, fold)
+
+    if reco_pipeline.PIPELINE_ENABLED:
+        pool = _pipeline_pool(m, uid, uidx, n, allowed, fold)
+        meta = _fetch_items(pool.keys)
+        result = _assemble(reco_pipeline.rerank(pool, meta, n, pref), meta, n)
+    else:
+        keys = _user_keys(m, uid, uidx, n, allowed, fold)
+        result = _assemble(keys, _fetch_items(keys), n, pref if allowed is None else None)
 
     # Fallback: nếu không đủ (hoặc pref rỗng) → trending theo pref (có thể rỗng → unfiltered)
     if not result:
+        metrics.inc("reco_fallback_total", route="user")
         result = _trending_filtered(pref, topN=n)
 
-    return {"userId": uid, "items": result}
-
-@app.get("/recommend/similar/{kind}/{oid}")
-def similar(kind: str, oid: str, n: int = Query(12, ge=1, le=50)):
-    if not MODEL_READY:
-        raise HTTPException(status_code=503, detail="Model not ready")
-    if kind not in ("movie", "series"):
-        raise HTTPException(status_code=400, detail="kind must be 'movie' or 'series'")
+    out = {"userId": uid, "items": result}
+    if fold is not None:
+        metrics.inc("reco_fold_in_total", route="user")
+        out["folded_in"] = True
+    return out
 
+def _similar_items(m: ALSModel, kind: str, oid: str, n: int) -> dict:
     key = f"{kind}:{oid}"
-    if key not in item_index:
+    if key not in m.item_index:
         return {"itemKey": key, "items": []}
 
-    midx = item_index[key]
-    v = V[midx]
-    sims = V @ v
-    sims[midx] = -1e9
+    midx = m.item_index[key]
+    idx = _similar_candidates(m, midx, n)
 
-    take = min(n, sims.shape[0] - 1)
-    idx = np.argpartition(-sims, range(take))[:take]
-    idx = idx[np.argsort(-sims[idx])]
+    keys = item_keys(m.items, idx)
+    return {"itemKey": key, "items": _assemble(keys, _fetch_items(keys), n)}
 
-    keys = [items[i] for i in idx]
-    meta = _fetch_items(keys)
+@app.get("/recommend/user/{uid}")
+def recommend(request: Request, uid: str, n: int = Query(8, ge=1, le=50)):
+    """Cache theo (model version, uid, n); TTL ngắn + xoá khi có /events/playback."""
+    m = _model()
+    key = user_key(m.version, uid)
+    body = _result_get(key, n)
+    if body is None:
+        body = _result_put(key, n, _recommend_user(m, uid, n), RESULT_CACHE_USER_TTL)
+    return _json_response(request, body, CACHE_CONTROL_USER)
 
-    out = []
-    for i in idx:
-        k = items[i]
-        k_kind, k_oid = _split_item_key(k)
-        m = meta.get(k)
-        if not m:
-            continue
-        out.append({
-            "kind": k_kind,
-            "movieId": k_oid,
-            **m
-        })
-    return {"itemKey": key, "items": out}
+@app.get("/recommend/similar/{kind}/{oid}")
+def similar(request: Request, kind: str, oid: str, n: int = Query(12, ge=1, le=50)):
+    m = _model()
+    if kind not in ("movie", "series"):
+        raise HTTPException(status_code=400, detail="kind must be 'movie' or 'series'")
+
+    key = similar_key(m.version, kind, oid)
+    body = _result_get(key, n)
+    if body is None:
+        body = _result_put(key, n, _similar_items(m, kind, oid, n), RESULT_CACHE_SIMILAR_TTL)
+    return _json_response(request, body, CACHE_CONTROL_SIMILAR)
+
+@app.post("/recommend/users")
+def recommend_batch(
+    userIds: List[str] = Body(..., embed=True),
+    n: int = Body(8, ge=1, le=50, embed=True),
+):
+    """
+    Batch version of /recommend/user/{uid}: cùng kết quả với route đơn, một lần fetch metadata cho union.
+    RECO_PIPELINE=1: reco_pipeline cho mọi user (ALS retrieval = một U_batch @ V.T theo khối khi live).
+    RECO_PIPELINE=0: one U_batch @ V.T, row-wise top-k, vectorized seen/category masks.
+    """
+    m = _model()
+    if len(userIds) > BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"at most {BATCH_MAX_USERS} userIds per call")
+
+    uids = list(dict.fromkeys(userIds))  # unique, giữ thứ tự
+    folds = _batch_folds(m, uids)
+    known = [u for u in uids if u in m.user_index and u not in folds]
+    prof = m.profile
+    # Precomputed profile cho known users; user ngoài profile đọc DB một lần cho cả batch
+    need_db = [u for u in uids if (prof is None or u not in m.user_index) and u not in folds]
+    if prof is None:
+        need_db += list(folds)
+    prefs = _users_profile_categories(need_db)
+    prefs.update({u: prof.user_names(m.user_index[u]) for u in uids if u not in prefs and u not in folds})
+
+    if reco_pipeline.PIPELINE_ENABLED:
+        pools = _batch_pools(m, uids, folds, n)
+        meta = _fetch_items(_pool_keys(pools))
+        return _fill_trending(m, uids, prefs, _pool_results(pools, folds, prefs, meta, n), n)
+
+    fold_keys = _fold_keys(m, folds, prefs, n)
+    out: Dict[str, dict] = {}
+
+    cand = keep = None
+    if known:
+        cand, keep = _batch_candidates(m, known, n)
+    meta = _fetch_items(_batch_meta_keys(m, cand, keep, fold_keys))
+    if known:
+        out = _batch_results(m, known, prefs, cand, keep, meta, n)
+    out.update(_fold_results(fold_keys, meta, n))
+
+    return _fill_trending(m, uids, prefs, out, n)
+
+
+# === async serving path (serve_async.py) ===
+if SERVE_ASYNC in ("1", "both"):
+    import serve_async
+    if SERVE_ASYNC == "1":
+        _async_routes = {(r.path, meth) for r in serve_async.router.routes for meth in r.methods}
+        app.router.routes = [r for r in app.router.routes
+                             if not any((getattr(r, "path", None), meth) in _async_routes
+                                        for meth in (getattr(r, "methods", None) or ()))]
+        app.include_router(serve_async.router)
+    else:
+        app.include_router(serve_async.router, prefix="/async")
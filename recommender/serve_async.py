@@ -0,0 +1,201 @@
+# serve_async.py — Async serving path (SERVE_ASYNC=1): PyMongo Async / Motor thay MongoClient blocking
+# Các query độc lập (playback history, likedItems, metadata movie/series) chạy đồng thời bằng
+# asyncio.gather; phần numpy (helper của serve_core.py) chạy trong threadpool, không block event loop.
+# Bật trong serve_api:
+#   SERVE_ASYNC=1     → thay các route /recommend/* bằng bản async
+#   SERVE_ASYNC=both  → giữ route sync, thêm bản async dưới /async (so sánh bằng loadtest_api.py)
+import asyncio, inspect
+from typing import Dict, List, Set
+
+from bson import ObjectId
+from fastapi import APIRouter, Body, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
+
+import serve_core as core
+from id_codec import item_keys
+import reco_pipeline
+from mongo_client import async_client
+from metrics import metrics, timed, mongo_listeners
+from result_cache import user_key, similar_key, RESULT_CACHE_USER_TTL, RESULT_CACHE_SIMILAR_TTL
+
+router = APIRouter()
+_client = None
+
+
+def _adb():
+    """Async client tạo lười trong event loop của app (pool theo MONGO_* env)."""
+    global _client
+    if _client is None:
+        _client = async_client(core.MONGO_URL, event_listeners=mongo_listeners())
+    return _client[core.DB_NAME]
+
+
+@router.on_event("shutdown")
+async def _close_client():
+    global _client
+    if _client is not None:
+        res = _client.close()
+        if inspect.isawaitable(res):  # PyMongo Async: coroutine; Motor: sync
+            await res
+        _client = None
+
+
+async def _afetch_meta(kind: str, oid_str_list: List[str]) -> Dict[str, dict]:
+    oids = [ObjectId(x) for x in oid_str_list if x and core._as_oid(x)]
+    if not oids:
+        return {}
+    col = _adb().movies if kind == "movie" else _adb().series
+    docs = await col.find({"_id": {"$in": oids}}, core.META_PROJ).to_list(length=None)
+    return {str(d["_id"]): core._meta_from_doc(d) for d in docs}
+
+
+@timed("fetch_items")
+async def _afetch_items(keys: List[str]) -> Dict[str, dict]:
+    return await core.item_cache.get_many_async(keys, _afetch_meta)
+
+
+@timed("profile_db")
+async def _auser_profile_categories(user_id: str, days: int = 60) -> Set[str]:
+    """Như serve_core._user_profile_categories; playback + likedItems query song song."""
+    oid = core._as_oid(user_id)
+    if not oid:
+        return set()
+    adb = _adb()
+    playback = adb[core.PLAYBACK_COL].find(
+        {"userId": oid, "lastActionAt": {"$gte": core._profile_since(days)}},
+        {"movieId": 1, "seasonNumber": 1, "episodeNumber": 1}
+    ).to_list(length=None) if core.schema.has(core.PLAYBACK_COL) else asyncio.sleep(0, [])
+    docs, udoc = await asyncio.gather(playback, adb.users.find_one({"_id": oid}, {"likedItems": 1}))
+    return core._categories_of(await _afetch_items(list(core._history_keys(docs, udoc))))
+
+
+def _rerank_assemble(pool, meta: Dict[str, dict], n: int, pref: Set[str]) -> List[dict]:
+    return core._assemble(reco_pipeline.rerank(pool, meta, n, pref), meta, n)
+
+
+async def _arecommend_user(m, uid: str, n: int) -> dict:
+    uidx = m.user_index.get(uid)
+    # Fold-in dùng pymongo sync (cache TTL) → threadpool, không block event loop
+    fold = await run_in_threadpool(core._fold_in, m, uid, uidx) if core._needs_fold_in(m, uid, uidx) else None
+
+    if uidx is None and fold is None:
+        metrics.inc("reco_cold_start_total", route="user")
+        pref = await _auser_profile_categories(uid)
+        return {"userId": uid, "items": core._trending_filtered(pref, topN=n), "cold_start": True}
+
+    if m.profile is not None:
+        pref, allowed = core._user_pref(m, uid, uidx, fold)  # vector precomputed, không query DB
+    else:
+        pref, allowed = await _auser_profile_categories(uid), None
+
+    # Scoring (V @ u, argpartition, rerank) là CPU-bound → threadpool
+    if reco_pipeline.PIPELINE_ENABLED:
+        pool = await run_in_threadpool(core._pipeline_pool, m, uid, uidx, n, allowed, fold)
+        meta = await _afetch_items(pool.keys)
+        result = await run_in_threadpool(_rerank_assemble, pool, meta, n, pref)
+    else:
+        keys = await run_in_threadpool(core._user_keys, m, uid, uidx, n, allowed, fold)
+        result = core._assemble(keys, await _afetch_items(keys), n, pref if allowed is None else None)
+    if not result:
+        metrics.inc("reco_fallback_total", route="user")
+        result = core._trending_filtered(pref, topN=n)
+    out = {"userId": uid, "items": result}
+    if fold is not None:
+        metrics.inc("reco_fold_in_total", route="user")
+        out["folded_in"] = True
+    return out
+
+
+async def _asimilar_items(m, kind: str, oid: str, n: int) -> dict:
+    key = f"{kind}:{oid}"
+    if key not in m.item_index:
+        return {"itemKey": key, "items": []}
+
+    idx = await run_in_threadpool(core._similar_candidates, m, m.item_index[key], n)
+    keys = item_keys(m.items, idx)
+    return {"itemKey": key, "items": core._assemble(keys, await _afetch_items(keys), n)}
+
+
+@router.get("/recommend/user/{uid}")
+async def recommend(request: Request, uid: str, n: int = Query(8, ge=1, le=50)):
+    m = core._model()
+    key = user_key(m.version, uid)
+    body = core._result_get(key, n)
+    if body is None:
+        body = core._result_put(key, n, await _arecommend_user(m, uid, n), RESULT_CACHE_USER_TTL)
+    return core._json_response(request, body, core.CACHE_CONTROL_USER)
+
+
+@router.get("/recommend/similar/{kind}/{oid}")
+async def similar(request: Request, kind: str, oid: str, n: int = Query(12, ge=1, le=50)):
+    m = core._model()
+    if kind not in ("movie", "series"):
+        raise HTTPException(status_code=400, detail="kind must be 'movie' or 'series'")
+
+    key = similar_key(m.version, kind, oid)
+    body = core._result_get(key, n)
+    if body is None:
+        body = core._result_put(key, n, await _asimilar_items(m, kind, oid, n), RESULT_CACHE_SIMILAR_TTL)
+    return core._json_response(request, body, core.CACHE_CONTROL_SIMILAR)
+
+
+@timed("profile_db")
+async def _ausers_profile_categories(user_ids: List[str], days: int = 60) -> Dict[str, Set[str]]:
+    """Như serve_core._users_profile_categories; hai query $in chạy song song."""
+    if not user_ids:
+        return {}
+    oids, pb, uq = core._profile_queries(user_ids, days)
+    docs, udocs = [], []
+    if oids:
+        adb = _adb()
+        playback = (adb[core.PLAYBACK_COL].find(pb, core._PB_PROJ).to_list(length=None)
+                    if pb is not None else asyncio.sleep(0, []))
+        docs, udocs = await asyncio.gather(playback, adb.users.find(uq, {"likedItems": 1}).to_list(length=None))
+    keys = core._history_by_user(user_ids, docs, udocs)
+    return core._categories_by_user(keys, await _afetch_items(list(set().union(*keys.values()))))
+
+
+@router.post("/recommend/users")
+async def recommend_batch(
+    userIds: List[str] = Body(..., embed=True),
+    n: int = Body(8, ge=1, le=50, embed=True),
+):
+    m = core._model()
+    if len(userIds) > core.BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"at most {core.BATCH_MAX_USERS} userIds per call")
+
+    uids = list(dict.fromkeys(userIds))
+    folds = await run_in_threadpool(core._batch_folds, m, uids)
+    known = [u for u in uids if u in m.user_index and u not in folds]
+    prof = m.profile
+
+    # Profile DB (user ngoài profile) chạy song song với phần numpy trong threadpool:
+    # pipeline pool (không cần pref từ DB) hoặc U_batch @ V.T của đường cũ
+    need_db = [u for u in uids if (prof is None or u not in m.user_index) and u not in folds]
+    if prof is None:
+        need_db += list(folds)
+    if reco_pipeline.PIPELINE_ENABLED:
+        ranked = run_in_threadpool(core._batch_pools, m, uids, folds, n)
+    else:
+        ranked = run_in_threadpool(core._batch_candidates, m, known, n) if known else asyncio.sleep(0, None)
+    prefs, ranked = await asyncio.gather(_ausers_profile_categories(need_db), ranked)
+    for u in uids:
+        if u not in prefs and u not in folds:
+            prefs[u] = prof.user_names(m.user_index[u])
+
+    if reco_pipeline.PIPELINE_ENABLED:
+        meta = await _afetch_items(core._pool_keys(ranked))
+        out = await run_in_threadpool(core._pool_results, ranked, folds, prefs, meta, n)
+        return core._fill_trending(m, uids, prefs, out, n)
+
+    # prof None → pref của user fold-in đã có trong prefs (query async ở trên), _fold_keys không đọc DB
+    fold_keys = await run_in_threadpool(core._fold_keys, m, folds, prefs, n) if folds else {}
+
+    cand, keep = ranked if known else (None, None)
+    meta = await _afetch_items(await run_in_threadpool(core._batch_meta_keys, m, cand, keep, fold_keys))
+    out: Dict[str, dict] = {}
+    if known:
+        out = await run_in_threadpool(core._batch_results, m, known, prefs, cand, keep, meta, n)
+    out.update(core._fold_results(fold_keys, meta, n))
+
+    return core._fill_trending(m, uids, prefs, out, n)
@@ -0,0 +1,548 @@
+# serve_core.py — Config, Mongo, model registry, cache và helper dùng chung cho serve_api (sync) + serve_async
+# Không tạo FastAPI app: serve_api.py giữ app/middleware/route/lifecycle, serve_async.py giữ route async;
+# cả hai import module này (không import lẫn nhau lúc load module).
+import os
+from typing import Callable, List, Dict, Set, Optional
+
+import numpy as np
+from bson import ObjectId
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+from item_cache import ItemMetaCache
+from seen_index import playback_item_key
+from category_profile import norm_category
+from id_codec import item_keys
+from mongo_client import pool_options
+from metrics import metrics, span, timed, mongo_listeners
+from fold_in import FoldIn, FOLDIN_ENABLED, FOLDIN_STALE
+from result_cache import make_result_cache, encode, etag, etag_matches, RESULT_CACHE_ENABLED
+from schema_probe import SchemaProbe, required_indexes
+from trending import TrendingService, TRENDING_COLLECTION
+import reco_pipeline
+from model_registry import ALSModel, ModelRegistry
+
+load_dotenv()
+
+MONGO_URL   = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME     = os.getenv("DB_NAME", "Movie-web")
+PLAYBACK_COL = os.getenv("WATCH_COLLECTION", "playback_state")  # đồng bộ tên env WATCH_COLLECTION
+
+ITEM_CACHE_TTL   = float(os.getenv("ITEM_CACHE_TTL", "600"))      # giây
+ITEM_CACHE_SIZE  = int(os.getenv("ITEM_CACHE_SIZE", "50000"))
+ITEM_CACHE_WARM  = os.getenv("ITEM_CACHE_WARM", "1") == "1"
+ITEM_CACHE_WATCH = os.getenv("ITEM_CACHE_WATCH", "0") == "1"     # change stream (cần replica set)
+SEEN_POLL_SECONDS = float(os.getenv("SEEN_POLL_SECONDS", "30"))  # 0 = tắt polling overlay
+BATCH_MAX_USERS  = int(os.getenv("BATCH_MAX_USERS", "1000"))
+BATCH_MATMUL_ROWS = int(os.getenv("BATCH_MATMUL_ROWS", "256"))  # user mỗi khối U_batch @ V.T (RAM ~ rows × items × 4B)
+SERVE_MODE       = os.getenv("SERVE_MODE", "live")  # "live" | "precomputed" (topk_*.npy từ train_als.py)
+ARTIFACTS_DIR    = os.getenv("ARTIFACTS_DIR", "artifacts")
+MODEL_WATCH_SECONDS = float(os.getenv("MODEL_WATCH_SECONDS", "0"))  # >0 = tự reload khi artifacts đổi
+SERVE_ASYNC      = os.getenv("SERVE_ASYNC", "0")   # "0" | "1" (route async thay sync) | "both" (thêm /async/*)
+CACHE_CONTROL_USER    = os.getenv("RESULT_CACHE_CONTROL_USER", "private, max-age=0, must-revalidate")
+CACHE_CONTROL_SIMILAR = os.getenv("RESULT_CACHE_CONTROL_SIMILAR", "public, max-age=300")
+
+db = MongoClient(MONGO_URL, event_listeners=mongo_listeners(), **pool_options())[DB_NAME]
+
+# Collection/index layout: probe lúc startup + refresh nền, không gọi list_collection_names() mỗi request
+schema = SchemaProbe(db, required_indexes(PLAYBACK_COL, trending_col=TRENDING_COLLECTION))
+
+# === Load artifacts (versioned; hot reload qua ModelRegistry) ===
+def _load_model(art_dir: str) -> ALSModel:
+    return ALSModel.load(art_dir, db[PLAYBACK_COL], SERVE_MODE)
+
+registry = ModelRegistry(ARTIFACTS_DIR, _load_model)
+registry.reload()
+
+
+# === helpers ===
+def _as_oid(s: str):
+    try:
+        return ObjectId(s)
+    except Exception:
+        return None
+
+def _split_item_key(key: str):
+    parts = key.split(":", 1)
+    return (parts[0], parts[1]) if len(parts) == 2 else ("movie", key)
+
+META_PROJ = {
+    "title": 1, "name": 1,
+    "posterUrl": 1, "image": 1, "titleImage": 1,
+    "year": 1, "category": 1, "rate": 1
+}
+
+def _meta_from_doc(d: dict) -> dict:
+    title = d.get("title") or d.get("name") or ""
+    poster = d.get("posterUrl") or d.get("image") or d.get("titleImage") or ""
+    # category is string; keep as-is (FE hiển thị)
+    return {
+        "title": title,
+        "posterUrl": poster,
+        "image": d.get("image"),
+        "titleImage": d.get("titleImage"),
+        "year": d.get("year"),
+        "category": d.get("category") or "",   # string
+        "rate": d.get("rate", 0),
+    }
+
+def _fetch_meta(kind: str, oid_str_list: List[str]) -> Dict[str, dict]:
+    """
+    Fetch movie/series metadata by ids (string form).
+    IMPORTANT: category is a STRING in schema.
+    """
+    oids = [ObjectId(x) for x in oid_str_list if x and _as_oid(x)]
+    if not oids:
+        return {}
+    col = db.movies if kind == "movie" else db.series
+    return {str(d["_id"]): _meta_from_doc(d) for d in col.find({"_id": {"$in": oids}}, META_PROJ)}
+
+item_cache = ItemMetaCache(_fetch_meta, ttl=ITEM_CACHE_TTL, max_size=ITEM_CACHE_SIZE)
+trending = TrendingService(db, PLAYBACK_COL, item_cache.get_many)
+folder = FoldIn(db, PLAYBACK_COL)
+result_cache = make_result_cache()
+
+def _model() -> ALSModel:
+    """Model for this request — giữ nguyên suốt request kể cả khi reload xảy ra."""
+    m = registry.current
+    if m is None:
+        raise HTTPException(status_code=503, detail="Model not ready")
+    return m
+
+@timed("fetch_items")
+def _fetch_items(item_keys: List[str]) -> Dict[str, dict]:
+    """Fetch metadata for mixed list of 'movie:<id>' / 'series:<id>' keys (cached)."""
+    return item_cache.get_many(item_keys)
+
+def _history_keys(playback_docs, udoc: Optional[dict]) -> Set[str]:
+    """Item keys từ playback_state (season/episode → series) + users.likedItems [{refId, kind}]."""
+    keys = set()
+    for w in playback_docs:
+        key = playback_item_key(w)
+        if key:
+            keys.add(key)
+    for it in ((udoc or {}).get("likedItems") or []):
+        if not isinstance(it, dict):
+            continue
+        ref = _as_oid(str(it.get("refId")))
+        kind = it.get("kind")
+        if ref and kind in ("Movie", "Series"):
+            keys.add(f"{'movie' if kind == 'Movie' else 'series'}:{ref}")
+    return keys
+
+def _categories_of(meta: Dict[str, dict]) -> Set[str]:
+    return {c for c in (norm_category(md.get("category")) for md in meta.values()) if c}
+
+def _profile_since(days: int = 60):
+    import datetime
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+@timed("profile_db")
+def _user_profile_categories(user_id: str, days: int = 60) -> Set[str]:
+    """
+    Collect user's preferred categories from:
+    - playback_state (dựa theo season/episode để biết movie/series)
+    - users.likedItems [{refId, kind}]
+    Return lowercase set of categories (strings).
+    Chỉ dùng cho user chưa có trong category_profile.npz (cold start / model cũ).
+    """
+    oid = _as_oid(user_id)
+    if not oid:
+        return set()
+
+    # A) playback_state
+    docs = []
+    if schema.has(PLAYBACK_COL):
+        with span("history"):
+            docs = list(db[PLAYBACK_COL].find(
+                {"userId": oid, "lastActionAt": {"$gte": _profile_since(days)}},
+                {"movieId": 1, "seasonNumber": 1, "episodeNumber": 1}
+            ))
+    # B) likedItems → gộp vào cùng một lần fetch metadata (cache), không find_one từng item
+    udoc = db.users.find_one({"_id": oid}, {"likedItems": 1})
+    return _categories_of(_fetch_items(list(_history_keys(docs, udoc))))
+
+def _history_by_user(user_ids: List[str], playback_docs, user_docs) -> Dict[str, Set[str]]:
+    """Kết quả hai query $in (playback_state, users) → item keys theo từng user (như _history_keys)."""
+    by_oid = {_as_oid(u): u for u in user_ids}
+    docs: Dict[str, list] = {u: [] for u in user_ids}
+    for w in playback_docs:
+        u = by_oid.get(w.get("userId"))
+        if u is not None:
+            docs[u].append(w)
+    udocs = {by_oid[d["_id"]]: d for d in user_docs if d.get("_id") in by_oid}
+    return {u: _history_keys(docs[u], udocs.get(u)) for u in user_ids}
+
+def _categories_by_user(keys: Dict[str, Set[str]], meta: Dict[str, dict]) -> Dict[str, Set[str]]:
+    return {u: _categories_of({k: meta[k] for k in ks if k in meta}) for u, ks in keys.items()}
+
+def _profile_queries(user_ids: List[str], days: int = 60):
+    """(oids, filter playback_state | None, filter users) cho một batch user."""
+    oids = [o for o in (_as_oid(u) for u in user_ids) if o]
+    pb = ({"userId": {"$in": oids}, "lastActionAt": {"$gte": _profile_since(days)}}
+          if oids and schema.has(PLAYBACK_COL) else None)
+    return oids, pb, {"_id": {"$in": oids}}
+
+_PB_PROJ = {"userId": 1, "movieId": 1, "seasonNumber": 1, "episodeNumber": 1}
+
+@timed("profile_db")
+def _users_profile_categories(user_ids: List[str], days: int = 60) -> Dict[str, Set[str]]:
+    """
+    _user_profile_categories cho cả batch: một query $in mỗi collection + một lần fetch metadata
+    cho union item keys, thay vì ~2 round trip mỗi user.
+    """
+    if not user_ids:
+        return {}
+    oids, pb, uq = _profile_queries(user_ids, days)
+    docs, udocs = [], []
+    if oids:
+        with span("history"):
+            docs = list(db[PLAYBACK_COL].find(pb, _PB_PROJ)) if pb is not None else []
+            udocs = list(db.users.find(uq, {"likedItems": 1}))
+    keys = _history_by_user(user_ids, docs, udocs)
+    return _categories_by_user(keys, _fetch_items(list(set().union(*keys.values()))))
+
+@timed("profile")
+def _user_pref(m: ALSModel, uid: str, uidx: Optional[int] = None, fold: Optional[dict] = None):
+    """
+    (category names, allowed mask theo category id | None).
+    User có trong profile → đọc vector precomputed, không query DB.
+    User fold-in → category của các item vừa dùng để fold-in (item_cat), cũng không query DB.
+    """
+    prof = m.profile
+    if prof is not None and fold is not None:
+        cats = np.unique(prof.item_cat[fold["items"]])
+        cats = cats[cats >= 0]
+        return {prof.categories[j] for j in cats}, prof.mask_for(cats)
+    if prof is not None and uidx is not None:
+        return prof.user_names(uidx), prof.user_mask(uidx)
+    pref = _user_profile_categories(uid)
+    return pref, (prof.mask_for_names(pref) if prof is not None else None)
+
+@timed("trending")
+def _trending_filtered(pref: Set[str], topN=12):
+    """
+    Trending fallback, filtered by user's categories (if any).
+    Đọc snapshot của TrendingService (refresh nền) — không aggregation trên request path.
+    """
+    return trending.top(pref, topN)
+
+
+def _needs_fold_in(m: ALSModel, uid: str, uidx: Optional[int]) -> bool:
+    if not FOLDIN_ENABLED:
+        return False
+    if uidx is None:
+        return True
+    return FOLDIN_STALE and m.seen is not None and m.seen.has_overlay(uid)
+
+@timed("fold_in")
+def _fold_in(m: ALSModel, uid: str, uidx: Optional[int]) -> Optional[dict]:
+    """
+    Vector cho user chưa có trong model (hoặc có lượt xem sau export):
+    một lần solve least-squares với V cố định, cache theo TTL.
+    """
+    if not _needs_fold_in(m, uid, uidx):
+        return None
+    oid = _as_oid(uid)
+    if not oid:
+        return None
+    try:
+        return folder.get(m, uid, oid)
+    except Exception as e:
+        print("[WARN] fold-in failed:", e)
+        return None
+
+@timed("candidates")
+def _user_candidates(m: ALSModel, uid: str, uidx: Optional[int], take: int,
+                     fold: Optional[dict] = None) -> np.ndarray:
+    """
+    Item indices for a known user, best first, watched items removed.
+    Precomputed table when available (O(1) row lookup); live V @ u otherwise,
+    or when the stored row runs out after removing watched items.
+    fold: vector fold-in thay cho U[uidx] (user mới / stale) — luôn tính live.
+    """
+    take = min(take, len(m.items))
+    row = m.topk.user_row(uidx) if m.topk is not None and fold is None else None
+    if row is not None:
+        if m.seen is not None:
+            row = row[~np.isin(row, m.seen.seen(uidx, uid))]
+        # row ngắn hơn take chỉ chấp nhận được khi bảng đã phủ toàn bộ catalog
+        if row.size >= take or m.topk.users_idx.shape[1] >= len(m.items):
+            return row[:take]
+
+    # Live: index search, watched items (CSR + overlay) excluded — không query DB
+    seen = m.seen.seen(uidx, uid) if m.seen is not None else None
+    if fold is not None:
+        seen = fold["watched"] if seen is None else np.union1d(seen, fold["watched"])
+        idx, _ = m.sim_index.search(fold["vector"], take, exclude=seen)
+        return idx
+    idx, _ = m.sim_index.search(m.U[uidx], take, exclude=seen)
+    return idx
+
+@timed("candidates")
+def _similar_candidates(m: ALSModel, midx: int, take: int) -> np.ndarray:
+    take = min(take, len(m.items) - 1)
+    row = m.topk.item_row(midx) if m.topk is not None else None
+    if row is not None and row.size >= take:
+        return row[:take]
+
+    idx, _ = m.sim_index.search(m.V[midx], take, exclude=np.array([midx]))
+    return idx
+
+def _topk_rows(S: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise top-k column indices of S, sorted by descending score."""
+    k = min(k, S.shape[1])
+    part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(S, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _user_keys(m: ALSModel, uid: str, uidx: Optional[int], n: int, allowed: Optional[np.ndarray],
+               fold: Optional[dict] = None) -> List[str]:
+    """Lấy nhiều ứng viên rồi lọc theo category (vectorized trên item_cat nếu có profile)."""
+    idx = _user_candidates(m, uid, uidx, max(n * 5, n), fold)
+    metrics.inc("reco_candidates_total", len(idx))
+    if allowed is not None:
+        before = len(idx)
+        idx = m.profile.filter(idx, allowed)
+        metrics.inc("reco_candidates_dropped_total", before - len(idx), stage="category")
+    return item_keys(m.items, idx)
+
+def _pipeline_pool(m: ALSModel, uid: str, uidx: Optional[int], n: int, allowed: Optional[np.ndarray],
+                   fold: Optional[dict] = None,
+                   als: Optional[Callable[[int], np.ndarray]] = None) -> "reco_pipeline.Pool":
+    """
+    Stage 1 + filter của reco_pipeline: ALS + trending + neighbour → pool chưa có metadata.
+    als: ALS retrieval đã tính sẵn (batch) thay cho _user_candidates.
+    """
+    seen = m.seen.seen(uidx, uid) if m.seen is not None else np.empty(0, dtype=np.int64)
+    if fold is not None:
+        seen = np.union1d(seen, fold["watched"])
+    u = fold["vector"] if fold is not None else m.U[uidx]
+    if als is None:
+        als = lambda take: _user_candidates(m, uid, uidx, take, fold)
+    return reco_pipeline.candidates(m, u, np.asarray(seen, dtype=np.int64), allowed, trending.snapshot(), als, n)
+
+def _assemble(keys: List[str], meta: Dict[str, dict], n: int, pref: Optional[Set[str]] = None) -> List[dict]:
+    """Response entries theo thứ tự keys; bỏ item thiếu metadata, lọc category (string) nếu có pref."""
+    result = []
+    no_meta = off_pref = 0
+    for key in keys:
+        kind, oid = _split_item_key(key)
+        md = meta.get(key)
+        if not md:
+            no_meta += 1
+            continue
+        if pref and norm_category(md.get("category")) not in pref:
+            off_pref += 1
+            continue
+        result.append({
+            "kind": kind,
+            "movieId": oid,
+            **md
+        })
+        if len(result) >= n:
+            break
+    if no_meta:
+        metrics.inc("reco_candidates_dropped_total", no_meta, stage="metadata")
+    if off_pref:
+        metrics.inc("reco_candidates_dropped_total", off_pref, stage="category")
+    return result
+
+@timed("candidates")
+def _batch_candidates(m: ALSModel, known: List[str], n: int):
+    """
+    One U_batch @ V.T, seen mask, row-wise top-k → (cand (B, T), keep (B, T)).
+    Có profile → keep đã gồm category mask, chỉ cần fetch metadata cho cand[keep].
+    """
+    uidxs = np.fromiter((m.user_index[u] for u in known), dtype=np.int64, count=len(known))
+    S = m.U[uidxs] @ m.V.T  # (B, num_items) — một lần gọi BLAS
+
+    if m.seen is not None:
+        rows, cols = m.seen.pairs(uidxs, known)
+        S[rows, cols] = -1e9
+
+    cand = _topk_rows(S, max(n * 5, n))  # (B, T)
+    keep = np.take_along_axis(S, cand, axis=1) > -1e9
+    if m.profile is not None:
+        # allowed[b, c + 1] từ vector sở thích; item_cat → lọc trước khi fetch metadata
+        keep &= m.profile.users_mask(uidxs)[np.arange(len(known))[:, None], m.profile.item_cat[cand] + 1]
+    return cand, keep
+
+@timed("candidates")
+def _batch_als(m: ALSModel, known: List[str], take: int) -> Dict[str, np.ndarray]:
+    """
+    ALS retrieval của pipeline cho known users trong batch — cùng kết quả với _user_candidates.
+    Live + ExactIndex → U_batch @ V.T theo khối BATCH_MATMUL_ROWS user (seen mask, top-k theo hàng)
+    thay vì một GEMV mỗi user; bảng topk / IVF đã rẻ theo từng user → _user_candidates.
+    """
+    take = min(take, len(m.items))
+    if m.topk is not None or getattr(m.sim_index, "name", None) != "exact":
+        return {u: _user_candidates(m, u, m.user_index[u], take) for u in known}
+    out: Dict[str, np.ndarray] = {}
+    for s in range(0, len(known), max(BATCH_MATMUL_ROWS, 1)):
+        chunk = known[s:s + max(BATCH_MATMUL_ROWS, 1)]
+        uidxs = np.fromiter((m.user_index[u] for u in chunk), dtype=np.int64, count=len(chunk))
+        S = np.asarray(m.U[uidxs] @ m.V.T)
+        if m.seen is not None:
+            rows, cols = m.seen.pairs(uidxs, chunk)
+            S[rows, cols] = -np.inf
+        cand = _topk_rows(S, take)
+        ok = np.isfinite(np.take_along_axis(S, cand, axis=1))
+        out.update((u, cand[b][ok[b]]) for b, u in enumerate(chunk))
+    return out
+
+def _batch_pools(m: ALSModel, uids: List[str], folds: Dict[str, dict], n: int):
+    """
+    uid → (Pool, pref names | None) cho known + fold-in users, cùng reco_pipeline.candidates với
+    /recommend/user; không query DB (pref None = không có profile → lấy từ prefs đọc DB của batch).
+    """
+    known = [u for u in uids if u in m.user_index and u not in folds]
+    als = _batch_als(m, known, max(reco_pipeline.RETRIEVE_ALS, n)) if reco_pipeline.RETRIEVE_ALS > 0 else {}
+    pools = {}
+    for u in known + list(folds):
+        uidx, fold = m.user_index.get(u), folds.get(u)
+        pref, allowed = _user_pref(m, u, uidx, fold) if m.profile is not None else (None, None)
+        rows = als.get(u)
+        pools[u] = (_pipeline_pool(m, u, uidx, n, allowed, fold,
+                                   (lambda take, r=rows: r[:take]) if rows is not None else None), pref)
+    return pools
+
+def _pool_keys(pools) -> List[str]:
+    """Union item keys của mọi pool → một lần fetch metadata cho cả batch."""
+    return list(dict.fromkeys(k for pool, _ in pools.values() for k in pool.keys))
+
+@timed("assemble")
+def _pool_results(pools, folds: Dict[str, dict], prefs: Dict[str, Set[str]],
+                  meta: Dict[str, dict], n: int) -> Dict[str, dict]:
+    """rerank + _assemble từng user như /recommend/user; ghi pref dùng cho fallback trending vào prefs."""
+    out: Dict[str, dict] = {}
+    for u, (pool, pref) in pools.items():
+        if pref is None:
+            pref = prefs[u]
+        prefs[u] = pref
+        out[u] = {"userId": u, "items": _assemble(reco_pipeline.rerank(pool, meta, n, pref), meta, n)}
+        if u in folds:
+            out[u]["folded_in"] = True
+    if folds:
+        metrics.inc("reco_fold_in_total", len(folds), route="batch")
+    return out
+
+@timed("assemble")
+def _batch_results(m: ALSModel, known: List[str], prefs: Dict[str, Set[str]],
+                   cand: np.ndarray, keep: np.ndarray, meta: Dict[str, dict], n: int) -> Dict[str, dict]:
+    union = np.unique(cand)
+    union_keys = item_keys(m.items, union)  # decode một lần cho cả batch
+    pos = np.searchsorted(union, cand)
+    has_meta = np.array([k in meta for k in union_keys], dtype=bool)
+    keep = keep & has_meta[pos]
+
+    if m.profile is None:
+        # category code cho từng item trong union (-1 = không có metadata)
+        cats = sorted({norm_category(md.get("category")) for md in meta.values()})
+        cat_code = {c: j for j, c in enumerate(cats)}
+        union_code = np.array(
+            [cat_code[norm_category(meta[k].get("category"))] if k in meta else -1
+             for k in union_keys], dtype=np.int64)
+        cand_code = union_code[pos]
+
+        # allowed[b, c]: user b chấp nhận category c (pref rỗng → tất cả)
+        allowed = np.ones((len(known), len(cats) + 1), dtype=bool)
+        allowed[:, -1] = False  # cột cuối ứng với code -1 (thiếu metadata)
+        for b, u in enumerate(known):
+            if prefs[u]:
+                allowed[b, :-1] = [c in prefs[u] for c in cats]
+        keep &= allowed[np.arange(len(known))[:, None], cand_code]
+
+    out: Dict[str, dict] = {}
+    for b, u in enumerate(known):
+        res = []
+        for j in pos[b][keep[b]][:n]:
+            key = union_keys[j]
+            kind, oid = _split_item_key(key)
+            res.append({"kind": kind, "movieId": oid, **meta[key]})
+        out[u] = {"userId": u, "items": res}
+    return out
+
+def _batch_folds(m: ALSModel, uids: List[str]) -> Dict[str, dict]:
+    """User mới / stale trong batch → fold-in vector (không nằm trong U nên không đi qua U_batch @ V.T)."""
+    need = {u: o for u, o in ((u, _as_oid(u)) for u in uids if _needs_fold_in(m, u, m.user_index.get(u))) if o}
+    if not need:
+        return {}
+    try:
+        res = folder.get_many(m, need)  # một query $in mỗi collection cho cả batch
+    except Exception as e:
+        print("[WARN] fold-in failed:", e)
+        return {}
+    return {u: res[u] for u in need if res[u] is not None}
+
+def _fold_keys(m: ALSModel, folds: Dict[str, dict], prefs: Dict[str, Set[str]], n: int):
+    """uid → (candidate keys, string pref | None) cho user fold-in; ghi pref vào prefs."""
+    res = {}
+    for u, f in folds.items():
+        uidx = m.user_index.get(u)
+        if m.profile is None and u in prefs:
+            pref, allowed = prefs[u], None  # đã đọc từ DB cùng cả batch (_users_profile_categories)
+        else:
+            pref, allowed = _user_pref(m, u, uidx, f)
+        prefs[u] = pref
+        res[u] = (_user_keys(m, u, uidx, n, allowed, f), pref if allowed is None else None)
+    return res
+
+def _batch_meta_keys(m: ALSModel, cand, keep, fold_keys) -> List[str]:
+    """Union item keys của cả batch (known + fold-in) → một lần fetch metadata."""
+    keys = item_keys(m.items, np.unique(cand[keep])) if cand is not None else []
+    seen = set(keys)
+    for ks, _ in fold_keys.values():
+        keys.extend(k for k in ks if k not in seen)
+        seen.update(ks)
+    return keys
+
+def _fold_results(fold_keys, meta: Dict[str, dict], n: int) -> Dict[str, dict]:
+    if fold_keys:
+        metrics.inc("reco_fold_in_total", len(fold_keys), route="batch")
+    return {u: {"userId": u, "items": _assemble(keys, meta, n, pref), "folded_in": True}
+            for u, (keys, pref) in fold_keys.items()}
+
+@timed("result_cache")
+def _result_get(key: str, n: int) -> Optional[bytes]:
+    if not RESULT_CACHE_ENABLED:
+        return None
+    body = result_cache.get(key, n)
+    metrics.inc("reco_result_cache_total", kind=key.split(":", 1)[0], result="miss" if body is None else "hit")
+    return body
+
+def _result_put(key: str, n: int, out: dict, ttl: float) -> bytes:
+    body = encode(out)
+    if RESULT_CACHE_ENABLED:
+        result_cache.put(key, n, body, ttl)
+    return body
+
+def _json_response(request: Request, body: bytes, cache_control: str) -> Response:
+    """JSON đã encode + ETag; If-None-Match khớp → 304 không body."""
+    tag = etag(body)
+    headers = {"ETag": tag, "Cache-Control": cache_control}
+    if etag_matches(tag, request.headers.get("if-none-match")):
+        metrics.inc("reco_not_modified_total")
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _fill_trending(m: ALSModel, uids: List[str], prefs: Dict[str, Set[str]], out: Dict[str, dict], n: int):
+    """Cold start + user thiếu kết quả → trending (snapshot trong RAM), một lần lọc cho mỗi tập pref."""
+    by_pref: Dict[frozenset, list] = {}
+    for u in uids:
+        if out.get(u, {}).get("items"):
+            continue
+        pref = frozenset(prefs[u])
+        if pref not in by_pref:
+            by_pref[pref] = _trending_filtered(prefs[u], topN=n)
+        entry = {**out.get(u, {}), "userId": u, "items": by_pref[pref]}  # giữ folded_in như /recommend/user
+        if u not in m.user_index and u not in out:
+            entry["cold_start"] = True
+            metrics.inc("reco_cold_start_total", route="batch")
+        else:
+            metrics.inc("reco_fallback_total", route="batch")
+        out[u] = entry
+    return {"results": [out[u] for u in uids]}
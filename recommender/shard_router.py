@@ -0,0 +1,350 @@
+# shard_router.py — Router trước các instance serve_api chạy sharded (artifacts/shards/, xem sharding.py)
+#   /recommend/user/{uid}, /events/playback   → shard của uid (consistent hashing, cùng ShardRing với sharding.py)
+#   /recommend/users, /events/playback/batch  → tách theo shard, gọi song song, ghép lại đúng thứ tự
+#   /recommend/similar/{kind}/{oid}           → shard nào cũng trả được (V đầy đủ); chọn theo hash item key
+#   /healthz gộp healthz của mọi shard; /admin/* gửi tới tất cả shard.
+# Usage:
+#   python sharding.py --shards 3
+#   python shard_router.py --spawn --port 8000       # chạy 3 serve_api (port 8101..8103) + router, Ctrl+C dừng tất cả
+#   SHARD_URLS=shard-0=http://10.0.0.1:8002,shard-1=http://10.0.0.2:8002 \
+#     python -m uvicorn shard_router:app --port 8000  # shard chạy trên host khác (ARTIFACTS_DIR=.../shard-<j>)
+import os, sys, json, time, signal, argparse, threading, subprocess, urllib.parse, urllib.request, urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Query, HTTPException, Body, Request
+from fastapi.responses import PlainTextResponse, Response, JSONResponse
+from dotenv import load_dotenv
+
+from metrics import metrics
+from sharding import ShardRing, load_manifest, SHARDS_DIR, MANIFEST_NAME
+
+load_dotenv()
+
+SHARD_MANIFEST  = os.getenv("SHARD_MANIFEST", os.path.join("artifacts", SHARDS_DIR, MANIFEST_NAME))
+SHARD_URLS      = os.getenv("SHARD_URLS", "")     # "shard-0=http://..,shard-1=http://.." hoặc list theo thứ tự manifest
+ROUTER_TIMEOUT  = float(os.getenv("ROUTER_TIMEOUT", "5"))
+ROUTER_ADMIN_TIMEOUT = float(os.getenv("ROUTER_ADMIN_TIMEOUT", "120"))  # reload ?wait=true, trending refresh
+ROUTER_THREADS  = int(os.getenv("ROUTER_THREADS", "16"))
+ROUTER_MANIFEST_SECONDS = float(os.getenv("ROUTER_MANIFEST_SECONDS", "10"))  # kiểm tra manifest đổi (mtime)
+BATCH_MAX_USERS = int(os.getenv("BATCH_MAX_USERS", "1000"))
+
+PASS_HEADERS = ("etag", "cache-control", "server-timing")
+
+app = FastAPI(title="Movie/Series Recommendation — shard router")
+
+
+class ShardUnavailable(Exception):
+    pass
+
+
+def parse_urls(spec: str, shard_ids: List[str]) -> Dict[str, str]:
+    """'shard-0=http://a,shard-1=http://b' hoặc 'http://a,http://b' (theo thứ tự shard trong manifest)."""
+    parts = [s.strip() for s in spec.split(",") if s.strip()]
+    if all("=" in s for s in parts):
+        urls = dict(s.split("=", 1) for s in parts)
+    else:
+        urls = dict(zip(shard_ids, parts))
+    missing = [s for s in shard_ids if s not in urls]
+    if missing:
+        raise RuntimeError(f"no URL for shards {missing}")
+    return {s: urls[s].rstrip("/") for s in shard_ids}
+
+
+class ShardMap:
+    """Manifest + URL của từng shard; đọc lại manifest khi file đổi (re-split với số shard khác)."""
+
+    def __init__(self, manifest_path: str, urls_spec: str):
+        self.manifest_path = manifest_path
+        self.urls_spec = urls_spec
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._load()
+
+    def _load(self):
+        manifest = load_manifest(self.manifest_path)
+        ring = ShardRing.from_manifest(manifest)
+        urls = parse_urls(self.urls_spec, ring.shards)
+        self.manifest, self.ring, self.urls = manifest, ring, urls
+        self._mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < ROUTER_MANIFEST_SECONDS:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                if os.stat(self.manifest_path).st_mtime_ns != self._mtime:
+                    self._load()
+                    print(f"[INFO] shard manifest reloaded: {self.ring.shards}")
+            except Exception as e:
+                print("[WARN] shard manifest reload failed, keeping current:", e)
+
+    def route(self, key: str) -> Tuple[str, str]:
+        sid = self.ring.shard_of(key)
+        return sid, self.urls[sid]
+
+    def group(self, keys: List[str]) -> Dict[str, List[int]]:
+        """Shard → vị trí của các key thuộc shard đó (giữ thứ tự)."""
+        out: Dict[str, List[int]] = {}
+        for pos, j in enumerate(self.ring.indices_of(keys).tolist()):
+            out.setdefault(self.ring.shards[j], []).append(pos)
+        return out
+
+    def stats(self) -> dict:
+        return {"manifest": self.manifest_path, "created_at": self.manifest.get("created_at"),
+                "users": self.manifest.get("users"), "shards": self.urls}
+
+
+shards: Optional[ShardMap] = None   # --spawn gán trước khi chạy uvicorn
+_shards_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=ROUTER_THREADS)
+
+
+def _shards() -> ShardMap:
+    global shards
+    if shards is None:
+        with _shards_lock:
+            if shards is None:
+                try:
+                    shards = ShardMap(SHARD_MANIFEST, SHARD_URLS)
+                except Exception as e:
+                    raise HTTPException(status_code=503, detail=f"shard map unavailable: {e}")
+    shards.maybe_reload()
+    return shards
+
+
+def _forward(method: str, url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+             timeout: float = ROUTER_TIMEOUT) -> Tuple[int, bytes, Dict[str, str]]:
+    """Một request tới shard → (status, body, headers lowercase); lỗi HTTP của shard được trả nguyên (400, 304, 422...)."""
+    req = urllib.request.Request(url, data=body, method=method, headers=dict(headers or {}))
+    if body is not None:
+        req.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return r.status, r.read(), {k.lower(): v for k, v in r.headers.items()}
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), {k.lower(): v for k, v in (e.headers or {}).items()}
+    except (urllib.error.URLError, OSError) as e:
+        raise ShardUnavailable(f"{url}: {getattr(e, 'reason', e)}")
+
+
+def _call(sid: str, method: str, url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+          timeout: float = ROUTER_TIMEOUT) -> Tuple[int, bytes, Dict[str, str]]:
+    metrics.inc("reco_router_requests_total", shard=sid)
+    try:
+        return _forward(method, url, body, headers, timeout)
+    except ShardUnavailable as e:
+        metrics.inc("reco_router_errors_total", shard=sid)
+        raise HTTPException(status_code=502, detail=f"shard {sid} unavailable: {e}")
+
+
+def _call_json(sid: str, method: str, url: str, payload) -> dict:
+    status, body, _ = _call(sid, method, url, json.dumps(payload).encode())
+    if status != 200:
+        raise HTTPException(status_code=status, detail=_detail(body))
+    return json.loads(body)
+
+
+def _detail(body: bytes):
+    try:
+        return json.loads(body).get("detail", body.decode("utf-8", "replace"))
+    except Exception:
+        return body.decode("utf-8", "replace")
+
+
+def _proxy(request: Request, sid: str, url: str, body: Optional[bytes] = None) -> Response:
+    """Forward nguyên request (query string, If-None-Match) và trả nguyên response + X-Shard."""
+    qs = request.scope.get("query_string", b"").decode("latin-1")  # raw; request.url dựng lại từ path đã decode
+    if qs:
+        url = f"{url}?{qs}"
+    fwd = {"If-None-Match": request.headers["if-none-match"]} if "if-none-match" in request.headers else {}
+    status, content, headers = _call(sid, request.method, url, body, fwd)
+    out = {k: headers[k] for k in PASS_HEADERS if k in headers}
+    out["X-Shard"] = sid
+    return Response(content=content if status != 304 else None, status_code=status,
+                    media_type=headers.get("content-type"), headers=out)
+
+
+def _seg(s: str) -> str:
+    """Path param → đúng một segment URL upstream ('/', '?', '#', '%' không đổi route / query của shard)."""
+    return urllib.parse.quote(s, safe="")
+
+
+def _fan_out(calls: Dict[str, Tuple[str, object]], method: str = "POST") -> Dict[str, dict]:
+    """{shard: (url, payload)} → {shard: json} song song."""
+    futs = {sid: _pool.submit(_call_json, sid, method, url, payload) for sid, (url, payload) in calls.items()}
+    return {sid: f.result() for sid, f in futs.items()}
+
+
+# === routes ===
+@app.get("/recommend/user/{uid}")
+def recommend(request: Request, uid: str, n: int = Query(8, ge=1, le=50)):
+    sid, base = _shards().route(uid)
+    return _proxy(request, sid, f"{base}/recommend/user/{_seg(uid)}")
+
+@app.get("/recommend/similar/{kind}/{oid}")
+def similar(request: Request, kind: str, oid: str, n: int = Query(12, ge=1, le=50)):
+    # mọi shard có V đầy đủ; hash theo item → cache kết quả similar không bị nhân N lần
+    sid, base = _shards().route(f"{kind}:{oid}")
+    return _proxy(request, sid, f"{base}/recommend/similar/{_seg(kind)}/{_seg(oid)}")
+
+@app.post("/recommend/users")
+def recommend_batch(
+    userIds: List[str] = Body(..., embed=True),
+    n: int = Body(8, ge=1, le=50, embed=True),
+):
+    """Tách userIds theo shard → POST /recommend/users song song → ghép theo thứ tự input (unique)."""
+    if len(userIds) > BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"at most {BATCH_MAX_USERS} userIds per call")
+    sm = _shards()
+    uids = list(dict.fromkeys(userIds))
+    groups = sm.group(uids)
+    replies = _fan_out({sid: (f"{sm.urls[sid]}/recommend/users", {"userIds": [uids[p] for p in pos], "n": n})
+                        for sid, pos in groups.items()})
+    by_uid = {r["userId"]: r for rep in replies.values() for r in rep["results"]}
+    return {"results": [by_uid[u] for u in uids]}
+
+@app.post("/events/playback")
+def playback_event(
+    request: Request,
+    userId: str = Body(...),
+    movieId: str = Body(...),
+    seasonNumber: Optional[int] = Body(None),
+    episodeNumber: Optional[int] = Body(None),
+):
+    sid, base = _shards().route(userId)
+    body = json.dumps({"userId": userId, "movieId": movieId,
+                       "seasonNumber": seasonNumber, "episodeNumber": episodeNumber}).encode()
+    return _proxy(request, sid, f"{base}/events/playback", body)
+
+@app.post("/events/playback/batch")
+def playback_events(events: List[dict] = Body(..., embed=True)):
+    """ingest_worker.py --notify <router>: mỗi shard nhận lượt xem của user thuộc nó."""
+    sm = _shards()
+    events = [ev for ev in events if ev.get("userId") and ev.get("movieId")]
+    groups = sm.group([str(ev["userId"]) for ev in events]) if events else {}
+    replies = _fan_out({sid: (f"{sm.urls[sid]}/events/playback/batch", {"events": [events[p] for p in pos]})
+                        for sid, pos in groups.items()})
+    return {"ok": True, "events": len(events), "known": sum(r.get("known", 0) for r in replies.values()),
+            "shards": {sid: r.get("events", 0) for sid, r in replies.items()}}
+
+@app.get("/healthz")
+def healthz():
+    """healthz của từng shard (song song); ok = mọi shard ok và model_ready."""
+    sm = _shards()
+
+    def one(sid: str) -> dict:
+        try:
+            status, body, _ = _forward("GET", f"{sm.urls[sid]}/healthz")
+            h = json.loads(body) if status == 200 else {}
+            return {"url": sm.urls[sid], "ok": bool(h.get("ok")) and bool(h.get("model_ready")),
+                    "users": h.get("users"), "items": h.get("items"),
+                    "version": (h.get("model") or {}).get("current", {}).get("version"),
+                    "shard": (h.get("model") or {}).get("current", {}).get("shard")}
+        except (ShardUnavailable, ValueError) as e:
+            return {"url": sm.urls[sid], "ok": False, "error": str(e)}
+
+    futs = {sid: _pool.submit(one, sid) for sid in sm.ring.shards}
+    per = {sid: f.result() for sid, f in futs.items()}
+    # shard trả về phải khớp tên trong manifest (tránh trỏ nhầm ARTIFACTS_DIR)
+    for sid, h in per.items():
+        if h.get("shard") not in (None, sid):
+            h.update(ok=False, error=f"instance serves {h['shard']}")
+    return JSONResponse({"ok": all(h["ok"] for h in per.values()), "router": sm.stats(), "shards": per},
+                        status_code=200 if all(h["ok"] for h in per.values()) else 503)
+
+@app.post("/admin/{path:path}")
+def admin_broadcast(request: Request, path: str):
+    """/admin/model/reload, /admin/items/refresh... → mọi shard (không body; query string giữ nguyên); lỗi ghi theo shard."""
+    sm = _shards()
+    q = f"?{request.url.query}" if request.url.query else ""
+    futs = {sid: _pool.submit(_call, sid, "POST", f"{sm.urls[sid]}/admin/{path}{q}", b"{}", None, ROUTER_ADMIN_TIMEOUT)
+            for sid in sm.ring.shards}
+    out = {}
+    for sid, f in futs.items():
+        try:
+            status, body, _ = f.result()
+        except HTTPException as e:
+            status, body = e.status_code, json.dumps({"detail": e.detail}).encode()
+        out[sid] = json.loads(body) if status == 200 else {"status": status, "detail": _detail(body)}
+    return out
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# === --spawn: N serve_api process (một shard mỗi process) + router, để chạy thử trên một máy ===
+def _wait_ready(urls: Dict[str, str], procs: List[subprocess.Popen], timeout: float):
+    deadline = time.monotonic() + timeout
+    pending = dict(urls)
+    while pending:
+        for p in procs:
+            if p.poll() is not None:
+                raise RuntimeError(f"shard process exited with code {p.returncode}")
+        for sid, url in list(pending.items()):
+            try:
+                with urllib.request.urlopen(f"{url}/healthz", timeout=2) as r:
+                    if json.loads(r.read()).get("model_ready"):
+                        print(f"[INFO] {sid} ready at {url}")
+                        pending.pop(sid)
+            except Exception:
+                pass
+        if pending and time.monotonic() > deadline:
+            raise RuntimeError(f"shards not ready after {timeout}s: {sorted(pending)}")
+        time.sleep(0.5)
+
+
+def spawn_shards(manifest_path: str, app_path: str, host: str, base_port: int) -> Tuple[Dict[str, str], List[subprocess.Popen]]:
+    manifest = load_manifest(manifest_path)
+    root = os.path.dirname(os.path.abspath(manifest_path))
+    urls, procs = {}, []
+    for j, s in enumerate(manifest["shards"]):
+        port = base_port + j + 1
+        env = dict(os.environ, ARTIFACTS_DIR=os.path.join(root, s["dir"]))
+        cmd = [sys.executable, "-m", "uvicorn", app_path, "--host", host, "--port", str(port)]
+        procs.append(subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__))))
+        urls[s["id"]] = f"http://{host}:{port}"
+        print(f"[INFO] {s['id']} ({s['users']} users) → {urls[s['id']]} pid={procs[-1].pid}")
+    return urls, procs
+
+
+def main(argv=None):
+    global shards
+    ap = argparse.ArgumentParser(description="Route recommendation requests to user shards")
+    ap.add_argument("--manifest", default=SHARD_MANIFEST)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--spawn", action="store_true", help="tự chạy một serve_api process cho mỗi shard")
+    ap.add_argument("--base-port", type=int, default=8100, help="--spawn: shard j nghe ở base-port + j + 1")
+    ap.add_argument("--app", default=os.getenv("SHARD_APP", "serve_api:app"), help="--spawn: uvicorn app của shard")
+    ap.add_argument("--startup-timeout", type=float, default=120.0)
+    args = ap.parse_args(argv)
+
+    import uvicorn
+    procs: List[subprocess.Popen] = []
+    try:
+        if args.spawn:
+            urls, procs = spawn_shards(args.manifest, args.app, args.host, args.base_port)
+            _wait_ready(urls, procs, args.startup_timeout)
+            spec = ",".join(f"{k}={v}" for k, v in urls.items())
+        else:
+            spec = SHARD_URLS
+        shards = ShardMap(args.manifest, spec)
+        print(f"[SUCCESS] router → {shards.urls}")
+        uvicorn.run(app, host=args.host, port=args.port)
+    finally:
+        for p in procs:
+            p.send_signal(signal.SIGTERM)
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+if __name__ == "__main__":
+    main()
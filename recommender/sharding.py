@@ -0,0 +1,192 @@
+# sharding.py — Chia artifacts của train_als.py theo user thành N shard (consistent hashing)
+#   Mỗi shard: U của user thuộc shard + phần per-user (seen, category profile, top-K users) + bản đầy đủ của V
+#   → một instance serve_api chỉ load shard của nó (ARTIFACTS_DIR=artifacts/shards/shard-<j>).
+#   Shard sở hữu các khoảng hash trên ring (SHARD_VNODES điểm / shard): thêm shard chỉ chuyển ~1/N user.
+#   shard_router.py đọc manifest.json và dùng cùng ShardRing để chọn shard cho /recommend/user/{uid}.
+#
+# Usage:
+#   python sharding.py --shards 4          # artifacts/ → artifacts/shards/{manifest.json, shard-0..3/}
+#   python train_als.py --shards 4         # train rồi chia luôn
+import os, json, time, shutil, hashlib, argparse, datetime
+from typing import List, Optional
+
+import numpy as np
+
+from id_codec import CodeList
+from id_index import IdList
+from model_registry import save_ids
+from category_profile import PROFILE_PATH
+
+SHARDS_DIR    = os.getenv("SHARDS_DIR", "shards")        # trong ARTIFACTS_DIR
+SHARD_VNODES  = int(os.getenv("SHARD_VNODES", "64"))     # điểm ảo mỗi shard trên ring
+MANIFEST_NAME = "manifest.json"
+
+# Dùng chung cho mọi shard (item side) — copy, không hardlink: np.save của lần train sau ghi đè
+# đúng inode đó trong khi shard đang mmap bản cũ
+SHARED_FILES = (
+    "item_factors.npy", "item_codes.npy", "item_codes_sorted.npy", "item_codes_order.npy",
+    "item_ids.npy", "item_ids_sorted.npy", "item_ids_order.npy", "item_id_map.json",
+    "topk_items_idx.npy", "topk_items_scores.npy", "ann_ivf.npz", "ann_ivf_vectors.npy", "train_meta.json",
+)
+
+
+def _hash64(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ShardRing:
+    """
+    Consistent-hash ring: mỗi shard có `vnodes` điểm hash("<shard>#<v>");
+    key thuộc shard của điểm đầu tiên > hash(key) (vòng lại điểm 0).
+    """
+
+    def __init__(self, shards: List[str], vnodes: int = SHARD_VNODES):
+        if not shards:
+            raise ValueError("ring needs at least one shard")
+        self.shards = list(shards)
+        self.vnodes = vnodes
+        pts = [(_hash64(f"{s}#{v}"), j) for j, s in enumerate(self.shards) for v in range(vnodes)]
+        pts.sort()
+        self.points = np.array([h for h, _ in pts], dtype=np.uint64)
+        self.owner = np.array([j for _, j in pts], dtype=np.int32)
+
+    @classmethod
+    def from_manifest(cls, manifest: dict) -> "ShardRing":
+        return cls([s["id"] for s in manifest["shards"]], int(manifest["ring"]["vnodes"]))
+
+    def indices_of(self, keys) -> np.ndarray:
+        """Vectorized: key → vị trí shard trong self.shards."""
+        h = np.fromiter((_hash64(k) for k in keys), dtype=np.uint64)
+        pos = np.searchsorted(self.points, h, side="right") % self.points.shape[0]
+        return self.owner[pos]
+
+    def index_of(self, key: str) -> int:
+        return int(self.indices_of([key])[0])
+
+    def shard_of(self, key: str) -> str:
+        return self.shards[self.index_of(key)]
+
+
+def load_manifest(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _user_ids(art_dir: str):
+    p = lambda name: os.path.join(art_dir, name)
+    if os.path.exists(p("user_codes.npy")):
+        return CodeList(np.load(p("user_codes.npy"), mmap_mode="r"), item=False)
+    if os.path.exists(p("user_ids.npy")):
+        return IdList(np.load(p("user_ids.npy"), mmap_mode="r"))
+    with open(p("user_id_map.json"), "r", encoding="utf-8") as f:
+        return json.load(f)["users"]
+
+
+def _slice_csr(indptr: np.ndarray, rows: np.ndarray, *cols: np.ndarray):
+    """Các hàng `rows` của CSR (indptr, cols...) → (indptr mới, cols đã cắt)."""
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lens = (ends - starts).astype(np.int64)
+    out_ptr = np.zeros(rows.shape[0] + 1, dtype=np.int64)
+    np.cumsum(lens, out=out_ptr[1:])
+    pos = np.repeat(starts - out_ptr[:-1], lens) + np.arange(out_ptr[-1], dtype=np.int64)
+    return (out_ptr,) + tuple(c[pos] for c in cols)
+
+
+def _write_shard(art_dir: str, out: str, sid: str, rows: np.ndarray, keys: List[str], ring: ShardRing):
+    p = lambda name: os.path.join(art_dir, name)
+    os.makedirs(out)
+    U = np.load(p("user_factors.npy"), mmap_mode="r")
+    np.save(os.path.join(out, "user_factors.npy"), np.ascontiguousarray(U[rows], dtype=np.float32))
+    save_ids(out, "user", keys, item=False)
+    with open(os.path.join(out, "user_id_map.json"), "w", encoding="utf-8") as f:
+        json.dump({"users": keys}, f)
+
+    if os.path.exists(p("seen_items.npz")):
+        d = np.load(p("seen_items.npz"))
+        indptr, indices = _slice_csr(d["indptr"], rows, d["indices"])
+        extra = {"since": d["since"]} if "since" in d.files else {}
+        np.savez(os.path.join(out, "seen_items.npz"), indptr=indptr, indices=indices, **extra)
+
+    if os.path.exists(p(PROFILE_PATH)):
+        d = np.load(p(PROFILE_PATH))
+        indptr, cat_idx, weight = _slice_csr(d["indptr"], rows, d["cat_idx"], d["weight"])
+        np.savez(os.path.join(out, PROFILE_PATH), categories=d["categories"], item_cat=d["item_cat"],
+                 indptr=indptr, cat_idx=cat_idx, weight=weight)
+
+    for name in ("topk_users_idx.npy", "topk_users_scores.npy"):
+        if os.path.exists(p(name)):
+            np.save(os.path.join(out, name), np.load(p(name), mmap_mode="r")[rows])
+
+    for name in SHARED_FILES:
+        if os.path.exists(p(name)):
+            shutil.copyfile(p(name), os.path.join(out, name))
+
+    with open(os.path.join(out, "shard.json"), "w", encoding="utf-8") as f:
+        # ring đi kèm shard: instance tự lọc user của mình (seen poll, /events/playback/batch)
+        json.dump({"id": sid, "users": int(rows.shape[0]),
+                   "ring": {"shards": ring.shards, "vnodes": ring.vnodes}}, f)
+
+
+def split_artifacts(art_dir: str = "artifacts", n_shards: int = 2, vnodes: int = SHARD_VNODES,
+                    shards_dir: str = SHARDS_DIR) -> dict:
+    """
+    artifacts/ (mmap format của train_als.py) → artifacts/<shards_dir>/shard-<j>/ + manifest.json.
+    Ghi vào <shards_dir>.tmp rồi rename (shard đang chạy thấy bản mới qua MODEL_WATCH / /admin/model/reload).
+    """
+    if not os.path.exists(os.path.join(art_dir, "user_factors.npy")):
+        raise RuntimeError("user_factors.npy missing — run train_als.py first (mmap artifacts)")
+    t0 = time.perf_counter()
+    users = _user_ids(art_dir)
+    num_users = len(users)
+    ids = [f"shard-{j}" for j in range(n_shards)]
+    ring = ShardRing(ids, vnodes)
+    keys = list(users)
+    owner = ring.indices_of(keys) if num_users else np.empty(0, dtype=np.int32)
+
+    final = os.path.join(art_dir, shards_dir)
+    tmp, old = final + ".tmp", final + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    entries = []
+    for j, sid in enumerate(ids):
+        rows = np.flatnonzero(owner == j)
+        _write_shard(art_dir, os.path.join(tmp, sid), sid, rows, [keys[r] for r in rows], ring)
+        entries.append({"id": sid, "dir": sid, "users": int(rows.shape[0])})
+
+    V = np.load(os.path.join(art_dir, "item_factors.npy"), mmap_mode="r")
+    manifest = {
+        "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "ring": {"hash": "blake2b-64", "vnodes": vnodes},
+        "users": num_users, "items": int(V.shape[0]),
+        "shards": entries,
+    }
+    with open(os.path.join(tmp, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(final):
+        os.rename(final, old)
+    os.rename(tmp, final)
+    shutil.rmtree(old, ignore_errors=True)
+    manifest["split_sec"] = round(time.perf_counter() - t0, 3)
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Split ALS serving artifacts into user shards")
+    ap.add_argument("--shards", type=int, default=int(os.getenv("ALS_SHARDS", "2")))
+    ap.add_argument("--vnodes", type=int, default=SHARD_VNODES)
+    ap.add_argument("--artifacts", default=os.getenv("ARTIFACTS_DIR", "artifacts"))
+    args = ap.parse_args(argv)
+    if args.shards < 1:
+        ap.error("--shards must be >= 1")
+    manifest = split_artifacts(args.artifacts, args.shards, args.vnodes)
+    sizes = {s["id"]: s["users"] for s in manifest["shards"]}
+    print(f"[SUCCESS] {manifest['users']} users → {len(sizes)} shards {sizes} ({manifest['split_sec']}s)")
+    print(f"[NEXT] python shard_router.py --spawn "
+          f"(manifest: {os.path.join(args.artifacts, SHARDS_DIR, MANIFEST_NAME)})")
+    return manifest
+
+
+if __name__ == "__main__":
+    main()
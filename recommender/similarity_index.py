@@ -0,0 +1,159 @@
+# similarity_index.py — Inner-product search over item factors
+#   ExactIndex: brute-force V @ q (mặc định)
+#   IVFIndex  : k-means partitioning (pure NumPy), chỉ quét `nprobe` cụm gần nhất
+import os, time
+from typing import Optional, Tuple
+
+import numpy as np
+
+SIM_INDEX  = os.getenv("SIM_INDEX", "exact")     # "exact" | "ivf"
+IVF_NLIST  = int(os.getenv("IVF_NLIST", "0"))     # 0 = tự chọn ~4*sqrt(N)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_PATH   = "ann_ivf.npz"
+IVF_VECTORS_PATH = "ann_ivf_vectors.npy"   # V theo thứ tự cụm, mmap chung giữa các worker
+
+
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class ExactIndex:
+    name = "exact"
+
+    def __init__(self, V: np.ndarray):
+        self.V = V
+
+    def search(self, q: np.ndarray, k: int, exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k item indices by q·v (best first), skipping `exclude`."""
+        scores = self.V @ q
+        if exclude is not None and len(exclude):
+            scores[exclude] = -np.inf
+        idx = _topk(scores, k)
+        idx = idx[np.isfinite(scores[idx])]
+        return idx, scores[idx]
+
+    def stats(self) -> dict:
+        return {"type": self.name, "items": int(self.V.shape[0])}
+
+
+def kmeans(X: np.ndarray, nlist: int, iters: int = 10, seed: int = 42, chunk: int = 65536) -> np.ndarray:
+    """Plain Lloyd k-means; assignment is chunked so memory stays O(chunk * nlist)."""
+    rng = np.random.default_rng(seed)
+    C = X[rng.choice(X.shape[0], size=nlist, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = _assign(X, C, chunk)
+        sums = np.zeros_like(C)
+        np.add.at(sums, assign, X)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        C[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():  # cụm rỗng → lấy lại điểm ngẫu nhiên
+            C[empty] = X[rng.choice(X.shape[0], size=int(empty.sum()), replace=False)]
+    return C
+
+
+def _assign(X: np.ndarray, C: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    cn = (C * C).sum(axis=1)
+    out = np.empty(X.shape[0], dtype=np.int32)
+    for s in range(0, X.shape[0], chunk):
+        # argmin ||x - c||^2 = argmin (||c||^2 - 2 x·c)
+        out[s:s + chunk] = np.argmin(cn[None, :] - 2.0 * (X[s:s + chunk] @ C.T), axis=1)
+    return out
+
+
+class IVFIndex:
+    name = "ivf"
+
+    def __init__(self, V: np.ndarray, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray,
+                 nprobe: int = IVF_NPROBE, Vp: Optional[np.ndarray] = None):
+        self.centroids = centroids
+        self.order = order                 # item idx, xếp theo cụm
+        self.offsets = offsets             # list j = order[offsets[j]:offsets[j+1]]
+        # vectors theo thứ tự cụm → quét liên tục; load() truyền bản mmap thay vì copy V mỗi worker
+        self.Vp = Vp if Vp is not None else np.ascontiguousarray(V[order])
+        self.nprobe = nprobe
+        self.widened = 0                   # số lần search phải mở rộng nprobe để đủ k
+
+    @classmethod
+    def build(cls, V: np.ndarray, nlist: int = 0, iters: int = 10, seed: int = 42) -> "IVFIndex":
+        n = V.shape[0]
+        nlist = nlist or max(1, min(n // 8, int(4 * np.sqrt(n))))
+        C = kmeans(V.astype(np.float32), nlist, iters=iters, seed=seed)
+        assign = _assign(V, C)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        return cls(V, C, order, offsets)
+
+    def save(self, path: str):
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets)
+        np.save(os.path.join(os.path.dirname(path), IVF_VECTORS_PATH),
+                np.ascontiguousarray(self.Vp, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path: str, V: np.ndarray, nprobe: int = IVF_NPROBE) -> "IVFIndex":
+        d = np.load(path)
+        if d["order"].shape[0] != V.shape[0] or d["centroids"].shape[1] != V.shape[1]:
+            raise RuntimeError("IVF index/Model mismatch")
+        vp_path = os.path.join(os.path.dirname(path), IVF_VECTORS_PATH)
+        Vp = None
+        if os.path.exists(vp_path):
+            Vp = np.load(vp_path, mmap_mode="r")
+            if Vp.shape != V.shape:
+                raise RuntimeError("IVF vectors/Model mismatch")
+        else:
+            print(f"[WARN] {IVF_VECTORS_PATH} missing (artifact cũ) — permuting V in memory")
+        return cls(V, d["centroids"], d["order"], d["offsets"], nprobe, Vp)
+
+    def search(self, q: np.ndarray, k: int, exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Quét `nprobe` cụm gần nhất; nếu các cụm đó không đủ k item (sau khi bỏ `exclude`)
+        thì nhân đôi nprobe tới khi đủ hoặc đã quét hết (= exact search).
+        """
+        nlist = self.centroids.shape[0]
+        ranked = np.argsort(-(self.centroids @ q))
+        nprobe = min(self.nprobe, nlist)
+        while True:
+            idx, scores = self._scan(q, ranked[:nprobe], k, exclude)
+            if idx.shape[0] >= k or nprobe >= nlist:
+                return idx, scores
+            nprobe = min(nlist, nprobe * 2)
+            self.widened += 1
+
+    def _scan(self, q: np.ndarray, lists: np.ndarray, k: int,
+              exclude: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        segs = [np.arange(self.offsets[j], self.offsets[j + 1]) for j in lists]
+        pos = np.concatenate(segs) if segs else np.empty(0, dtype=np.int64)
+        cand = self.order[pos]
+        scores = self.Vp[pos] @ q
+        if exclude is not None and len(exclude):
+            scores[np.isin(cand, exclude)] = -np.inf
+        top = _topk(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return cand[top].astype(np.int64), scores[top]
+
+    def stats(self) -> dict:
+        return {"type": self.name, "items": int(self.order.shape[0]),
+                "nlist": int(self.centroids.shape[0]), "nprobe": self.nprobe, "widened": self.widened,
+                "vectors": "mmap" if isinstance(self.Vp, np.memmap) else "memory"}
+
+
+def build_ivf_artifact(V: np.ndarray, art_dir: str = "artifacts", nlist: int = IVF_NLIST) -> dict:
+    t0 = time.time()
+    idx = IVFIndex.build(V, nlist=nlist)
+    idx.save(os.path.join(art_dir, IVF_PATH))
+    return {"nlist": int(idx.centroids.shape[0]), "build_sec": round(time.time() - t0, 3)}
+
+
+def load_similarity_index(V: np.ndarray, art_dir: str = "artifacts", kind: str = SIM_INDEX):
+    """Index theo SIM_INDEX; thiếu artifact IVF → quay về exact."""
+    if kind == "ivf":
+        try:
+            return IVFIndex.load(os.path.join(art_dir, IVF_PATH), V)
+        except Exception as e:
+            print("[WARN] IVF index unavailable, using exact search:", e)
+    return ExactIndex(V)
@@ -0,0 +1,149 @@
+# synth_data.py — Dữ liệu giả lập (playback_state / users / movies / series) cho benchmark
+# Popularity theo power-law (Zipf) cho cả item lẫn mức độ hoạt động của user, cộng sở thích
+# category theo user để ALS có tín hiệu thật. Document giống schema mongoose ở server/Models.
+# Ví dụ:
+#   DB_NAME=Movie-web-bench python synth_data.py --users 50000 --movies 8000 --series 2000 --events 30 --drop
+import os, datetime
+from typing import Dict
+
+import numpy as np
+from bson import ObjectId
+
+CATEGORIES = ["Action", "Drama", "Comedy", "Horror", "Romance", "Sci-Fi",
+              "Animation", "Thriller", "Documentary", "Adventure", "Crime", "Family"]
+
+
+def zipf_weights(n: int, a: float, rng: np.random.Generator) -> np.ndarray:
+    """p_i ∝ rank^-a, rank gán ngẫu nhiên (item phổ biến không dồn về đầu danh sách)."""
+    w = np.arange(1, n + 1, dtype=np.float64) ** -a
+    rng.shuffle(w)
+    return w / w.sum()
+
+
+def _object_ids(n: int):
+    return [ObjectId() for _ in range(n)]
+
+
+def _insert(col, docs, batch: int) -> int:
+    for i in range(0, len(docs), batch):
+        col.insert_many(docs[i:i + batch], ordered=False)
+    return len(docs)
+
+
+def generate(db, users: int = 2000, movies: int = 1500, series: int = 300, events: float = 20.0,
+             item_zipf: float = 1.1, user_zipf: float = 0.8, affinity: float = 0.6,
+             like_rate: float = 0.15, review_rate: float = 0.05, days: int = 90,
+             seed: int = 0, batch: int = 10000,
+             watch_col: str = "playback_state", users_col: str = "users",
+             movies_col: str = "movies", series_col: str = "series") -> Dict[str, int]:
+    """
+    Ghi dữ liệu vào db, trả về số document theo collection.
+    events: số lượt xem trung bình mỗi user (phân bố power-law giữa các user).
+    affinity: tỉ lệ lượt xem lấy từ category yêu thích của user, phần còn lại theo popularity toàn cục.
+    """
+    rng = np.random.default_rng(seed)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    n_items = movies + series
+
+    item_ids = _object_ids(n_items)
+    is_series = np.arange(n_items) >= movies
+    item_cat = rng.integers(0, len(CATEGORIES), size=n_items)
+    pop = zipf_weights(n_items, item_zipf, rng)
+
+    # === Lượt xem: số lượt mỗi user ~ power-law, item ~ popularity (toàn cục hoặc trong category) ===
+    activity = zipf_weights(users, user_zipf, rng)
+    per_user = np.maximum(1, rng.multinomial(int(users * events), activity))
+    uu = np.repeat(np.arange(users), per_user)
+    fav = rng.integers(0, len(CATEGORIES), size=users)
+    ii = rng.choice(n_items, size=uu.size, p=pop)
+    own = rng.random(uu.size) < affinity
+    for c in range(len(CATEGORIES)):
+        in_c = np.flatnonzero(item_cat == c)
+        sel = np.flatnonzero(own & (fav[uu] == c))
+        if in_c.size and sel.size:
+            ii[sel] = rng.choice(in_c, size=sel.size, p=pop[in_c] / pop[in_c].sum())
+    pairs = np.unique(uu.astype(np.int64) * n_items + ii)  # một row playback_state / (user, item)
+    uu, ii = pairs // n_items, pairs % n_items
+
+    progress = np.round(rng.beta(0.8, 0.6, size=uu.size) * 100, 1)
+    finished = progress >= 90
+    age = np.minimum(rng.exponential(days / 3.0, size=uu.size), days)
+    episode = rng.integers(1, 11, size=uu.size)
+
+    user_ids = _object_ids(users)
+    when = [now - datetime.timedelta(days=float(a)) for a in age]
+    playback = [{
+        "userId": user_ids[u], "movieId": item_ids[i],
+        "seasonNumber": 1 if is_series[i] else None,
+        "episodeNumber": int(e) if is_series[i] else None,
+        "progressPct": float(p), "finished": bool(f), "duration": 5400, "lastPosition": int(54 * p),
+        "lastAction": "complete" if f else "progress", "lastActionAt": t,
+    } for u, i, p, f, e, t in zip(uu.tolist(), ii.tolist(), progress, finished, episode, when)]
+
+    # === likedItems (một phần item đã xem hết) + reviews trên movies ===
+    liked = finished & (rng.random(uu.size) < like_rate / max(finished.mean(), 1e-9))
+    likes: Dict[int, list] = {}
+    for u, i in zip(uu[liked].tolist(), ii[liked].tolist()):
+        likes.setdefault(u, []).append({"refId": item_ids[i], "kind": "Series" if is_series[i] else "Movie"})
+    reviewed = finished & ~is_series[ii] & (rng.random(uu.size) < review_rate / max(finished.mean(), 1e-9))
+    reviews: Dict[int, list] = {}
+    for u, i in zip(uu[reviewed].tolist(), ii[reviewed].tolist()):
+        reviews.setdefault(i, []).append({"userId": user_ids[u], "userName": f"user{u}",
+                                          "rating": int(rng.integers(1, 6)), "comment": "-"})
+
+    user_docs = [{"_id": user_ids[u], "fullName": f"user{u}", "email": f"user{u}@bench.local",
+                  "likedItems": likes.get(u, []), "updatedAt": now} for u in range(users)]
+    movie_docs, series_docs = [], []
+    for i in range(n_items):
+        doc = {"_id": item_ids[i], "name": f"{'Series' if is_series[i] else 'Movie'} {i}",
+               "category": CATEGORIES[item_cat[i]], "year": int(1980 + i % 45), "rate": int(i % 5) + 1,
+               "image": f"/img/{i}.jpg", "titleImage": f"/img/{i}_t.jpg", "updatedAt": now}
+        if is_series[i]:
+            series_docs.append(doc)
+        else:
+            revs = reviews.get(i, [])
+            doc.update({"desc": "-", "language": "en", "time": 90, "video": "-",
+                        "reviews": revs, "numberOfReviews": len(revs)})
+            movie_docs.append(doc)
+
+    return {
+        movies_col: _insert(db[movies_col], movie_docs, batch),
+        series_col: _insert(db[series_col], series_docs, batch),
+        users_col: _insert(db[users_col], user_docs, batch),
+        watch_col: _insert(db[watch_col], playback, batch),
+        "likes": int(liked.sum()),
+        "reviews": int(reviewed.sum()),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="Generate synthetic recommender data into MONGO_URL/DB_NAME")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--movies", type=int, default=1500)
+    ap.add_argument("--series", type=int, default=300)
+    ap.add_argument("--events", type=float, default=20.0, help="mean playback rows per user")
+    ap.add_argument("--item-zipf", type=float, default=1.1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--drop", action="store_true", help="drop the four collections first")
+    ap.add_argument("--force", action="store_true", help="allow writing into DB_NAME=Movie-web")
+    args = ap.parse_args()
+
+    db_name = os.getenv("DB_NAME", "Movie-web-bench")
+    if db_name == "Movie-web" and not args.force:
+        raise SystemExit("[ERROR] refusing to write synthetic data into Movie-web (set DB_NAME or --force)")
+    cols = dict(watch_col=os.getenv("WATCH_COLLECTION", "playback_state"),
+                users_col=os.getenv("USERS_COLLECTION", "users"),
+                movies_col=os.getenv("MOVIES_COLLECTION", "movies"),
+                series_col=os.getenv("SERIES_COLLECTION", "series"))
+    _db = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))[db_name]
+    if args.drop:
+        for c in cols.values():
+            _db.drop_collection(c)
+    res = generate(_db, users=args.users, movies=args.movies, series=args.series, events=args.events,
+                   item_zipf=args.item_zipf, seed=args.seed, **cols)
+    print(f"[DONE] {db_name}: {res}")
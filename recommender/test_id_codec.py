@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from id_codec import (CodeIndex, CodeList, code_key, decode_codes, encode_keys, index_for, item_code,
+                      item_keys, key_code, oid_bytes, rows_for, save_code_arrays)
+
+# byte 0 ở cuối: numpy cắt khi đọc từng phần tử S*
+TRAILING_ZERO = "65f0a1b2c3d4e5f601020000"
+
+
+def _items():
+    oids = [str(ObjectId()) for _ in range(5)] + [TRAILING_ZERO]
+    return [f"movie:{o}" for o in oids] + [f"series:{o}" for o in oids[:3]] + [f"series:{TRAILING_ZERO}"]
+
+
+def test_oid_bytes_accepts_known_forms():
+    o = ObjectId()
+    assert oid_bytes(o) == oid_bytes(str(o)) == oid_bytes({"$oid": str(o)}) == oid_bytes(o.binary) == o.binary
+    assert oid_bytes("not-an-objectid") is None
+    assert oid_bytes("z" * 24) is None
+    assert oid_bytes(42) is None
+
+
+def test_encode_decode_round_trip():
+    items = _items()
+    assert decode_codes(encode_keys(items, item=True), item=True) == items
+    users = [k.split(":")[1] for k in items[:6]]
+    assert decode_codes(encode_keys(users, item=False), item=False) == users
+
+
+def test_code_order_matches_string_order():
+    items = _items()
+    codes = encode_keys(items, item=True)
+    assert [items[j] for j in np.argsort(codes, kind="stable")] == sorted(items)
+
+
+def test_trailing_zero_bytes_survive_single_element_access():
+    items = _items()
+    codes = encode_keys(items, item=True)
+    lst = CodeList(codes, item=True)
+    assert [lst[i] for i in range(len(lst))] == items
+    assert list(lst) == items
+    assert code_key(item_code(TRAILING_ZERO, True), item=True) == f"series:{TRAILING_ZERO}"
+    assert key_code(f"movie:{TRAILING_ZERO}", item=True)[-2:] == b"\0\0"
+
+
+def test_code_index_lookup():
+    items = _items()
+    idx = CodeIndex.from_keys(items, item=True)
+    assert [idx[k] for k in items] == list(range(len(items)))
+    assert f"movie:{TRAILING_ZERO}" in idx and f"series:{TRAILING_ZERO}" in idx
+    assert idx.get(f"series:{str(ObjectId())}") is None
+    assert idx.get("tv:" + TRAILING_ZERO) is None
+    assert idx.lookup([items[3], "bad", items[0]]).tolist() == [3, -1, 0]
+    with pytest.raises(KeyError):
+        idx["movie:" + str(ObjectId())]
+
+
+def test_non_objectid_ids_fall_back_to_dict():
+    with pytest.raises(ValueError):
+        encode_keys(["movie:abc"], item=True)
+    index = index_for(["movie:abc", f"movie:{TRAILING_ZERO}"], item=True)
+    assert isinstance(index, dict)
+    codes = [item_code(TRAILING_ZERO, False), None]
+    assert rows_for(index, codes, item=True).tolist() == [1, -1]
+
+
+def test_rows_for_and_item_keys_with_code_index(tmp_path):
+    items = _items()
+    assert save_code_arrays(str(tmp_path), "item", items, item=True)
+    idx = CodeIndex.load(str(tmp_path), "item", item=True)
+    assert isinstance(idx.sorted, np.memmap)
+    codes = [item_code(TRAILING_ZERO, True), None, item_code(str(ObjectId()), False)]
+    assert rows_for(idx, codes, item=True).tolist() == [len(items) - 1, -1, -1]
+    lst = CodeList(np.load(tmp_path / "item_codes.npy", mmap_mode="r"), item=True)
+    assert item_keys(lst, [8, 0]) == [items[8], items[0]]
+    assert item_keys(items, [8, 0]) == [items[8], items[0]]
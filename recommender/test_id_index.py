@@ -0,0 +1,13 @@
+import numpy as np
+
+from id_index import IdIndex, save_id_arrays
+
+
+def test_lookup_treats_non_ascii_keys_as_missing(tmp_path):
+    ids = ["movie:abc", "movie:abd", "user-1"]
+    save_id_arrays(str(tmp_path), "item", ids)
+    idx = IdIndex.load(str(tmp_path), "item")
+    keys = ["movie:abé", "movie:abd", "movie:abéc", "user-1", "movie:abcdefghij", ""]
+    assert idx.lookup(keys).tolist() == [-1, 1, -1, 2, -1, -1]
+    assert [idx.get(k, -1) for k in keys] == idx.lookup(keys).tolist()
+    assert idx.lookup([]).dtype == np.int64
@@ -0,0 +1,55 @@
+import datetime
+
+import pytest
+from bson import ObjectId
+
+import mongo_check
+from mongo_check import OTHER_IDS, Report, bulk_check, id_ranges
+
+mongomock = pytest.importorskip("mongomock")  # optional, như bench_pipeline.py --mock
+
+
+def _oid(days_ago):
+    return ObjectId.from_datetime(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days_ago))
+
+
+def _db():
+    db = mongomock.MongoClient().db
+    movie = ObjectId()
+    db[mongo_check.MOVIES_COL].insert_one({"_id": movie})
+    users = [_oid(d) for d in range(0, 300, 10)] + ["legacy-user", 42]
+    db[mongo_check.USERS_COL].insert_many(
+        [{"_id": u, "likedItems": [{"refId": movie, "kind": "Movie"}]} for u in users])
+    db[mongo_check.USERS_COL].update_one({"_id": "legacy-user"}, {"$push": {"likedItems": "movie:abc"}})
+    rows = [{"_id": _oid(d), "userId": users[0], "movieId": movie} for d in range(0, 300, 7)]
+    rows += [{"_id": f"row-{i}", "userId": users[1], "movieId": movie} for i in range(3)]
+    db[mongo_check.WATCH_COL].insert_many(rows)
+    return db, len(users), len(rows)
+
+
+def test_id_ranges_add_a_pass_for_non_objectid_ids():
+    db, _, _ = _db()
+    ranges = id_ranges(db[mongo_check.USERS_COL], 4)
+    assert ranges[-1] == OTHER_IDS and len(ranges) == 5
+
+
+def test_id_ranges_objectid_only_collection():
+    db, _, _ = _db()
+    db[mongo_check.USERS_COL].delete_many({"_id": {"$not": {"$type": "objectId"}}})
+    assert OTHER_IDS not in id_ranges(db[mongo_check.USERS_COL], 4)
+
+
+def test_bulk_check_scans_every_id_type():
+    db, n_users, n_rows = _db()
+    report = bulk_check(db, workers=2, parts_per_worker=2, batch=7, report=Report())
+    assert report.counts["liked.users"] == n_users
+    assert report.counts["playback.rows"] == n_rows
+    assert report.counts["playback.orphaned_user"] == 0
+
+
+def test_invalid_non_dict_liked_item_keeps_type_and_repr():
+    db, _, _ = _db()
+    report = bulk_check(db, workers=1, report=Report(), checks=("liked",))
+    (issue,) = report.examples["liked.invalid"]
+    assert issue["userId"] == "legacy-user"
+    assert issue["type"] == "str" and issue["item"] == "'movie:abc'"
@@ -0,0 +1,55 @@
+import numpy as np
+
+from result_cache import MemoryBackend, ResultCache, encode, etag, etag_matches, similar_key, user_key
+
+
+def test_etag_follows_body():
+    a = encode({"userId": "u", "items": [{"rate": np.float32(4.5)}]})
+    assert etag(a) == etag(encode({"userId": "u", "items": [{"rate": 4.5}]}))
+    assert etag(a) != etag(encode({"userId": "u", "items": []}))
+    assert etag(a).startswith('"') and etag(a).endswith('"')
+
+
+def test_etag_matches_if_none_match_forms():
+    tag = etag(b"{}")
+    assert etag_matches(tag, tag)
+    assert etag_matches(tag, f'"other", W/{tag}')
+    assert etag_matches(tag, " * ")
+    assert not etag_matches(tag, '"other"')
+    assert not etag_matches(tag, None)
+    assert not etag_matches(tag, "")
+
+
+def test_clear_prefix_keeps_other_kinds():
+    c = ResultCache(MemoryBackend(100))
+    c.put(user_key("v1", "u"), 8, b"u", 60)
+    c.put(similar_key("v1", "movie", "a"), 12, b"a", 60)
+    c.put(similar_key("v1", "series", "b"), 12, b"b", 60)
+    assert c.clear("similar:") == 2
+    assert c.get(similar_key("v1", "movie", "a"), 12) is None
+    assert c.get(user_key("v1", "u"), 8) == b"u"
+
+
+def test_local_entry_expires():
+    c = ResultCache(MemoryBackend(100))
+    c.put("user:v1:u", 8, b"x", 0)
+    assert c.get("user:v1:u", 8) is None
+
+
+class _BrokenShared:
+    def hget(self, key, field):
+        raise ConnectionError("down")
+
+    def hset(self, key, field, value, ttl):
+        raise ConnectionError("down")
+
+    def stats(self):
+        return {"type": "broken"}
+
+
+def test_shared_failure_is_a_miss():
+    c = ResultCache(MemoryBackend(100), _BrokenShared(), local_ttl=5)
+    assert c.get("user:v1:u", 8) is None
+    c.put("user:v1:u", 8, b"x", 60)  # tầng 1 vẫn ghi, TTL bị giới hạn bởi local_ttl
+    assert c.get("user:v1:u", 8) == b"x"
+    assert c.stats()["errors"] == 2
@@ -0,0 +1,24 @@
+import pytest
+
+from schema_probe import SchemaProbe
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def test_missing_index_warns_only_when_set_changes(capsys):
+    db = mongomock.MongoClient().db
+    db.playback.insert_one({"userId": 1})
+    probe = SchemaProbe(db, {"playback": [(("userId", 1),), (("lastActionAt", 1),)]}, create=False)
+    probe.refresh()
+    assert capsys.readouterr().out.count("[WARN] missing index") == 2
+    probe.refresh()
+    assert "[WARN]" not in capsys.readouterr().out
+
+    db.playback.create_index([("userId", 1), ("movieId", 1)])
+    probe.refresh()
+    out = capsys.readouterr().out
+    assert "[WARN]" not in out and "index playback{userId: 1} now present" in out
+    db.playback.drop_indexes()
+    probe.refresh()
+    assert capsys.readouterr().out.count("[WARN] missing index playback{userId: 1}") == 1
+    assert list(probe.stats()["missing_indexes"]) == ["playback"]
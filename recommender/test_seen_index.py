@@ -0,0 +1,58 @@
+import numpy as np
+
+from seen_index import SeenIndex, build_csr
+
+
+def _index(compact_at=0, max_pairs=0):
+    indptr, indices = build_csr([[1, 4], [], [0, 2, 3]])
+    return SeenIndex(indptr, indices, None, compact_at=compact_at, max_pairs=max_pairs)
+
+
+def _pair_set(rows, cols):
+    return set(zip(rows.tolist(), cols.tolist()))
+
+
+def test_pairs_base_only():
+    s = _index()
+    rows, cols = s.pairs(np.array([2, 0, 1]), ["c", "a", "b"])
+    assert _pair_set(rows, cols) == {(0, 0), (0, 2), (0, 3), (1, 1), (1, 4)}
+
+
+def test_pairs_include_overlay_for_batch_users_only():
+    s = _index()
+    s.add("b", 7)
+    s.add("a", 9)
+    s.add("x", 5)  # không nằm trong batch
+    rows, cols = s.pairs(np.array([0, 1]), ["a", "b"])
+    assert _pair_set(rows, cols) == {(0, 1), (0, 4), (0, 9), (1, 7)}
+
+
+def test_compaction_keeps_seen_and_pairs():
+    s = _index(compact_at=3)
+    for uid, i in [("a", 9), ("b", 7), ("new", 5), ("a", 8), ("b", 6), ("a", 9), ("new", 4)]:
+        s.add(uid, i)
+    assert s.compactions == 2 and not s.overlay
+    assert sorted(s.seen(0, "a").tolist()) == [1, 4, 8, 9]
+    assert sorted(s.seen(1, "b").tolist()) == [6, 7]
+    assert sorted(s.seen(None, "new").tolist()) == [4, 5]
+    assert s.has_overlay("new") and not s.has_overlay("c")
+    rows, cols = s.pairs(np.array([1, 0]), ["b", "a"])
+    assert _pair_set(rows, cols) == {(0, 6), (0, 7), (1, 1), (1, 4), (1, 8), (1, 9)}
+    assert s.stats()["overlay_pairs"] == 6
+
+
+def test_overlay_cap_drops_new_pairs():
+    s = _index(max_pairs=2)
+    s.add("a", 9)
+    s.add("a", 9)  # trùng, không tính
+    s.add("b", 7)
+    s.add("b", 6)
+    st = s.stats()
+    assert st["overlay_pairs"] == 2 and st["overlay_dropped"] == 1
+    assert s.seen(1, "b").tolist() == [7]
+
+
+def test_seen_without_overlay_returns_base_slice():
+    s = _index()
+    assert s.seen(2, "c").tolist() == [0, 2, 3]
+    assert s.seen(None, "nobody").size == 0
@@ -0,0 +1,45 @@
+import contextlib, io, sys
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("implicit")
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    """Synth data → export → train trong thư mục tạm, serve_api trên cùng mongomock."""
+    if "serve_core" in sys.modules:
+        pytest.skip("serve_core đã được import với Mongo thật")
+    import pymongo
+    from fastapi.testclient import TestClient
+
+    mp = pytest.MonkeyPatch()
+    mc = mongomock.MongoClient()
+    mp.setattr(pymongo, "MongoClient", lambda *a, **k: mc)
+    mp.chdir(tmp_path_factory.mktemp("serve"))
+    import synth_data, export_interactions, train_als
+    mp.setattr(export_interactions, "MongoClient", lambda *a, **k: mc)
+    synth_data.generate(mc["Movie-web"], users=300, movies=200, series=40, events=15, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        export_interactions.main([])
+        train_als.main([])
+        import serve_api
+    with TestClient(serve_api.app) as c:
+        yield c, serve_api
+    mp.undo()
+
+
+@pytest.mark.parametrize("n", [4, 12])
+def test_batch_matches_single_user_route(client, n):
+    c, serve_api = client
+    import reco_pipeline
+    assert reco_pipeline.PIPELINE_ENABLED
+    m = serve_api.registry.current
+    uids = [m.users[i] for i in range(0, 60, 3)] + ["c" * 24]  # + cold start
+    single = {u: c.get(f"/recommend/user/{u}?n={n}").json() for u in uids}
+    batch = c.post("/recommend/users", json={"userIds": uids, "n": n}).json()["results"]
+    assert [r["userId"] for r in batch] == uids
+    for r in batch:
+        assert r == single[r["userId"]]
+        assert len(r["items"]) == n
@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+
+import shard_router
+
+
+class _Map:
+    def maybe_reload(self):
+        pass
+
+    def route(self, key):
+        return "shard-0", "http://shard0"
+
+
+def test_path_params_are_quoted_upstream(monkeypatch):
+    calls = []
+
+    def fake_call(sid, method, url, body=None, headers=None, timeout=None):
+        calls.append(url)
+        return 200, b"{}", {"content-type": "application/json"}
+
+    monkeypatch.setattr(shard_router, "shards", _Map())
+    monkeypatch.setattr(shard_router, "_call", fake_call)
+    c = TestClient(shard_router.app)
+    assert c.get("/recommend/user/a%3Fn%3D99%23x%25?n=3").status_code == 200
+    assert c.get("/recommend/similar/movie/b%23c").status_code == 200
+    assert calls == ["http://shard0/recommend/user/a%3Fn%3D99%23x%25?n=3",
+                     "http://shard0/recommend/similar/movie/b%23c"]
@@ -0,0 +1,99 @@
+import os, json
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from model_registry import ALSModel, save_mmap_artifacts
+from seen_index import build_csr
+from sharding import ShardRing, _slice_csr, split_artifacts, MANIFEST_NAME
+
+
+def _keys(n):
+    return [str(ObjectId()) for _ in range(n)]
+
+
+def test_ring_is_deterministic():
+    keys = _keys(200)
+    a = ShardRing(["shard-0", "shard-1", "shard-2"])
+    b = ShardRing(["shard-0", "shard-1", "shard-2"])
+    assert a.indices_of(keys).tolist() == b.indices_of(keys).tolist()
+    assert [a.shard_of(k) for k in keys[:5]] == [a.shards[a.index_of(k)] for k in keys[:5]]
+
+
+def test_adding_a_shard_moves_about_one_nth():
+    keys = _keys(4000)
+    before = ShardRing([f"shard-{j}" for j in range(4)])
+    after = ShardRing([f"shard-{j}" for j in range(5)])
+    old = np.array(before.shards)[before.indices_of(keys)]
+    new = np.array(after.shards)[after.indices_of(keys)]
+    moved = old != new
+    assert set(new[moved]) == {"shard-4"}  # chỉ chuyển sang shard mới
+    assert 0.1 < moved.mean() < 0.3
+
+
+def test_slice_csr_keeps_selected_rows():
+    indptr, indices = build_csr([[3, 1], [], [7], [2, 5, 9]])
+    out_ptr, out_idx = _slice_csr(indptr, np.array([3, 1, 0]), indices)
+    assert out_ptr.tolist() == [0, 3, 3, 5]
+    assert out_idx.tolist() == [2, 5, 9, 1, 3]
+
+
+def test_split_artifacts_round_trip(tmp_path):
+    art = str(tmp_path)
+    users, items = _keys(60), [f"movie:{k}" for k in _keys(20)]
+    rng = np.random.default_rng(0)
+    U, V = rng.normal(size=(60, 4)), rng.normal(size=(20, 4))
+    save_mmap_artifacts(art, U, V, users, items)
+    rows = [[u % 20, (u * 7) % 20] for u in range(60)]
+    indptr, indices = build_csr(rows)
+    np.savez(os.path.join(art, "seen_items.npz"), indptr=indptr, indices=indices, since=np.int64(0))
+
+    manifest = split_artifacts(art, n_shards=3, vnodes=16)
+    assert sum(s["users"] for s in manifest["shards"]) == 60
+    with open(os.path.join(art, "shards", MANIFEST_NAME), encoding="utf-8") as f:
+        ring = ShardRing.from_manifest(json.load(f))
+
+    for s in manifest["shards"]:
+        d = os.path.join(art, "shards", s["dir"])
+        with open(os.path.join(d, "user_id_map.json"), encoding="utf-8") as f:
+            mine = json.load(f)["users"]
+        assert all(ring.shard_of(u) == s["id"] for u in mine)
+        Us = np.load(os.path.join(d, "user_factors.npy"))
+        seen = np.load(os.path.join(d, "seen_items.npz"))
+        for r, u in enumerate(mine):
+            g = users.index(u)
+            assert np.allclose(Us[r], U[g])
+            got = seen["indices"][seen["indptr"][r]:seen["indptr"][r + 1]]
+            assert got.tolist() == sorted(set(rows[g]))
+        assert np.array_equal(np.load(os.path.join(d, "item_factors.npy")), V.astype(np.float32))
+
+
+def test_shard_owns_and_filters_seen_poll(tmp_path):
+    mongomock = pytest.importorskip("mongomock")
+    art = str(tmp_path)
+    users, items = _keys(40), [f"movie:{k}" for k in _keys(10)]
+    save_mmap_artifacts(art, np.ones((40, 2)), np.ones((10, 2)), users, items)
+    indptr, indices = build_csr([[] for _ in users])
+    np.savez(os.path.join(art, "seen_items.npz"), indptr=indptr, indices=indices)
+    split_artifacts(art, n_shards=3, vnodes=16)
+    col = mongomock.MongoClient().db.playback
+    others = [str(ObjectId()) for _ in range(20)]  # chưa có trong U của shard nào
+    col.insert_many([{"userId": u, "movieId": items[0].split(":")[1]} for u in users + others])
+
+    owned = set()
+    for j in range(3):
+        d = os.path.join(art, "shards", f"shard-{j}")
+        if j == 2:  # shard chia bởi bản cũ: shard.json không có ring → manifest.json bên cạnh
+            with open(os.path.join(d, "shard.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            meta.pop("ring")
+            with open(os.path.join(d, "shard.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        m = ALSModel.load(d)
+        touched = set()
+        m.seen.poll(col, m.item_index, touched, owns=m.owns)
+        assert touched == {u for u in users + others if m.ring.shard_of(u) == f"shard-{j}"}
+        assert set(m.users) <= touched
+        owned |= touched
+    assert owned == set(users + others)
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from similarity_index import ExactIndex, IVFIndex, IVF_PATH, IVF_VECTORS_PATH
+
+
+def _factors(n=600, d=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, d)).astype(np.float32)
+
+
+def test_exact_search_skips_excluded():
+    V = _factors()
+    q = V[0]
+    top, _ = ExactIndex(V).search(q, 5)
+    idx, scores = ExactIndex(V).search(q, 5, exclude=top[:2])
+    assert not set(top[:2]) & set(idx.tolist())
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_ivf_full_probe_matches_exact():
+    V = _factors()
+    ivf = IVFIndex.build(V, nlist=16)
+    ivf.nprobe = 16
+    q = _factors(1, seed=1)[0]
+    assert np.array_equal(ivf.search(q, 20)[0], ExactIndex(V).search(q, 20)[0])
+
+
+def test_ivf_widens_probe_when_lists_are_short():
+    V = _factors()
+    ivf = IVFIndex.build(V, nlist=64)
+    ivf.nprobe = 1  # ~10 item mỗi cụm, ít hơn k
+    q = _factors(1, seed=2)[0]
+    idx, _ = ivf.search(q, 50)
+    assert idx.shape[0] == 50 and len(set(idx.tolist())) == 50
+    assert ivf.widened > 0
+
+
+def test_ivf_short_after_exclude_returns_k():
+    V = _factors()
+    ivf = IVFIndex.build(V, nlist=32)
+    ivf.nprobe = 2
+    q = _factors(1, seed=3)[0]
+    seen = ivf.search(q, 40)[0]
+    idx, _ = ivf.search(q, 30, exclude=seen)
+    assert idx.shape[0] == 30
+    assert not set(idx.tolist()) & set(seen.tolist())
+
+
+def test_ivf_returns_all_remaining_when_fewer_than_k():
+    V = _factors(100)
+    ivf = IVFIndex.build(V, nlist=8)
+    idx, _ = ivf.search(V[0], 20, exclude=np.arange(95))
+    assert sorted(idx.tolist()) == [95, 96, 97, 98, 99]
+
+
+def test_ivf_load_mmaps_permuted_vectors(tmp_path):
+    V = _factors()
+    built = IVFIndex.build(V, nlist=16)
+    built.save(os.path.join(tmp_path, IVF_PATH))
+    assert os.path.exists(os.path.join(tmp_path, IVF_VECTORS_PATH))
+    loaded = IVFIndex.load(os.path.join(tmp_path, IVF_PATH), V)
+    assert isinstance(loaded.Vp, np.memmap)
+    assert np.array_equal(np.asarray(loaded.Vp), V[loaded.order])
+    q = V[5]
+    assert np.array_equal(loaded.search(q, 10)[0], built.search(q, 10)[0])
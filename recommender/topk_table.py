@@ -0,0 +1,97 @@
+# topk_table.py — Precompute top-K items cho mọi user / mọi item (similar) từ ALS factors
+# Output (cạnh als_model.npz, đọc bằng mmap):
+#   topk_users_idx.npy / topk_users_scores.npy   (num_users, K)
+#   topk_items_idx.npy / topk_items_scores.npy   (num_items, K)
+import os, json, time
+from typing import Optional
+
+import numpy as np
+
+TOPK_K     = int(os.getenv("TOPK_K", "200"))
+TOPK_CHUNK = int(os.getenv("TOPK_CHUNK", "2048"))  # số hàng mỗi lần nhân ma trận
+
+
+def compute_topk(Q: np.ndarray, V: np.ndarray, k: int, chunk: int = TOPK_CHUNK,
+                 exclude_self: bool = False):
+    """
+    Top-k of Q @ V.T per row, processed `chunk` rows at a time so the
+    dense score block never exceeds (chunk, num_items).
+    exclude_self: Q is V itself (similar items) → bỏ chính item đó.
+    """
+    n, m = Q.shape[0], V.shape[0]
+    k = min(k, m - 1 if exclude_self else m)
+    out_idx = np.empty((n, k), dtype=np.int32)
+    out_scr = np.empty((n, k), dtype=np.float32)
+    for s in range(0, n, chunk):
+        e = min(s + chunk, n)
+        S = Q[s:e] @ V.T
+        if exclude_self:
+            S[np.arange(e - s), np.arange(s, e)] = -np.inf
+        part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+        ps = np.take_along_axis(S, part, axis=1)
+        order = np.argsort(-ps, axis=1)
+        out_idx[s:e] = np.take_along_axis(part, order, axis=1)
+        out_scr[s:e] = np.take_along_axis(ps, order, axis=1)
+    return out_idx, out_scr
+
+
+def build_topk_artifacts(U: np.ndarray, V: np.ndarray, art_dir: str = "artifacts",
+                         k: int = TOPK_K, chunk: int = TOPK_CHUNK) -> dict:
+    t0 = time.time()
+    ui, us = compute_topk(U, V, k, chunk)
+    np.save(os.path.join(art_dir, "topk_users_idx.npy"), ui)
+    np.save(os.path.join(art_dir, "topk_users_scores.npy"), us)
+    t1 = time.time()
+    ii, iscr = compute_topk(V, V, k, chunk, exclude_self=True)
+    np.save(os.path.join(art_dir, "topk_items_idx.npy"), ii)
+    np.save(os.path.join(art_dir, "topk_items_scores.npy"), iscr)
+    t2 = time.time()
+    return {"k_users": int(ui.shape[1]), "k_items": int(ii.shape[1]),
+            "users_sec": round(t1 - t0, 3), "items_sec": round(t2 - t1, 3)}
+
+
+class TopKTable:
+    """Memory-mapped precomputed top-K (users + similar items)."""
+
+    def __init__(self, users_idx, users_scores, items_idx, items_scores):
+        self.users_idx = users_idx
+        self.users_scores = users_scores
+        self.items_idx = items_idx
+        self.items_scores = items_scores
+
+    @classmethod
+    def load(cls, art_dir: str, num_users: int, num_items: int) -> "TopKTable":
+        p = lambda name: os.path.join(art_dir, name)
+        t = cls(
+            np.load(p("topk_users_idx.npy"), mmap_mode="r"),
+            np.load(p("topk_users_scores.npy"), mmap_mode="r"),
+            np.load(p("topk_items_idx.npy"), mmap_mode="r"),
+            np.load(p("topk_items_scores.npy"), mmap_mode="r"),
+        )
+        if t.users_idx.shape[0] != num_users or t.items_idx.shape[0] != num_items:
+            raise RuntimeError("TopK table/Mapping mismatch")
+        return t
+
+    def user_row(self, uidx: int) -> Optional[np.ndarray]:
+        return np.asarray(self.users_idx[uidx]) if 0 <= uidx < self.users_idx.shape[0] else None
+
+    def item_row(self, iidx: int) -> Optional[np.ndarray]:
+        return np.asarray(self.items_idx[iidx]) if 0 <= iidx < self.items_idx.shape[0] else None
+
+    def stats(self) -> dict:
+        return {"users": int(self.users_idx.shape[0]), "k_users": int(self.users_idx.shape[1]),
+                "items": int(self.items_idx.shape[0]), "k_items": int(self.items_idx.shape[1])}
+
+
+if __name__ == "__main__":
+    # Chạy lại riêng bước precompute (không train lại)
+    with open("artifacts/user_id_map.json", "r", encoding="utf-8") as f:
+        n_users = len(json.load(f)["users"])
+    with open("artifacts/item_id_map.json", "r", encoding="utf-8") as f:
+        n_items = len(json.load(f)["items"])
+    data = np.load("artifacts/als_model.npz")
+    U, V = data["user_factors"], data["item_factors"]
+    if U.shape[0] == n_items and V.shape[0] == n_users:
+        U, V = V, U
+    info = build_topk_artifacts(U, V)
+    print(f"[INFO] Saved top-K tables: {info}")
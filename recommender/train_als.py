@@ -1,42 +1,297 @@
-# train_als.py
-import os
+# train_als.py — ALS (implicit) trên artifacts/interactions/ → factors, top-K, IVF + train_meta.json
+# Ví dụ:
+#   python train_als.py                                          # như trước: 15 iterations, alpha 15, reg 0.02
+#   python train_als.py --threads 8 --iterations 40 --early-stop loss --tol 1e-3
+#   python train_als.py --early-stop val --val-frac 0.05 --patience 3 --iterations 50
+#   python train_als.py --dtype float64                          # factors float64 (confidence luôn float32)
+#   python train_als.py --shards 4                               # + artifacts/shards/ cho shard_router.py
+import os, json, time, argparse, datetime
+from typing import Optional
+
 import numpy as np
-import pandas as pd
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
 from implicit.als import AlternatingLeastSquares
 
-path = "artifacts/interactions.csv"
-if not os.path.exists(path):
-    raise FileNotFoundError(f"Missing {path}. Run export_interactions.py first.")
-
-df = pd.read_csv(path)
-print(f"[INFO] Loaded {len(df)} interactions")
-num_users = df["user_idx"].nunique()
-num_items = df["item_idx"].nunique()
-print(f"[INFO] Users={num_users} Items={num_items}")
-
-user_ids = df["user_idx"].astype(int).values
-item_ids = df["item_idx"].astype(int).values
-scores   = df["score"].astype(float).values
-
-X = coo_matrix((scores, (user_ids, item_ids)))  # (items, users)
-
-factors = min(32, max(8, min(num_users, num_items) - 1))
-model = AlternatingLeastSquares(
-    factors=factors,
-    regularization=0.02,
-    iterations=15,
-    random_state=42
-)
-
-confidence = (X * 15.0).astype("double")
-model.fit(confidence)
-print("[SUCCESS] ALS trained")
-
-os.makedirs("artifacts", exist_ok=True)
-np.savez(
-    "artifacts/als_model.npz",
-    user_factors=model.user_factors,
-    item_factors=model.item_factors
-)
-print("[INFO] Saved artifacts/als_model.npz")
+from interactions_io import has_interactions, load_interactions, to_csr
+from topk_table import build_topk_artifacts
+from similarity_index import build_ivf_artifact
+from model_registry import save_mmap_artifacts
+from sharding import split_artifacts, SHARD_VNODES
+
+TRAIN_META_PATH = "artifacts/train_meta.json"
+
+
+def confidence_data(score: np.ndarray, alpha: float, chunk: int = 1 << 22) -> np.ndarray:
+    """alpha × score → float32 từng đoạn (score có thể là mmap): chỉ một mảng float32 kích thước nnz."""
+    out = np.empty(score.shape[0], dtype=np.float32)
+    for s in range(0, out.shape[0], chunk):
+        np.multiply(score[s:s + chunk], alpha, out=out[s:s + chunk], casting="unsafe")
+    return out
+
+
+def load_confidence(alpha: float, chunk: int):
+    """Ma trận confidence C = alpha × score (users, items), float32 — implicit nhận trực tiếp, không copy thêm."""
+    with open("artifacts/user_id_map.json", "r", encoding="utf-8") as f:
+        id_users = json.load(f)["users"]
+    with open("artifacts/item_id_map.json", "r", encoding="utf-8") as f:
+        id_items = json.load(f)["items"]
+
+    # shape theo id maps: export --incremental có thể giữ user/item không còn tương tác
+    if has_interactions("artifacts"):
+        # artifacts/interactions/*.npy: mmap, đã sort theo (user, item) → CSR không qua pandas
+        cols = load_interactions("artifacts")
+        user_ids, item_ids = cols["user_idx"], cols["item_idx"]
+        # solver Cython của implicit cần buffer ghi được → indices copy (int32), data là bản confidence mới
+        C = to_csr(user_ids, np.array(item_ids, dtype=np.int32), confidence_data(cols["score"], alpha, chunk),
+                   len(id_users), len(id_items))
+        print(f"[INFO] Loaded {C.nnz} interactions (artifacts/interactions/)")
+    else:
+        import pandas as pd
+        path = "artifacts/interactions.csv"
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing artifacts/interactions/ or {path}. Run export_interactions.py first.")
+        df = pd.read_csv(path)
+        print(f"[INFO] Loaded {len(df)} interactions ({path})")
+        user_ids = df["user_idx"].astype(int).values
+        item_ids = df["item_idx"].astype(int).values
+        scores   = df["score"].astype(np.float32).values
+        C = coo_matrix((scores, (user_ids, item_ids)), shape=(len(id_users), len(id_items))).tocsr()
+        C.data *= np.float32(alpha)  # in-place, không tạo bản scaled
+    return C, id_users, id_items, user_ids, item_ids
+
+
+def split_validation(C: csr_matrix, frac: float, seed: int, min_items: int = 2):
+    """Giữ lại ~frac tương tác của mỗi user có >= min_items → (train, val) cùng shape."""
+    rng = np.random.default_rng(seed)
+    counts = np.diff(C.indptr)
+    rows = np.repeat(np.arange(C.shape[0]), counts)
+    held = (rng.random(C.nnz) < frac) & (counts[rows] >= min_items)
+
+    def _sub(mask):
+        indptr = np.zeros(C.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[mask], minlength=C.shape[0]), out=indptr[1:])
+        return csr_matrix((C.data[mask], C.indices[mask], indptr), shape=C.shape)
+
+    return _sub(~held), _sub(held)
+
+
+def val_recall(U: np.ndarray, V: np.ndarray, train: csr_matrix, val: csr_matrix, users: np.ndarray,
+               k: int) -> float:
+    """recall@k trên item giữ lại; item đã có trong train bị loại khỏi ranking."""
+    from evaluate_als import ranking_metrics
+    return ranking_metrics(U, V, train, val, users, (k,))[f"recall@{k}"]
+
+
+def default_factors(num_users: int, num_items: int) -> int:
+    return min(32, max(8, min(num_users, num_items) - 1))
+
+
+def fit_als(model: AlternatingLeastSquares, C: csr_matrix, iterations: int, seed: int, threads: int,
+            track_loss: bool = False, on_iter=None):
+    """
+    Vòng lặp ALS của implicit (cùng solver, cùng khởi tạo) nhưng gọi on_iter sau mỗi iteration
+    để theo dõi loss / validation và dừng sớm. on_iter(it, sec, loss) → True = dừng.
+    """
+    from implicit.utils import check_random_state
+    rng = check_random_state(seed)
+    Ciu = C.T.tocsr()
+    model.user_factors = rng.random((C.shape[0], model.factors), dtype=model.dtype) * 0.01
+    model.item_factors = rng.random((C.shape[1], model.factors), dtype=model.dtype) * 0.01
+    loss_fn = None
+    if track_loss:
+        from implicit.cpu import _als
+        loss_fn = _als.calculate_loss
+
+    for it in range(1, iterations + 1):
+        t = time.perf_counter()
+        model.solver(C, model.user_factors, model.item_factors, model.regularization, num_threads=threads)
+        model.solver(Ciu, model.item_factors, model.user_factors, model.regularization, num_threads=threads)
+        sec = time.perf_counter() - t
+        loss = float(loss_fn(C, model.user_factors, model.item_factors, model.regularization,
+                             num_threads=threads)) if loss_fn else None
+        if on_iter is not None and on_iter(it, sec, loss):
+            return it
+    return iterations
+
+
+class EarlyStop:
+    """Theo dõi loss (thấp hơn = tốt) hoặc metric validation (cao hơn = tốt) qua từng iteration."""
+
+    def __init__(self, mode: str, patience: int, tol: float):
+        self.mode, self.patience, self.tol = mode, patience, tol
+        self.best: Optional[float] = None
+        self.best_iter = 0
+        self.bad = 0
+
+    def update(self, it: int, value: Optional[float]) -> bool:
+        if self.mode == "none" or value is None:
+            return False
+        better = self.best is None or (
+            value < self.best * (1 - self.tol) if self.mode == "loss" else value > self.best + self.tol)
+        if better:
+            self.best, self.best_iter, self.bad = value, it, 0
+            return False
+        self.bad += 1
+        return self.bad >= self.patience
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Train ALS on artifacts/interactions and write serving artifacts")
+    ap.add_argument("--factors", type=int, default=int(os.getenv("ALS_FACTORS", "0")), help="0 = heuristic cũ")
+    ap.add_argument("--iterations", type=int, default=int(os.getenv("ALS_ITERATIONS", "15")))
+    ap.add_argument("--regularization", type=float, default=float(os.getenv("ALS_REG", "0.02")))
+    ap.add_argument("--alpha", type=float, default=float(os.getenv("ALS_ALPHA", "15.0")), help="confidence = alpha × score")
+    ap.add_argument("--threads", type=int, default=int(os.getenv("ALS_THREADS", "0")), help="0 = tất cả core")
+    ap.add_argument("--dtype", choices=["float32", "float64"], default=os.getenv("ALS_DTYPE", "float32"),
+                    help="kiểu của factors (confidence luôn float32 như solver của implicit)")
+    ap.add_argument("--cg", dest="use_cg", action="store_true", default=True, help="conjugate gradient solver (mặc định)")
+    ap.add_argument("--cholesky", dest="use_cg", action="store_false", help="giải chính xác (chậm hơn)")
+    ap.add_argument("--early-stop", choices=["none", "loss", "val"], default=os.getenv("ALS_EARLY_STOP", "none"))
+    ap.add_argument("--patience", type=int, default=2)
+    ap.add_argument("--tol", type=float, default=1e-3, help="loss: cải thiện tương đối tối thiểu; val: tuyệt đối")
+    ap.add_argument("--track-loss", action="store_true", help="tính loss mỗi iteration kể cả khi không early stop")
+    ap.add_argument("--val-frac", type=float, default=0.05)
+    ap.add_argument("--val-users", type=int, default=2000, help="số user tối đa dùng để tính recall@k")
+    ap.add_argument("--val-k", type=int, default=20)
+    ap.add_argument("--no-refit", action="store_true", help="--early-stop val: giữ factors của tập train thay vì train lại trên toàn bộ")
+    ap.add_argument("--chunk", type=int, default=1 << 22, help="số phần tử mỗi đoạn khi dựng confidence")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--shards", type=int, default=int(os.getenv("ALS_SHARDS", "0")),
+                    help=">0 = chia user thành N shard (artifacts/shards/, xem sharding.py)")
+    args = ap.parse_args(argv)
+
+    timings = {}
+    t0 = time.perf_counter()
+    C, id_users, id_items, user_ids, item_ids = load_confidence(args.alpha, args.chunk)
+    timings["load_sec"] = round(time.perf_counter() - t0, 3)
+
+    num_users = np.unique(user_ids).shape[0]
+    num_items = np.unique(item_ids).shape[0]
+    print(f"[INFO] Users={num_users} Items={num_items}")
+
+    factors = args.factors or default_factors(num_users, num_items)
+    threads = args.threads
+
+    def new_model():
+        return AlternatingLeastSquares(factors=factors, regularization=args.regularization, alpha=1.0,
+                                       dtype=np.dtype(args.dtype).type, use_cg=args.use_cg,
+                                       iterations=args.iterations, num_threads=threads, random_state=args.seed)
+
+    # BLAS đa luồng tranh core với thread của implicit → giới hạn 1 trong lúc fit (nếu có threadpoolctl)
+    try:
+        from threadpoolctl import threadpool_limits
+        blas_limit = threadpool_limits(1, "blas")
+    except ImportError:
+        blas_limit = None
+
+    history = {"iter_sec": [], "loss": [], "val_recall": []}
+    stop = EarlyStop(args.early_stop, args.patience, args.tol)
+    model = new_model()
+    train, val, val_users, best = C, None, None, None
+    if args.early_stop == "val":
+        train, val = split_validation(C, args.val_frac, args.seed)
+        cand = np.flatnonzero(np.diff(val.indptr) > 0)
+        rng = np.random.default_rng(args.seed)
+        val_users = rng.choice(cand, size=min(args.val_users, cand.size), replace=False) if cand.size else cand
+        print(f"[INFO] validation: {val.nnz} held-out interactions, {val_users.size} users, recall@{args.val_k}")
+
+    def on_iter(it, sec, loss):
+        history["iter_sec"].append(round(sec, 4))
+        history["loss"].append(loss)
+        value, msg = loss, f"loss={loss:.6f}" if loss is not None else ""
+        if val is not None and val_users.size:
+            value = val_recall(model.user_factors, model.item_factors, train, val, val_users, args.val_k)
+            history["val_recall"].append(round(value, 5))
+            msg = (msg + f" recall@{args.val_k}={value:.4f}").strip()
+        print(f"[INFO] iter {it:3d}/{args.iterations} {sec:7.3f}s {msg}")
+        done = stop.update(it, value)
+        if val is not None and stop.best_iter == it:
+            nonlocal best
+            best = (np.array(model.user_factors), np.array(model.item_factors))
+        return done
+
+    t = time.perf_counter()
+    ran = fit_als(model, train, args.iterations, args.seed, threads,
+                  track_loss=args.track_loss or args.early_stop == "loss", on_iter=on_iter)
+    timings["fit_sec"] = round(time.perf_counter() - t, 3)
+    stopped_early = ran < args.iterations
+    final_iters = ran
+
+    if args.early_stop == "val" and best is not None:
+        final_iters = stop.best_iter
+        if args.no_refit:
+            model.user_factors, model.item_factors = best
+        else:
+            # số iteration tốt nhất đã biết → train lại trên toàn bộ tương tác (gồm phần validation)
+            print(f"[INFO] refit on all interactions with {final_iters} iterations")
+            t = time.perf_counter()
+            model = new_model()
+            fit_als(model, C, final_iters, args.seed, threads)
+            timings["refit_sec"] = round(time.perf_counter() - t, 3)
+    if blas_limit is not None:
+        blas_limit.restore_original_limits()
+    print(f"[SUCCESS] ALS trained ({ran} iterations{', early stop' if stopped_early else ''}, "
+          f"{timings['fit_sec']:.2f}s)")
+
+    os.makedirs("artifacts", exist_ok=True)
+    t = time.perf_counter()
+    np.savez(
+        "artifacts/als_model.npz",
+        user_factors=model.user_factors,
+        item_factors=model.item_factors
+    )
+    print("[INFO] Saved artifacts/als_model.npz")
+
+    # === mmap format: raw .npy factors + sorted id arrays (dùng chung giữa uvicorn workers) ===
+    Uf, Vf = np.asarray(model.user_factors), np.asarray(model.item_factors)
+    if Uf.shape[0] != C.shape[0] and Vf.shape[0] == C.shape[0]:
+        Uf, Vf = Vf, Uf
+    if Uf.shape[0] == len(id_users) and Vf.shape[0] == len(id_items):
+        save_mmap_artifacts("artifacts", Uf, Vf, id_users, id_items)
+        print("[INFO] Saved artifacts/{user,item}_factors.npy + id arrays")
+    else:
+        print("[WARN] factor/id map size mismatch — skipped mmap artifacts")
+    timings["save_sec"] = round(time.perf_counter() - t, 3)
+
+    # === Post-training: precompute top-K cho serve_api (SERVE_MODE=precomputed) ===
+    if os.getenv("TOPK_PRECOMPUTE", "1") == "1":
+        t = time.perf_counter()
+        info = build_topk_artifacts(Uf, Vf, "artifacts")
+        timings["topk_sec"] = round(time.perf_counter() - t, 3)
+        print(f"[INFO] Saved top-K tables: {info}")
+
+    # === ANN index cho SIM_INDEX=ivf ===
+    if os.getenv("IVF_BUILD", "1") == "1":
+        t = time.perf_counter()
+        info = build_ivf_artifact(Vf, "artifacts")
+        timings["ivf_sec"] = round(time.perf_counter() - t, 3)
+        print(f"[INFO] Saved artifacts/ann_ivf.npz: {info}")
+
+    # === Metadata: tham số + timing + convergence (fold_in.py đọc alpha / regularization từ đây) ===
+    import implicit
+    meta = {
+        "trained_at": datetime.datetime.utcnow().isoformat() + "Z",
+        "implicit": implicit.__version__,
+        "users": len(id_users), "items": len(id_items), "nnz": int(C.nnz),
+        "factors": factors, "regularization": args.regularization, "alpha": args.alpha,
+        "dtype": args.dtype, "solver": "cg" if args.use_cg else "cholesky",
+        "threads": threads, "seed": args.seed,
+        "iterations_max": args.iterations, "iterations_run": ran, "iterations_final": final_iters,
+        "early_stop": args.early_stop, "stopped_early": stopped_early,
+        "best_iteration": stop.best_iter or None, "best_value": stop.best,
+        "history": history,
+        "timings": dict(timings, total_sec=round(time.perf_counter() - t0, 3)),
+    }
+    with open(TRAIN_META_PATH, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"[INFO] Saved {TRAIN_META_PATH}: {meta['timings']}")
+
+    # === Sharded serving: U theo user shard + V đầy đủ, manifest cho shard_router.py ===
+    if args.shards > 0:
+        manifest = split_artifacts("artifacts", args.shards, SHARD_VNODES)
+        print(f"[INFO] Saved artifacts/shards ({len(manifest['shards'])} shards, {manifest['split_sec']}s)")
+    return meta
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# trending.py — Pre-ranked trending lists (tổng + theo category) cho cold start
+# Refresh nền theo lịch; request chỉ đọc snapshot trong RAM (không aggregation, không query DB).
+#   TRENDING_HALF_LIFE_DAYS = 0 : đếm thường trong TRENDING_WINDOW_DAYS (mặc định, như cũ)
+#   TRENDING_HALF_LIFE_DAYS > 0 : opt-in đếm có suy giảm theo thời gian, w = 2^(-age / half_life) (vd. 7)
+#   TRENDING_COLLECTION          : collection materialized (tuỳ chọn) — một worker/cron ghi,
+#                                  các worker khác đọc với TRENDING_SOURCE=collection
+import os, math, time, heapq, datetime, threading
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Set
+
+from pymongo import ReplaceOne
+
+from category_profile import norm_category
+
+TRENDING_REFRESH_SECONDS = float(os.getenv("TRENDING_REFRESH_SECONDS", "300"))
+TRENDING_HALF_LIFE_DAYS  = float(os.getenv("TRENDING_HALF_LIFE_DAYS", "0"))
+TRENDING_WINDOW_DAYS     = int(os.getenv("TRENDING_WINDOW_DAYS", "30"))
+TRENDING_LIMIT           = int(os.getenv("TRENDING_LIMIT", "1000"))
+TRENDING_COLLECTION      = os.getenv("TRENDING_COLLECTION", "")            # "" = không materialize
+TRENDING_SOURCE          = os.getenv("TRENDING_SOURCE", "aggregate")       # "aggregate" | "collection"
+
+
+def trending_pipeline(now: datetime.datetime, window_days: int, half_life_days: float, limit: int) -> List[dict]:
+    since = now - datetime.timedelta(days=window_days)
+    is_series = {"$or": [{"$ne": [{"$ifNull": ["$seasonNumber", None]}, None]},
+                         {"$ne": [{"$ifNull": ["$episodeNumber", None]}, None]}]}
+    if half_life_days > 0:
+        # $subtract(date, date) → ms; exp(-ln2 * age_ms / half_life_ms)
+        k = math.log(2) / (half_life_days * 86400000.0)
+        weight = {"$exp": {"$multiply": [-k, {"$subtract": [now, "$lastActionAt"]}]}}
+    else:
+        weight = 1
+    return [
+        {"$match": {"lastActionAt": {"$gte": since}, "movieId": {"$ne": None}}},
+        {"$group": {"_id": {"m": "$movieId", "s": is_series}, "score": {"$sum": weight}}},
+        {"$sort": {"score": -1}},
+        {"$limit": limit},
+    ]
+
+
+class _Snapshot:
+    def __init__(self, ranked: List[dict], built_at: float, source: str):
+        self.ranked = ranked  # [{"kind", "movieId", "score", **meta}], score giảm dần
+        # bản trả cho client: "score" chỉ dùng nội bộ (xếp hạng, merge, reco_pipeline), không ra response
+        self.public: Dict[int, dict] = {id(it): {k: v for k, v in it.items() if k != "score"} for it in ranked}
+        self.by_category: Dict[str, List[dict]] = {}
+        for it in ranked:
+            self.by_category.setdefault(norm_category(it.get("category")), []).append(it)
+        self.built_at = built_at
+        self.source = source
+
+
+class TrendingService:
+    """
+    refresh() dựng snapshot mới rồi gán tham chiếu (atomic); top() chỉ đọc snapshot.
+    fetch_items: key list → {key: meta} (dùng ItemMetaCache của serve_api).
+    """
+
+    def __init__(self, db, playback_col: str, fetch_items: Callable[[List[str]], Dict[str, dict]],
+                 half_life_days: float = TRENDING_HALF_LIFE_DAYS, window_days: int = TRENDING_WINDOW_DAYS,
+                 limit: int = TRENDING_LIMIT, collection: str = TRENDING_COLLECTION,
+                 source: str = TRENDING_SOURCE):
+        self.db = db
+        self.playback_col = playback_col
+        self.fetch_items = fetch_items
+        self.half_life_days = half_life_days
+        self.window_days = window_days
+        self.limit = limit
+        self.collection = collection
+        self.source = source if collection else "aggregate"
+        self._snap: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.last_error: Optional[str] = None
+        self.last_refresh_sec = 0.0
+
+    # --- build ---
+    def _aggregate(self) -> List[dict]:
+        now = datetime.datetime.utcnow()
+        pipe = trending_pipeline(now, self.window_days, self.half_life_days, self.limit)
+        raw = list(self.db[self.playback_col].aggregate(pipe, allowDiskUse=True))
+        return self._hydrate([(f"{'series' if r['_id'].get('s') else 'movie'}:{r['_id']['m']}", float(r["score"]))
+                              for r in raw if r["_id"].get("m")])
+
+    def _read_collection(self) -> List[dict]:
+        cur = self.db[self.collection].find({}, {"_id": 1, "score": 1}).sort("score", -1).limit(self.limit)
+        return self._hydrate([(d["_id"], float(d["score"])) for d in cur])
+
+    def _hydrate(self, scored) -> List[dict]:
+        """(key, score) → entry với metadata hiện tại (qua fetch_items / cache); bỏ item đã bị xoá."""
+        meta = self.fetch_items([k for k, _ in scored])
+        ranked = []
+        for key, score in scored:
+            md = meta.get(key)
+            if not md:
+                continue
+            kind, _, oid = key.partition(":")
+            ranked.append({"kind": kind, "movieId": oid, **md, "score": score})
+        return ranked
+
+    def _materialize(self, ranked: List[dict]):
+        col = self.db[self.collection]
+        now = datetime.datetime.utcnow()
+        ops = [ReplaceOne({"_id": f"{it['kind']}:{it['movieId']}"},
+                          {"kind": it["kind"], "movieId": it["movieId"], "category": norm_category(it.get("category")),
+                           "score": it["score"], "updatedAt": now}, upsert=True)
+               for it in ranked]
+        if ops:
+            col.bulk_write(ops, ordered=False)
+        col.delete_many({"updatedAt": {"$lt": now}})
+
+    def refresh(self) -> dict:
+        if not self._lock.acquire(blocking=False):
+            return {"status": "in_progress"}
+        try:
+            t0 = time.time()
+            try:
+                if self.source == "collection":
+                    ranked = self._read_collection()
+                else:
+                    ranked = self._aggregate()
+                    if self.collection:
+                        self._materialize(ranked)
+            except Exception as e:
+                self.last_error = str(e)
+                print("[WARN] trending refresh failed:", e)
+                return {"status": "failed", "error": str(e)}
+            self._snap = _Snapshot(ranked, time.time(), self.source)
+            self.refreshes += 1
+            self.last_error = None
+            self.last_refresh_sec = round(time.time() - t0, 3)
+            return {"status": "ok", "items": len(ranked), "sec": self.last_refresh_sec}
+        finally:
+            self._lock.release()
+
+    def run(self, interval: float, stop: threading.Event):
+        def _loop():
+            while not stop.wait(interval):
+                self.refresh()
+        t = threading.Thread(target=_loop, daemon=True, name="trending-refresh")
+        t.start()
+        return t
+
+    # --- serve ---
+    def snapshot(self) -> Optional[_Snapshot]:
+        """
+        Snapshot hiện tại; None khi chưa dựng được (startup refresh lỗi) — request không bao giờ
+        tự refresh (aggregation vài giây), serve_api warm lúc startup + refresh nền.
+        """
+        return self._snap
+
+    def top(self, pref: Optional[Set[str]] = None, n: int = 12) -> List[dict]:
+        """
+        n item trending nhất; pref (category lowercase) → trộn các list theo category
+        đã xếp hạng sẵn (heapq.merge theo score), pref rỗng → list tổng.
+        """
+        snap = self.snapshot()
+        if snap is None:
+            return []
+        if not pref:
+            ranked = snap.ranked[:n]
+        else:
+            lists = [snap.by_category[c] for c in pref if c in snap.by_category]
+            if len(lists) == 1:
+                ranked = lists[0][:n]
+            else:
+                ranked = islice(heapq.merge(*lists, key=lambda it: -it["score"]), n)
+        return [snap.public[id(it)] for it in ranked]
+
+    def stats(self) -> dict:
+        snap = self._snap
+        return {
+            "items": len(snap.ranked) if snap else 0,
+            "categories": len(snap.by_category) if snap else 0,
+            "built_at": snap.built_at if snap else None,
+            "source": self.source,
+            "half_life_days": self.half_life_days,
+            "window_days": self.window_days,
+            "refreshes": self.refreshes,
+            "last_refresh_sec": self.last_refresh_sec,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == "__main__":
+    # Cron: aggregate + ghi TRENDING_COLLECTION cho các API worker đọc (TRENDING_SOURCE=collection)
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+    from bson import ObjectId
+
+    load_dotenv()
+    _db = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))[os.getenv("DB_NAME", "Movie-web")]
+    if not TRENDING_COLLECTION:
+        raise SystemExit("[ERROR] set TRENDING_COLLECTION to materialize trending lists")
+
+    def _fetch(keys: List[str]) -> Dict[str, dict]:
+        # collection chỉ lưu key/category/score — worker tự lấy metadata qua item cache
+        out: Dict[str, dict] = {}
+        for kind, col in (("movie", os.getenv("MOVIES_COLLECTION", "movies")),
+                          ("series", os.getenv("SERIES_COLLECTION", "series"))):
+            oids = [ObjectId(k.split(":", 1)[1]) for k in keys
+                    if k.startswith(kind + ":") and ObjectId.is_valid(k.split(":", 1)[1])]
+            for d in _db[col].find({"_id": {"$in": oids}}, {"category": 1}):
+                out[f"{kind}:{d['_id']}"] = {"category": d.get("category") or ""}
+        return out
+
+    svc = TrendingService(_db, os.getenv("WATCH_COLLECTION", "playback_state"), _fetch, source="aggregate")
+    print("[INFO] trending:", svc.refresh())